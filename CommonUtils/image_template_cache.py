@@ -0,0 +1,57 @@
+import hashlib
+import logging
+import os
+
+from PIL import Image
+
+# Decoded, pre-resized background templates shared by the slide generators.
+# Each (path, mtime, size, mode) is decoded and resized once per process and handed out as cheap copies.
+# With a cache_dir the resized pixel buffer is also kept on disk as raw bytes, so other processes and later
+# runs load it with a single read instead of decoding the JPEG/PNG again.
+
+_templates = {}
+
+
+def _template_key(path, size, mode):
+    return os.path.abspath(path), os.path.getmtime(path), tuple(size) if size else None, mode
+
+
+def _raw_cache_path(cache_dir, key, size, mode):
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, f"{digest}_{size[0]}x{size[1]}_{mode}.raw")
+
+
+def _load_template(path, size, mode, key, cache_dir):
+    raw_path = _raw_cache_path(cache_dir, key, size, mode) if cache_dir and size else None
+    if raw_path and os.path.exists(raw_path):
+        with open(raw_path, 'rb') as f:
+            return Image.frombytes(mode, tuple(size), f.read())
+
+    image = Image.open(path).convert(mode)
+    if size and image.size != tuple(size):
+        image = image.resize(tuple(size))
+
+    if raw_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write under a temporary name first so parallel workers never read a half-written buffer
+        temp_path = f"{raw_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(image.tobytes())
+        os.replace(temp_path, raw_path)
+    logging.info(f"Decoded template {path} at {image.size}")
+    return image
+
+
+# Return a private copy of the background template at the given size (None keeps the original size)
+def get_template(path, size=None, mode="RGB", cache_dir=None):
+    key = _template_key(path, size, mode)
+    template = _templates.get(key)
+    if template is None:
+        template = _load_template(path, size, mode, key, cache_dir)
+        _templates[key] = template
+    return template.copy()
+
+
+# Drop all templates held in memory
+def clear_templates():
+    _templates.clear()
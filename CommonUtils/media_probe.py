@@ -0,0 +1,80 @@
+import json
+import subprocess
+from collections import namedtuple
+
+# ffprobe helpers shared by the slideshow encoder and the video mergers.
+# Everything is read from container and packet metadata, so probing never decodes a frame.
+
+# Duration plus the parameters of the first video and audio stream (None when the stream is missing)
+MediaInfo = namedtuple("MediaInfo", ["duration", "width", "height", "fps", "sample_rate", "channels"])
+
+
+def _ffprobe(args):
+    result = subprocess.run(["ffprobe", "-v", "error", *args], check=True, capture_output=True, text=True)
+    return result.stdout
+
+
+# "30/1" style frame rate to a float (None for the "0/0" ffprobe reports when it does not know)
+def _frame_rate(rate):
+    if not rate:
+        return None
+    num, _, den = rate.partition("/")
+    if not float(den or 1):
+        return None
+    return float(num) / float(den or 1) or None
+
+
+# Duration of an audio or video file in seconds
+def media_duration(path):
+    return float(_ffprobe(["-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1",
+                           path]).strip())
+
+
+# Duration of the first video stream in seconds. The container duration also covers a longer audio track,
+# so this reads the stream duration, or the end of the last video packet where the container (e.g. MKV)
+# does not store one.
+def video_duration(path):
+    duration = _ffprobe(["-select_streams", "v:0", "-show_entries", "stream=duration",
+                         "-of", "default=noprint_wrappers=1:nokey=1", path]).strip()
+    if duration not in ("", "N/A"):
+        return float(duration)
+    end = 0.0
+    output = _ffprobe(["-select_streams", "v:0", "-show_entries", "packet=pts_time,duration_time", "-of", "csv=p=0",
+                       path])
+    for line in output.splitlines():
+        pts_time, _, duration_time = line.partition(",")
+        if pts_time not in ("", "N/A"):
+            end = max(end, float(pts_time) + (float(duration_time) if duration_time not in ("", "N/A") else 0.0))
+    return end
+
+
+# Duration and stream parameters of a media file
+def media_info(path):
+    data = json.loads(_ffprobe([
+        "-show_entries", "format=duration:stream=codec_type,width,height,r_frame_rate,avg_frame_rate,"
+                         "sample_rate,channels",
+        "-of", "json", path]))
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    fps = None
+    if video:
+        fps = _frame_rate(video.get("avg_frame_rate")) or _frame_rate(video.get("r_frame_rate"))
+    return MediaInfo(
+        duration=float(data["format"]["duration"]),
+        width=video["width"] if video else None,
+        height=video["height"] if video else None,
+        fps=fps,
+        sample_rate=int(audio["sample_rate"]) if audio else None,
+        channels=int(audio["channels"]) if audio else None)
+
+
+# Sorted presentation times of the video keyframes, read from the packet flags
+def keyframe_times(path):
+    output = _ffprobe(["-select_streams", "v:0", "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", path])
+    times = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            times.append(float(pts_time))
+    return sorted(times)
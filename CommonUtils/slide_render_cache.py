@@ -0,0 +1,86 @@
+import hashlib
+import json
+import logging
+import os
+
+# Content-addressed render cache for slide images.
+# Every slide gets a key hashing everything its pixels depend on (text, style config, template image hash and
+# renderer version). A manifest in the slide directory maps each slide file to the key it was rendered with,
+# so a rerun only renders slides whose key changed or whose file is missing.
+# Functions accept manifest=None, meaning caching is disabled and every slide is rendered.
+
+MANIFEST_NAME = "render_manifest.json"
+
+_file_hashes = {}
+
+
+# Content hash of a file (template images, fonts), memoized per (path, mtime, size)
+def file_hash(path):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+    if key not in _file_hashes:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        _file_hashes[key] = sha.hexdigest()
+    return _file_hashes[key]
+
+
+# Hash of the JSON-serializable parts a slide depends on
+def slide_key(*parts):
+    data = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+# The config entries that affect how slides look
+def style_from_config(config, keys):
+    return {key: config.get(key) for key in keys}
+
+
+# Load the manifest of a slide directory (empty when missing or unreadable)
+def load_manifest(slide_dir):
+    try:
+        with open(os.path.join(slide_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable render manifest in {slide_dir}: {e}")
+        return {}
+
+
+# Write the manifest atomically so an interrupted run never leaves a half-written file
+def save_manifest(slide_dir, manifest):
+    if manifest is None:
+        return
+    manifest_path = os.path.join(slide_dir, MANIFEST_NAME)
+    temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+# Whether all output files exist and were rendered with this key
+def is_fresh(manifest, output_paths, key):
+    if manifest is None:
+        return False
+    return all(manifest.get(os.path.basename(path)) == key and os.path.exists(path) for path in output_paths)
+
+
+# Remember the key the output files were rendered with
+def record(manifest, output_paths, key):
+    if manifest is None:
+        return
+    for path in output_paths:
+        manifest[os.path.basename(path)] = key
+
+
+# Return output_path untouched if it is up to date for key, otherwise call render() (which must write
+# output_path and return it) and record the key
+def render_cached(manifest, output_path, key, render):
+    if is_fresh(manifest, [output_path], key):
+        return output_path
+    rendered_path = render()
+    record(manifest, [output_path], key)
+    return rendered_path
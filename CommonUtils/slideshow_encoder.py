@@ -0,0 +1,344 @@
+import logging
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+import media_probe
+
+# Still-image slideshow encoder driving ffmpeg directly.
+# Slides go through the concat demuxer as one decoded frame per image plus its duration, ffmpeg repeats that
+# frame up to the output frame rate, and x264 tuned for still images with long GOPs encodes the repeats as
+# near-free skip blocks. No frame is composited in Python, so encoding runs far faster than real time.
+# Slides given as PIL images or arrays (or files ffmpeg cannot concat as they are) never touch the disk: each is
+# converted to RGB once and piped to ffmpeg's rawvideo input, repeated for the frames it stays on screen.
+# Long timelines can also be cut at slide boundaries into segments encoded by parallel ffmpeg processes with
+# identical codec settings and joined by the concat demuxer with -c copy. Segments start on the frame grid of the
+# whole timeline and hold an exact frame count, so the joined video has the same frames as a single pass.
+
+# One slideshow entry: image (file path, PIL image or RGB array) shown for duration seconds, optional audio of
+# its own (padded with silence or cut to the duration) and optional fades from/to black in seconds
+Slide = namedtuple("Slide", ["image", "duration", "audio", "fade_in", "fade_out"], defaults=[None, 0, 0])
+
+# Seconds between keyframes; slides barely change, so long GOPs cost nothing in quality
+KEYFRAME_INTERVAL = 10
+
+# Parallel mode cuts the timeline into this many segments per process so uneven segments balance out
+SEGMENTS_PER_PROCESS = 2
+
+# Common format every audio stream is converted to before concatenating or mixing
+AUDIO_FORMAT = "aresample=44100,aformat=sample_fmts=fltp:channel_layouts=stereo"
+AUDIO_CODEC_ARGS = ["-c:a", "aac", "-b:a", "192k"]
+
+
+# Run ffmpeg, writing the raw frames (an iterable of bytes) to its stdin when given
+def run_ffmpeg(args, frames=None):
+    logging.debug("Running: " + " ".join(args))
+    if frames is None:
+        subprocess.run(args, check=True)
+        return
+    process = subprocess.Popen(args, stdin=subprocess.PIPE)
+    try:
+        for frame in frames:
+            process.stdin.write(frame)
+        process.stdin.close()
+    except BrokenPipeError:
+        # ffmpeg stops reading once -t or -frames:v is reached
+        pass
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        process.wait()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, args)
+
+
+# Quote a path for a concat demuxer list
+def _concat_path(path):
+    return "'{}'".format(os.path.abspath(path).replace("'", "'\\''"))
+
+
+# Concat demuxer list of files, each shown for its duration when durations are given. framerate opens image
+# files at that rate, so slide starts are timestamped on the output frame grid instead of the default 1/25s.
+def write_concat_list(list_path, files, durations=None, framerate=None):
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for index, path in enumerate(files):
+            f.write(f"file {_concat_path(path)}\n")
+            if framerate is not None:
+                f.write(f"option framerate {framerate}\n")
+            if durations is not None:
+                f.write(f"duration {durations[index]:.6f}\n")
+        if durations is not None and files:
+            # The demuxer only honours the duration of the last image when it is followed by another entry
+            f.write(f"file {_concat_path(files[-1])}\n")
+            if framerate is not None:
+                f.write(f"option framerate {framerate}\n")
+
+
+# Size, file format and mode of a slide image given as a path, PIL image or RGB array
+def _image_info(image):
+    if isinstance(image, (str, os.PathLike)):
+        with Image.open(image) as img:
+            return img.size, img.format, img.mode
+    if isinstance(image, Image.Image):
+        return image.size, None, image.mode
+    return (image.shape[1], image.shape[0]), None, "RGB"
+
+
+# Image files for the concat demuxer, or None when the slides are streamed as raw frames, plus the frame size
+# (defaults to the size of the first slide). The demuxer decodes every entry with the decoder picked for the first
+# one and rebuilds the filter graph (dropping frames) whenever the frame size or pixel format changes, so only
+# files of the same size, format and mode are passed through.
+def _slide_files(slides, size):
+    infos = [_image_info(slide.image) for slide in slides]
+    size = tuple(size) if size else infos[0][0]
+    if all(info[0] == size and info[1] is not None and info[1:] == infos[0][1:] for info in infos):
+        return [os.fspath(slide.image) for slide in slides], size
+    return None, size
+
+
+# RGB bytes of one slide image at the given size (letterboxed, like moviepy's compose mode)
+def _slide_frame(image, size):
+    if isinstance(image, (str, os.PathLike)):
+        with Image.open(image) as img:
+            image = img.convert("RGB")
+    elif isinstance(image, Image.Image):
+        image = image.convert("RGB")
+    else:
+        image = Image.fromarray(image).convert("RGB")
+    if image.size != size:
+        image = ImageOps.pad(image, size, color="black")
+    return image.tobytes()
+
+
+# Raw frames of slides shown back to back from start on the local timeline: each slide is converted once
+# and repeated for the frames the fps filter would give it, so streamed and concatenated slides line up
+def _slide_frames(slides, size, fps, start=0):
+    for slide in slides:
+        frame_count = _frame_index(start + slide.duration, fps) - _frame_index(start, fps)
+        start += slide.duration
+        if frame_count <= 0:
+            continue
+        frame = _slide_frame(slide.image, size)
+        for _ in range(frame_count):
+            yield frame
+
+
+# Frame of the timeline at which a slide starting at seconds is first shown (the fps filter rounds to nearest)
+def _frame_index(seconds, fps):
+    return math.floor(seconds * fps + 0.5)
+
+
+# Video filter chain: even dimensions for yuv420p, constant frame rate, per-slide fades (each enabled only on the
+# frames showing its own slide, so the first frame of the next slide is untouched). start is the time of the
+# first slide on the local timeline (a segment's first slide may start up to half a frame before or after its
+# first frame). Fades are counted in whole frames from the first frame a slide is shown and back from the first
+# frame of the next one, so they fall on the same frames however the timeline is cut into segments.
+def _video_filters(slides, fps, start=0):
+    filters = ["scale=trunc(iw/2)*2:trunc(ih/2)*2", "setsar=1", f"fps={fps}"]
+    for slide in slides:
+        shown = _frame_index(start, fps)
+        hidden = _frame_index(start + slide.duration, fps)
+        if slide.fade_in:
+            frames = max(1, round(slide.fade_in * fps))
+            filters.append(f"fade=t=in:s={shown}:n={frames}:enable='between(n,{shown},{hidden - 1})'")
+        if slide.fade_out:
+            frames = max(1, round(slide.fade_out * fps))
+            filters.append(f"fade=t=out:s={max(0, hidden - frames)}:n={frames}:"
+                           f"enable='between(n,{max(shown, hidden - frames)},{hidden - 1})'")
+        start += slide.duration
+    filters.append("format=yuv420p")
+    return ",".join(filters)
+
+
+# Input arguments, filter graph and raw frames (None when ffmpeg reads files) turning slides shown back to back
+# into the [vout] stream. images are the slide files, or None to stream the slides at size through stdin.
+# lead is how long before its real start the first slide is already shown: the first frame of a segment sits on
+# the frame grid of the whole timeline, and the later slide boundaries stay where they are on that grid.
+def _video_graph(slides, images, fps, list_path, size, lead=0):
+    graph = [f"[0:v]{_video_filters(slides, fps, start=lead)}[vout]"]
+    if images is None:
+        input_args = ["-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}", "-framerate", str(fps),
+                      "-i", "-"]
+        return input_args, graph, _slide_frames(slides, size, fps, start=lead)
+    durations = [slide.duration for slide in slides]
+    durations[0] += lead
+    if len(slides) == 1:
+        input_args = ["-loop", "1", "-framerate", str(fps), "-t", f"{durations[0]:.6f}", "-i", images[0]]
+    else:
+        write_concat_list(list_path, images, durations, framerate=fps)
+        input_args = ["-f", "concat", "-safe", "0", "-i", list_path]
+    return input_args, graph, None
+
+
+# Input arguments, filter graph and output label of the audio track (label None when there is no audio).
+# Per-slide audio and the background track are mixed; inputs are numbered from first_input.
+def _audio_graph(slides, total_duration, first_input, audio=None, volume=1.0, fade_in=0, fade_out=0,
+                 loop=True):
+    input_args, graph, labels = [], [], []
+    input_count = first_input
+
+    if any(slide.audio for slide in slides):
+        segments = []
+        for index, slide in enumerate(slides):
+            if slide.audio:
+                input_args += ["-i", slide.audio]
+                source = f"[{input_count}:a]{AUDIO_FORMAT},apad"
+                input_count += 1
+            else:
+                source = f"anullsrc=r=44100:cl=stereo,{AUDIO_FORMAT}"
+            graph.append(f"{source},atrim=duration={slide.duration:.3f},asetpts=PTS-STARTPTS[s{index}]")
+            segments.append(f"[s{index}]")
+        graph.append(f"{''.join(segments)}concat=n={len(segments)}:v=0:a=1[slide_audio]")
+        labels.append("[slide_audio]")
+
+    if audio:
+        tracks = [audio] if isinstance(audio, (str, os.PathLike)) else list(audio)
+        if len(tracks) == 1:
+            loop_args = ["-stream_loop", "-1"] if loop else []
+            input_args += loop_args + ["-i", os.fspath(tracks[0])]
+            chain = f"[{input_count}:a]{AUDIO_FORMAT},"
+        else:
+            if loop:
+                # A playlist cannot be looped with -stream_loop, so repeat it until it covers the video
+                playlist_duration = sum(media_probe.media_duration(track) for track in tracks)
+                tracks = tracks * max(1, math.ceil(total_duration / playlist_duration))
+            # Tracks may differ in sample rate and channels, so each is converted before the concat filter
+            for index, track in enumerate(tracks):
+                input_args += ["-i", os.fspath(track)]
+                graph.append(f"[{input_count + index}:a]{AUDIO_FORMAT}[t{index}]")
+            graph.append("".join(f"[t{index}]" for index in range(len(tracks))) +
+                         f"concat=n={len(tracks)}:v=0:a=1[playlist]")
+            chain = "[playlist]"
+        chain += f"atrim=duration={total_duration:.3f}"
+        if volume != 1.0:
+            chain += f",volume={volume}"
+        if fade_in:
+            chain += f",afade=t=in:st=0:d={fade_in}"
+        if fade_out:
+            chain += f",afade=t=out:st={max(0, total_duration - fade_out):.3f}:d={fade_out}"
+        graph.append(chain + "[music]")
+        labels.append("[music]")
+
+    if len(labels) == 2:
+        graph.append("[slide_audio][music]amix=inputs=2:duration=first:normalize=0[aout]")
+        labels = ["[aout]"]
+    return input_args, graph, labels[0] if labels else None
+
+
+# x264 settings shared by every encode, so separately encoded segments can be joined without re-encoding
+def _video_codec_args(fps, preset, crf, bitrate, threads=None):
+    args = ["-c:v", "libx264", "-preset", preset, "-tune", "stillimage", "-g", str(fps * KEYFRAME_INTERVAL)]
+    args += ["-b:v", bitrate] if bitrate else ["-crf", str(crf)]
+    if threads:
+        args += ["-threads", str(threads)]
+    return args
+
+
+# Split slides and their image files into at most count runs of consecutive slides of similar total duration.
+# Each slide goes to the segment its midpoint falls in.
+def _split_segments(slides, images, count):
+    target_duration = sum(slide.duration for slide in slides) / count
+    segments = {}
+    start = 0
+    for slide, image in zip(slides, images or [None] * len(slides)):
+        index = min(count - 1, int((start + slide.duration / 2) / target_duration))
+        segments.setdefault(index, []).append((slide, image))
+        start += slide.duration
+    return [segments[index] for index in sorted(segments)]
+
+
+# Encode the slides as independent video segments on parallel ffmpeg processes (the audio track is one more
+# job, since AAC cannot be cut at arbitrary points without gaps), then join everything with -c copy
+def _encode_parallel(slides, images, size, output_path, total_duration, fps, codec_args, music, processes,
+                     work_dir):
+    segment_count = min(len(slides), processes * SEGMENTS_PER_PROCESS)
+    threads = max(1, (os.cpu_count() or 1) // processes)
+    commands, segment_paths = [], []
+    segment_start = 0
+    for index, segment in enumerate(_split_segments(slides, images, segment_count)):
+        segment_slides = [slide for slide, _ in segment]
+        segment_end = segment_start + sum(slide.duration for slide in segment_slides)
+        # The segment covers the frames a single pass would show from its first slide up to the next segment's
+        # first slide, starting lead seconds before the first slide's real start (negative: after it)
+        first_frame, end_frame = _frame_index(segment_start, fps), _frame_index(segment_end, fps)
+        lead = segment_start - first_frame / fps
+        segment_images = None if images is None else [image for _, image in segment]
+        input_args, graph, frames = _video_graph(segment_slides, segment_images, fps,
+                                                 os.path.join(work_dir, f"segment_{index:03d}.txt"), size, lead=lead)
+        segment_path = os.path.join(work_dir, f"segment_{index:03d}.mp4")
+        commands.append((["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *input_args,
+                          "-filter_complex", ";".join(graph), "-map", "[vout]",
+                          *_video_codec_args(fps, *codec_args, threads=threads),
+                          "-frames:v", str(end_frame - first_frame), segment_path], frames))
+        segment_paths.append(segment_path)
+        segment_start = segment_end
+
+    audio_inputs, audio_graph, audio_label = _audio_graph(slides, total_duration, 0, **music)
+    audio_path = os.path.join(work_dir, "audio.m4a")
+    if audio_label:
+        commands.append((["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *audio_inputs,
+                          "-filter_complex", ";".join(audio_graph), "-map", audio_label, *AUDIO_CODEC_ARGS,
+                          "-t", f"{total_duration:.3f}", audio_path], None))
+
+    with ThreadPoolExecutor(max_workers=processes) as executor:
+        list(executor.map(lambda command: run_ffmpeg(*command), commands))
+    logging.info(f"Encoded {len(segment_paths)} segments on {processes} parallel ffmpeg processes")
+
+    segment_list = os.path.join(work_dir, "segments.txt")
+    write_concat_list(segment_list, segment_paths)
+    command = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-f", "concat", "-safe", "0",
+               "-i", segment_list]
+    if audio_label:
+        command += ["-i", audio_path, "-map", "0:v", "-map", "1:a"]
+    command += ["-c", "copy", "-t", f"{total_duration:.3f}", "-movflags", "+faststart", output_path]
+    run_ffmpeg(command)
+
+
+# Encode slides into output_path.
+# audio is a background track (a path or a list of paths played in sequence) looped or cut to the video length,
+# with volume and fades applied; it is mixed with the per-slide audio when both are present.
+# size defaults to the size of the first slide; duration overrides the total length (defaults to the sum of the
+# slide durations). With processes > 1 the timeline is split at slide boundaries into segments encoded in
+# parallel and joined losslessly.
+def encode_slideshow(slides, output_path, fps=24, size=None, audio=None, audio_volume=1.0, audio_fade_in=0,
+                     audio_fade_out=0, loop_audio=True, duration=None, preset="veryfast", crf=23, bitrate=None,
+                     processes=1):
+    slides = [slide if isinstance(slide, Slide) else Slide(*slide) for slide in slides]
+    if not slides:
+        raise ValueError("No slides to encode")
+    total_duration = duration if duration is not None else sum(slide.duration for slide in slides)
+    music = dict(audio=audio, volume=audio_volume, fade_in=audio_fade_in, fade_out=audio_fade_out, loop=loop_audio)
+    start_time = time.time()
+
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="slideshow_", dir=output_dir)
+    try:
+        images, size = _slide_files(slides, size)
+        if processes and processes > 1 and len(slides) > 1:
+            _encode_parallel(slides, images, size, output_path, total_duration, fps, (preset, crf, bitrate), music,
+                             processes, work_dir)
+        else:
+            input_args, graph, frames = _video_graph(slides, images, fps, os.path.join(work_dir, "slides.txt"), size)
+            audio_inputs, audio_graph, audio_label = _audio_graph(slides, total_duration, 1, **music)
+            command = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *input_args, *audio_inputs,
+                       "-filter_complex", ";".join(graph + audio_graph), "-map", "[vout]"]
+            if audio_label:
+                command += ["-map", audio_label, *AUDIO_CODEC_ARGS]
+            command += _video_codec_args(fps, preset, crf, bitrate)
+            command += ["-t", f"{total_duration:.3f}", "-movflags", "+faststart", output_path]
+            run_ffmpeg(command, frames)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    logging.info(f"Encoded {len(slides)} slides ({total_duration:.1f}s) into {output_path} "
+                 f"in {time.time() - start_time:.1f}s")
+    return output_path
@@ -0,0 +1,105 @@
+from bisect import bisect_right
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw
+
+from image_template_cache import get_template
+
+# Subtitle frames composited over backgrounds that are resized to the video size once.
+# Text is laid out at the scale of the source image, drawn into a small RGBA strip cut to the ink box of its
+# lines and scaled by the same factor as the background. A frame is the background with only that strip's band
+# alpha-blended, built once per cue and handed out again for every frame until the next cue starts.
+
+# One subtitle on screen: background image, text and how many seconds it stays
+Cue = namedtuple("Cue", ["image_path", "text", "duration"])
+
+# Transparent border kept around the ink box so the resampling kernel sees the glyph edges fade out
+STRIP_MARGIN = 8
+
+# Blend arrays kept for repeated subtitle texts
+STRIP_CACHE_SIZE = 256
+
+
+# Alpha-premultiplied color and inverse alpha (float32) of a text strip, and its top-left corner in the video
+# frame. lines are LineBoxes laid out in a source_size image; the strip is scaled into a video_size frame.
+def text_strip(lines, font, fill, source_size, video_size):
+    measure = ImageDraw.Draw(Image.new("L", (1, 1)))
+    boxes = [measure.textbbox((line.x, line.y), line.text, font=font) for line in lines]
+    left = int(np.floor(min(box[0] for box in boxes))) - STRIP_MARGIN
+    top = int(np.floor(min(box[1] for box in boxes))) - STRIP_MARGIN
+    right = int(np.ceil(max(box[2] for box in boxes))) + STRIP_MARGIN
+    bottom = int(np.ceil(max(box[3] for box in boxes))) + STRIP_MARGIN
+
+    # Coverage mask of the lines, turned into a solid-color strip with that mask as alpha
+    mask = Image.new("L", (right - left, bottom - top), 0)
+    draw = ImageDraw.Draw(mask)
+    for line in lines:
+        draw.text((line.x - left, line.y - top), line.text, font=font, fill=255)
+    strip = Image.new("RGBA", mask.size, ImageColor.getrgb(fill)[:3] + (0,))
+    strip.putalpha(mask)
+
+    # Scale the part of the strip that lands on whole video pixels, sampled from exactly the source area the
+    # background resize maps onto them, so the text sits where it would on a resized full image
+    scale_x = video_size[0] / source_size[0]
+    scale_y = video_size[1] / source_size[1]
+    x0, y0 = int(np.ceil(left * scale_x)), int(np.ceil(top * scale_y))
+    x1, y1 = int(np.floor(right * scale_x)), int(np.floor(bottom * scale_y))
+    if (scale_x, scale_y) != (1, 1):
+        source_box = (x0 / scale_x - left, y0 / scale_y - top, x1 / scale_x - left, y1 / scale_y - top)
+        strip = strip.resize((x1 - x0, y1 - y0), Image.LANCZOS, box=source_box)
+
+    pixels = np.asarray(strip, dtype=np.float32)
+    alpha = pixels[..., 3:] / 255.0
+    return pixels[..., :3] * alpha, 1.0 - alpha, x0, y0
+
+
+# Build make_frame(t) for a run of cues shown back to back in a video_size video, plus the total duration.
+# layout(text, source_size) returns the LineBoxes of a subtitle in its source image; font and fill are what the
+# lines are drawn with. Times past the last cue keep showing it.
+def subtitle_frame_maker(cues, video_size, layout, font, fill="white"):
+    width, height = video_size
+    starts = list(np.cumsum([0.0] + [cue.duration for cue in cues[:-1]]))
+    total_duration = float(sum(cue.duration for cue in cues))
+    backgrounds = {}
+
+    # Background resized to the video size plus the size of the source image the text is laid out in
+    def background(image_path):
+        if image_path not in backgrounds:
+            with Image.open(image_path) as image:
+                source_size = image.size
+            backgrounds[image_path] = (np.asarray(get_template(image_path, video_size)), source_size)
+        return backgrounds[image_path]
+
+    @lru_cache(maxsize=STRIP_CACHE_SIZE)
+    def strip(image_path, text):
+        lines = [line for line in layout(text, background(image_path)[1]) if line.text]
+        if not lines:
+            return None
+        return text_strip(lines, font, fill, background(image_path)[1], video_size)
+
+    current = {"cue": None, "frame": None}
+
+    def make_frame(t):
+        index = min(max(bisect_right(starts, t) - 1, 0), len(cues) - 1)
+        if index == current["cue"]:
+            return current["frame"]
+
+        cue = cues[index]
+        frame = background(cue.image_path)[0].copy()
+        blend = strip(cue.image_path, cue.text)
+        if blend is not None:
+            color, inverse_alpha, x, y = blend
+            # Only the band under the strip is touched, clipped to the frame
+            left, top = max(x, 0), max(y, 0)
+            right = min(x + color.shape[1], width)
+            bottom = min(y + color.shape[0], height)
+            if right > left and bottom > top:
+                region = (slice(top - y, bottom - y), slice(left - x, right - x))
+                band = frame[top:bottom, left:right]
+                frame[top:bottom, left:right] = band * inverse_alpha[region] + color[region] + 0.5
+        current["cue"], current["frame"] = index, frame
+        return frame
+
+    return make_frame, total_duration
@@ -0,0 +1,142 @@
+from collections import namedtuple
+from functools import lru_cache
+
+from PIL import ImageFont
+
+# Pixel-width text layout shared by the slide, subtitle and story renderers.
+# Word advances are measured once per (font, size, word) and cached, lines are broken by summing the cached
+# widths, and the result is a list of line boxes ready to pass to ImageDraw.text.
+
+# One laid-out line: text plus its top-left position and size in pixels
+LineBox = namedtuple("LineBox", ["text", "x", "y", "width", "height"])
+
+# Smallest size auto-fit goes down to before letting text overflow
+MIN_FONT_SIZE = 16
+
+# Fonts seen by the layout engine, keyed like the measurement cache
+_fonts = {}
+
+
+# Process-wide font registry: each (font path, size) is loaded once and shared by every renderer
+@lru_cache(maxsize=None)
+def load_font(font_path, size):
+    return ImageFont.truetype(font_path, size)
+
+
+# Cache key of a font: its file and size, so reloaded copies of the same font share measurements
+def font_key(font):
+    path = getattr(font, "path", None)
+    if not isinstance(path, str):
+        # Default bitmap fonts and fonts loaded from file objects have no usable path
+        return id(font), getattr(font, "size", None)
+    return path, font.size
+
+
+@lru_cache(maxsize=65536)
+def _measure(font_id, size, text):
+    return _fonts[(font_id, size)].getlength(text)
+
+
+# Advance width of a word or line in pixels
+def text_width(font, text):
+    key = font_key(font)
+    if key not in _fonts:
+        _fonts[key] = font
+    return _measure(key[0], key[1], text)
+
+
+@lru_cache(maxsize=1024)
+def _line_height(font_id, size):
+    bbox = _fonts[(font_id, size)].getbbox("Ay")
+    return bbox[3] - bbox[1]
+
+
+# Height of a line of text (ascender to descender of "Ay")
+def line_height(font):
+    key = font_key(font)
+    if key not in _fonts:
+        _fonts[key] = font
+    return _line_height(*key)
+
+
+# Break text into (line, width) pairs no wider than max_width; explicit newlines start a new line.
+# A single word wider than max_width gets a line of its own.
+def break_lines(text, font, max_width):
+    space_width = text_width(font, " ")
+    lines = []
+    for paragraph in text.split('\n'):
+        line_words, line_width = [], 0
+        for word in paragraph.split():
+            word_width = text_width(font, word)
+            if line_words and line_width + space_width + word_width > max_width:
+                lines.append((' '.join(line_words), line_width))
+                line_words, line_width = [], 0
+            line_width += word_width + (space_width if line_words else 0)
+            line_words.append(word)
+        if line_words:
+            lines.append((' '.join(line_words), line_width))
+    return lines
+
+
+# Lay out text in a column starting at (x, y) and return its LineBoxes.
+# line_step is the distance between line tops (defaults to the font's line height);
+# align "center" centers each line within max_width, and a box_height centers the block vertically in it.
+def layout_lines(text, font, max_width, x=0, y=0, line_step=None, align="left", box_height=None):
+    height = line_height(font)
+    if line_step is None:
+        line_step = height
+    lines = break_lines(text, font, max_width)
+    if box_height is not None:
+        y += (box_height - len(lines) * line_step) // 2
+    boxes = []
+    for line, width in lines:
+        line_x = x + (max_width - width) // 2 if align == "center" else x
+        boxes.append(LineBox(line, int(line_x), y, width, height))
+        y += line_step
+    return boxes
+
+
+# x position of every word in a line box, using the cached word and space widths
+def word_positions(line_box, font):
+    space_width = text_width(font, " ")
+    positions = []
+    x = line_box.x
+    for word in line_box.text.split():
+        positions.append((word, x))
+        x += text_width(font, word) + space_width
+    return positions
+
+
+# Draw laid-out lines
+def draw_lines(draw, line_boxes, font, fill):
+    for box in line_boxes:
+        draw.text((box.x, box.y), box.text, font=font, fill=fill)
+
+
+# Whether text wrapped to box_width fits in box_height with lines line_spacing line heights apart
+def text_fits(text, font, box_width, box_height, line_spacing=1.0):
+    lines = break_lines(text, font, box_width)
+    if any(width > box_width for _, width in lines):
+        return False
+    return len(lines) * int(line_height(font) * line_spacing) <= box_height
+
+
+# Binary search for the largest size in [min_size, max_size] accepted by fits(size); min_size if none is
+def largest_fitting_size(fits, min_size, max_size):
+    best = min_size
+    low, high = min_size, max_size
+    while low <= high:
+        size = (low + high) // 2
+        if fits(size):
+            best, low = size, size + 1
+        else:
+            high = size - 1
+    return best
+
+
+# Largest font (up to max_size) whose wrapped text fits the box
+def fit_font(text, font_path, max_size, box_width, box_height, line_spacing=1.0, min_size=MIN_FONT_SIZE):
+    size = largest_fitting_size(
+        lambda size: text_fits(text, load_font(font_path, size), box_width, box_height, line_spacing),
+        min(min_size, max_size), max_size)
+    return load_font(font_path, size)
@@ -0,0 +1,203 @@
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+# numpy frame renderers for countdown timers (progress bar and circular clock).
+# The canvas is built once with an empty and with a full bar, the digit glyphs are rasterized once into alpha
+# masks, and every seconds label is blended once over both canvases. A frame is then assembled from column slices
+# of those arrays with no per-pixel math, and frames whose bar width and label match the previous frame are reused.
+
+
+def _rgb(color):
+    return np.array(ImageColor.getrgb(color)[:3], dtype=np.uint8)
+
+
+# Alpha mask (float32, 0..1) of every character, rendered at the same baseline so they can be placed side by side
+def _glyph_masks(font, characters):
+    ascent, descent = font.getmetrics()
+    masks = {}
+    for char in characters:
+        width = max(1, int(round(font.getlength(char))))
+        image = Image.new("L", (width, ascent + descent), 0)
+        ImageDraw.Draw(image).text((0, 0), char, font=font, fill=255)
+        masks[char] = np.asarray(image, dtype=np.float32) / 255.0
+    return masks
+
+
+# Alpha mask (height x width x 1) of a label cropped to its ink box, and the top-left corner that centers it on
+# (center_x, center_y), clipped to a frame_width x frame_height frame
+def _label_alpha(glyphs, label, frame_width, frame_height, center_x, center_y):
+    mask = np.hstack([glyphs[char] for char in label])
+    rows = np.flatnonzero(mask.max(axis=1))
+    cols = np.flatnonzero(mask.max(axis=0))
+    if rows.size:
+        mask = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    x = int(round(center_x - mask.shape[1] / 2))
+    y = int(round(center_y - mask.shape[0] / 2))
+    left, top = max(0, -x), max(0, -y)
+    right = min(mask.shape[1], frame_width - x)
+    bottom = min(mask.shape[0], frame_height - y)
+    return mask[top:bottom, left:right, None], x + left, y + top
+
+
+# Seconds label of a countdown moment: "7" or "00:07"
+def countdown_label(time_left, show_seconds_only=True):
+    seconds = int(max(0, time_left))
+    if show_seconds_only:
+        return f"{seconds}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+# Build make_frame(t) for a width x height countdown timer running for duration seconds.
+# The bar spans bar_height_ratio of the height (centered) on canvas_color (defaults to background_color), and
+# the label's ink box is centered on text_center, given as fractions of the frame width and height.
+def timer_frame_maker(width, height, duration, background_color, foreground_color, digit_color, font_path,
+                      font_size, canvas_color=None, bar_height_ratio=0.9, text_center=(0.5, 0.5),
+                      show_seconds_only=True):
+    bar_height = int(round(height * bar_height_ratio))
+    bar_top = (height - bar_height) // 2
+    bar_bottom = bar_top + bar_height
+
+    canvas = np.empty((height, width, 3), dtype=np.uint8)
+    canvas[:] = _rgb(canvas_color or background_color)
+    canvas[bar_top:bar_bottom] = _rgb(background_color)
+    # The same canvas with the bar completely filled; a frame takes its first columns from here
+    filled = canvas.copy()
+    filled[bar_top:bar_bottom] = _rgb(foreground_color)
+    digit = _rgb(digit_color).astype(np.float32)
+
+    font = ImageFont.truetype(font_path, int(round(font_size)))
+    glyphs = _glyph_masks(font, "0123456789:")
+    labels = {}
+
+    # A label blended once over the empty and over the filled canvas
+    def label_patches(label):
+        if label not in labels:
+            alpha, x, y = _label_alpha(glyphs, label, width, height, width * text_center[0], height * text_center[1])
+            box = (slice(y, y + alpha.shape[0]), slice(x, x + alpha.shape[1]))
+            patches = [(base[box] * (1.0 - alpha) + digit * alpha).astype(np.uint8) for base in (canvas, filled)]
+            labels[label] = (patches[0], patches[1], x, y)
+        return labels[label]
+
+    last = {"key": None, "frame": None}
+
+    def make_frame(t):
+        progress = min(max(t / duration, 0.0), 1.0) if duration else 1.0
+        fill = int(round(width * progress))
+        label = countdown_label(duration - t, show_seconds_only)
+        key = (fill, label)
+        if key == last["key"]:
+            return last["frame"]
+
+        # Whole-column slice copies only: filled part, empty part, then the label patch split the same way
+        frame = np.empty_like(canvas)
+        frame[:, :fill] = filled[:, :fill]
+        frame[:, fill:] = canvas[:, fill:]
+        empty_patch, filled_patch, x, y = label_patches(label)
+        patch_height, patch_width = empty_patch.shape[:2]
+        if patch_width and patch_height:
+            split = min(max(fill - x, 0), patch_width)
+            frame[y:y + patch_height, x:x + split] = filled_patch[:, :split]
+            frame[y:y + patch_height, x + split:x + patch_width] = empty_patch[:, split:]
+        last["key"], last["frame"] = key, frame
+        return frame
+
+    return make_frame
+
+
+# Geometry of the clock face in a size x size frame, computed once per size: the circle (same placement as a
+# default matplotlib polar axes) and, for the pixels inside it, their flat indices sorted by angle. The angle is
+# measured counterclockwise from 3 o'clock in [0, 2pi), so the pixels covered by the remaining fraction are
+# exactly a prefix of that order.
+@lru_cache(maxsize=None)
+def _clock_geometry(size):
+    center_x, center_y = 0.5125 * size, 0.505 * size
+    radius = 0.385 * size
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32)
+    dx, dy = xx + 0.5 - center_x, yy + 0.5 - center_y
+    distance = np.hypot(dx, dy)
+    angle = np.mod(np.arctan2(-dy, dx), 2 * np.pi).astype(np.float32)
+    # Everything the antialiased disc edge touches, so partly covered pixels unwind too
+    inside = np.flatnonzero(distance.ravel() < radius + 0.5)
+    order = np.argsort(angle.ravel()[inside], kind="stable")
+    return {
+        "center": (center_x, center_y),
+        "radius": radius,
+        "distance": distance,
+        "angle": angle,
+        "pixels": inside[order],
+        "pixel_angles": angle.ravel()[inside][order],
+    }
+
+
+# Build make_frame(t) for a size x size circular countdown: a disc in foreground_color that unwinds clockwise to
+# background_color, outlined on canvas_color, with the seconds label in its center.
+# The disc colors are painted once into two full canvases; a frame is the face buffer with the pixels whose
+# angle left the remaining fraction copied over from the background canvas (a slice of the angle-sorted LUT),
+# plus the label patch picked per pixel from the label pre-blended over either disc color.
+def clock_frame_maker(size, duration, background_color, foreground_color, digit_color, font_path, font_size,
+                      canvas_color="white", outline_color="black", outline_width=3):
+    geometry = _clock_geometry(size)
+    distance, radius = geometry["distance"], geometry["radius"]
+    pixels, pixel_angles = geometry["pixels"], geometry["pixel_angles"]
+
+    # Antialiased disc coverage and outline ring
+    disc = np.clip(radius - distance + 0.5, 0.0, 1.0)[..., None]
+    ring = np.clip(outline_width / 2 - np.abs(distance - radius) + 0.5, 0.0, 1.0)[..., None]
+    canvas = _rgb(canvas_color).astype(np.float32)
+    outline = _rgb(outline_color).astype(np.float32)
+
+    def paint(disc_color):
+        image = canvas * (1.0 - disc) + _rgb(disc_color).astype(np.float32) * disc
+        return (image * (1.0 - ring) + outline * ring).astype(np.uint8)
+
+    unwound = paint(background_color)
+    wound = paint(foreground_color)
+    unwound_flat = unwound.reshape(-1, 3)
+    digit = _rgb(digit_color).astype(np.float32)
+
+    font = ImageFont.truetype(font_path, int(round(font_size)))
+    glyphs = _glyph_masks(font, "0123456789:")
+    labels = {}
+
+    # A label pre-blended over both disc states, plus the angles under it to choose between them per frame
+    def label_patches(label):
+        if label not in labels:
+            alpha, x, y = _label_alpha(glyphs, label, size, size, *geometry["center"])
+            box = (slice(y, y + alpha.shape[0]), slice(x, x + alpha.shape[1]))
+            patches = [(base[box] * (1.0 - alpha) + digit * alpha).astype(np.uint8) for base in (wound, unwound)]
+            labels[label] = (patches[0], patches[1], geometry["angle"][box], box)
+        return labels[label]
+
+    # Face buffer and how many angle-sorted pixels are still wound in it, plus the last frame handed out
+    state = {"face": wound.copy(), "wound": len(pixels), "key": None, "frame": None}
+
+    def make_frame(t):
+        remaining = min(max(1.0 - t / duration, 0.0), 1.0) if duration else 0.0
+        threshold = np.float32(remaining * 2 * np.pi)
+        wound_count = int(np.searchsorted(pixel_angles, threshold, side="right"))
+        label = countdown_label(duration * remaining)
+        key = (wound_count, label)
+        if key == state["key"]:
+            return state["frame"]
+
+        face = state["face"].reshape(-1, 3)
+        if wound_count <= state["wound"]:
+            # Moving forward: only the pixels that just unwound change
+            changed = pixels[wound_count:state["wound"]]
+            face[changed] = unwound_flat[changed]
+        else:
+            # Seeking backwards: rebuild the face from the full comparison
+            np.copyto(state["face"], unwound)
+            rewound = pixels[:wound_count]
+            face[rewound] = wound.reshape(-1, 3)[rewound]
+        state["wound"] = wound_count
+
+        frame = state["face"].copy()
+        wound_patch, unwound_patch, angles, box = label_patches(label)
+        frame[box] = np.where((angles <= threshold)[..., None], wound_patch, unwound_patch)
+        state["key"], state["frame"] = key, frame
+        return frame
+
+    return make_frame
@@ -1,12 +1,13 @@
 import json
 import os
-import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
-from matplotlib.font_manager import FontProperties
+import sys
+from matplotlib.font_manager import FontProperties, findfont
 from moviepy.editor import VideoClip, AudioFileClip
 import moviepy.audio.fx.all as afx
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from timer_frames import timer_frame_maker
+
 # === Load configuration ===
 with open('config_pg_bar.json', 'r') as f:
     config = json.load(f)["timer_progress_bar"]
@@ -28,57 +29,20 @@ FADEOUT_DURATION = config.get("FADEOUT_DURATION", 3)
 FPS = config["FPS"]
 OUTPUT_FILE = config["OUTPUT_PATH"]
 
-# === DPI & Video Size in Inches ===
+# === Frame Renderer ===
+# Font sizes were given in points at 300 DPI; glyphs are rasterized in pixels
 DPI = 300
-figsize = (WIDTH / DPI, HEIGHT / DPI)
-
-# === Frame Generator ===
-def make_frame(t):
-    progress = t / TIMER_DURATION
-
-    # Setup figure with custom face color to match background
-    fig = plt.figure(figsize=figsize, dpi=DPI, facecolor=BACKGROUND_COLOR)
-    canvas = FigureCanvas(fig)
-    ax = fig.add_subplot(111)
-    ax.set_facecolor(BACKGROUND_COLOR)
-
-    ax.set_xlim(0, 1)
-    ax.set_ylim(0, 1)
-    ax.set_xticks([])
-    ax.set_yticks([])
-
-    for spine in ax.spines.values():
-        spine.set_visible(False)
-
-    bar_height = BAR_HEIGHT_RATIO
-    ax.barh(0.5, 1, height=bar_height, color=BACKGROUND_COLOR, align='center')
-    ax.barh(0.5, progress, height=bar_height, color=FOREGROUND_COLOR, align='center')
-
-    # font = FontProperties(family=DIGIT_FONT_TYPE, size=DIGIT_FONT_SIZE)
-    scaled_font_size = DIGIT_FONT_SIZE * (HEIGHT / 240)  # Adjust denominator for scaling
-    font = FontProperties(family=DIGIT_FONT_TYPE, size=scaled_font_size)
-    time_left = max(0, TIMER_DURATION - t)
-
-
-    if SHOW_SECONDS_ONLY:
-        time_text = f"{int(time_left)}"
-    else:
-        mins = int(time_left) // 60
-        secs = int(time_left) % 60
-        time_text = f"{mins:02d}:{secs:02d}"
-
-    ax.text(0.5, 0.4, time_text, ha='center', va='center', color=DIGIT_COLOR, fontproperties=font)
-
-    plt.subplots_adjust(left=0, right=1, top=1, bottom=0)
-
-    canvas.draw()
-    renderer = canvas.get_renderer()
-    width, height = canvas.get_width_height()
-    buf = np.frombuffer(renderer.buffer_rgba(), dtype='uint8')
-    img = buf.reshape((height, width, 4))[:, :, :3]  # Drop alpha channel
-
-    plt.close(fig)
-    return img
+font_path = findfont(FontProperties(family=DIGIT_FONT_TYPE))
+font_size = DIGIT_FONT_SIZE * (HEIGHT / 240) * DPI / 72  # Adjust denominator for scaling
+
+make_frame = timer_frame_maker(
+    WIDTH, HEIGHT, TIMER_DURATION,
+    BACKGROUND_COLOR, FOREGROUND_COLOR, DIGIT_COLOR,
+    font_path, font_size,
+    bar_height_ratio=BAR_HEIGHT_RATIO,
+    text_center=(0.5, 0.6),
+    show_seconds_only=SHOW_SECONDS_ONLY,
+)
 
 # === Generate Animation ===
 animation = VideoClip(make_frame, duration=TIMER_DURATION)
@@ -1,9 +1,16 @@
 # 01_generate_slide_images.py
 
 import os
+import sys
 import json
 import csv
-from PIL import Image, ImageDraw, ImageFont
+from PIL import ImageDraw
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from image_template_cache import get_template
+from text_layout import layout_lines, draw_lines, line_height, load_font, fit_font
+from slide_render_cache import (file_hash, slide_key, style_from_config, load_manifest, save_manifest, is_fresh,
+                                record)
 
 # === Load config ===
 with open("config.json", "r", encoding="utf-8") as f:
@@ -15,6 +22,7 @@ FONT_PATH = config["font_path"]
 WIDTH = config["image_width"]
 HEIGHT = config["image_height"]
 OUTPUT_DIR = config["output_dir"]
+TEMPLATE_CACHE_DIR = config.get("template_cache_dir", os.path.join(OUTPUT_DIR, ".template_cache"))
 
 QUESTION_BOX = config["question"]["box"]
 QUESTION_FONT_SIZE = config["question"]["font_size"]
@@ -33,42 +41,35 @@ ANSWER_FONT_SIZE = config["answer"]["font_size"]
 ANSWER_BG = config["answer"]["background_color"]
 ANSWER_COLOR = config["answer"]["text_color"]
 
+# Auto-fit shrinks long questions/choices (from the configured font sizes down to MIN_FONT_SIZE) to fit their boxes
+AUTO_FIT_TEXT = config.get("auto_fit_text", False)
+MIN_FONT_SIZE = config.get("min_font_size", 16)
+TEXT_PADDING = 10
+CHOICE_LABEL_WIDTH = 80
+CHOICE_LABEL_SPACING = 10
+
+# Render cache: slides whose row, style and template are unchanged are not re-rendered.
+# Bump RENDERER_VERSION whenever the drawing code changes.
+RENDERER_VERSION = 1
+RENDER_CACHE = config.get("render_cache", True)
+RENDER_STYLE = style_from_config(config, ["font_path", "image_width", "image_height", "question", "choices", "answer",
+                                          "auto_fit_text", "min_font_size"])
+
 os.makedirs(os.path.join(OUTPUT_DIR, "images"), exist_ok=True)
 
 # === Helper: Draw wrapped text inside a box ===
-def draw_text_box(draw, text, font, box, fill_bg, fill_fg, padding=10, line_spacing=1.0):
+def draw_text_box(draw, text, font, box, fill_bg, fill_fg, padding=TEXT_PADDING, line_spacing=1.0):
     x, y, w, h = box["x"], box["y"], box["w"], box["h"]
     draw.rectangle([x, y, x + w, y + h], fill=fill_bg)
 
-    # Word-wrap logic
-    lines = []
-    words = text.split()
-    line = ""
-
-    for word in words:
-        test_line = f"{line} {word}".strip()
-        bbox = font.getbbox(test_line)
-        line_width = bbox[2] - bbox[0]
-        if line_width + 2 * padding <= w:
-            line = test_line
-        else:
-            lines.append(line)
-            line = word
-    if line:
-        lines.append(line)
-
-    # Line height and vertical spacing
-    line_height = font.getbbox("Ay")[3] - font.getbbox("Ay")[1]
-    line_gap = int(line_height * line_spacing)
-    total_height = len(lines) * line_gap
-    start_y = y + (h - total_height) // 2
-
-    for i, line in enumerate(lines):
-        draw.text((x + padding, start_y + i * line_gap), line, font=font, fill=fill_fg)
+    # Word-wrap by cached word widths, then center the block vertically
+    line_gap = int(line_height(font) * line_spacing)
+    lines = layout_lines(text, font, w - 2 * padding, x + padding, y, line_gap, box_height=h)
+    draw_lines(draw, lines, font, fill_fg)
 
 # === Helper: Draw a choice label and its text ===
-def draw_choice_with_label_box(draw, label, text, font, base_x, base_y, box_w, box_h, label_bg, text_bg, text_fg, spacing=10):
-    label_box_width = 80
+def draw_choice_with_label_box(draw, label, text, font, base_x, base_y, box_w, box_h, label_bg, text_bg, text_fg, spacing=CHOICE_LABEL_SPACING):
+    label_box_width = CHOICE_LABEL_WIDTH
     label_box = [base_x, base_y, base_x + label_box_width, base_y + box_h]
     draw.rectangle(label_box, fill=label_bg)
 
@@ -88,57 +89,93 @@ def draw_choice_with_label_box(draw, label, text, font, base_x, base_y, box_w, b
     }
     draw_text_box(draw, text, font, text_box, fill_bg=text_bg, fill_fg=text_fg)
 
+# === Helper: Largest question and choice fonts that fit their boxes ===
+def fit_slide_fonts(question, option_texts):
+    font_q = fit_font(question, FONT_PATH, QUESTION_FONT_SIZE, QUESTION_BOX["w"] - 2 * TEXT_PADDING, QUESTION_BOX["h"],
+                      line_spacing=1.5, min_size=MIN_FONT_SIZE)
+
+    # All choices share the size of the tightest one so they stay uniform
+    choice_width = CHOICE_BOX["w"] - CHOICE_LABEL_WIDTH - CHOICE_LABEL_SPACING - 2 * TEXT_PADDING
+    choice_size = min((fit_font(text, FONT_PATH, CHOICE_FONT_SIZE, choice_width, CHOICE_BOX["h"],
+                                min_size=MIN_FONT_SIZE).size for text in option_texts), default=CHOICE_FONT_SIZE)
+    return font_q, load_font(FONT_PATH, choice_size)
+
+# === Helper: Render the question and answer images of one CSV row ===
+def render_slide_pair(row, q_path, a_path, font_q, font_c, font_a):
+    # Base image (decoded and resized once, each slide draws on a copy)
+    base = get_template(BG_IMAGE, (WIDTH, HEIGHT), cache_dir=TEMPLATE_CACHE_DIR)
+    draw = ImageDraw.Draw(base)
+
+    if AUTO_FIT_TEXT:
+        option_texts = [row[f"Option {opt}"].split('.', 1)[-1].strip()
+                        for opt in ["A", "B", "C", "D"] if f"Option {opt}" in row]
+        font_q, font_c = fit_slide_fonts(row["Question"], option_texts)
+
+    # Question
+    draw_text_box(draw, row["Question"], font_q, QUESTION_BOX, QUESTION_BG, QUESTION_COLOR, line_spacing=1.5)
+
+    # Choices
+    y = CHOICE_BOX["y_start"]
+    for opt in ["A", "B", "C", "D"]:
+        label = f"Option {opt}"
+        if label in row:
+            option_text = row[label].split('.', 1)[-1].strip()  # Strip "A.", "B." etc.
+            draw_choice_with_label_box(
+                draw,
+                f"[{opt}]",
+                option_text,
+                font_c,
+                CHOICE_BOX["x"],
+                y,
+                CHOICE_BOX["w"],
+                CHOICE_BOX["h"],
+                label_bg=CHOICE_LABEL_BG,
+                text_bg=CHOICE_BG,
+                text_fg=CHOICE_COLOR
+            )
+        y += CHOICE_BOX["h"] + CHOICE_SPACING
+
+    # Save question image
+    base.save(q_path)
+
+    # Answer image
+    base_a = base.copy()
+    draw_a = ImageDraw.Draw(base_a)
+    draw_text_box(draw_a, f"Answer: {row['Answer']}", font_a, ANSWER_BOX, ANSWER_BG, ANSWER_COLOR)
+    base_a.save(a_path)
+
 # === Main Function ===
 def generate_images():
+    # Fonts (loaded once through the shared font registry)
+    font_q = load_font(FONT_PATH, QUESTION_FONT_SIZE)
+    font_c = load_font(FONT_PATH, CHOICE_FONT_SIZE)
+    font_a = load_font(FONT_PATH, ANSWER_FONT_SIZE)
+
+    image_dir = os.path.join(OUTPUT_DIR, "images")
+    manifest = load_manifest(image_dir) if RENDER_CACHE else None
+    template_hash = file_hash(BG_IMAGE)
+    rendered, reused = 0, 0
+
     with open(CSV_PATH, "r", encoding="utf-8") as f:
         reader = csv.DictReader(f, delimiter='|')
 
-        for idx, row in enumerate(reader, 1):
-            # Base image
-            base = Image.open(BG_IMAGE).convert("RGB").resize((WIDTH, HEIGHT))
-            draw = ImageDraw.Draw(base)
-
-            # Fonts
-            font_q = ImageFont.truetype(FONT_PATH, QUESTION_FONT_SIZE)
-            font_c = ImageFont.truetype(FONT_PATH, CHOICE_FONT_SIZE)
-            font_a = ImageFont.truetype(FONT_PATH, ANSWER_FONT_SIZE)
-
-            # Question
-            draw_text_box(draw, row["Question"], font_q, QUESTION_BOX, QUESTION_BG, QUESTION_COLOR, line_spacing=1.5)
-
-            # Choices
-            y = CHOICE_BOX["y_start"]
-            for opt in ["A", "B", "C", "D"]:
-                label = f"Option {opt}"
-                if label in row:
-                    option_text = row[label].split('.', 1)[-1].strip()  # Strip "A.", "B." etc.
-                    draw_choice_with_label_box(
-                        draw,
-                        f"[{opt}]",
-                        option_text,
-                        font_c,
-                        CHOICE_BOX["x"],
-                        y,
-                        CHOICE_BOX["w"],
-                        CHOICE_BOX["h"],
-                        label_bg=CHOICE_LABEL_BG,
-                        text_bg=CHOICE_BG,
-                        text_fg=CHOICE_COLOR
-                    )
-                y += CHOICE_BOX["h"] + CHOICE_SPACING
-
-            # Save question image
-            q_path = os.path.join(OUTPUT_DIR, "images", f"slide_{idx:03d}_q.png")
-            base.save(q_path)
-
-            # Answer image
-            base_a = base.copy()
-            draw_a = ImageDraw.Draw(base_a)
-            draw_text_box(draw_a, f"Answer: {row['Answer']}", font_a, ANSWER_BOX, ANSWER_BG, ANSWER_COLOR)
-            a_path = os.path.join(OUTPUT_DIR, "images", f"slide_{idx:03d}_a.png")
-            base_a.save(a_path)
-
-            print(f"🖼️ Saved slide_{idx:03d}_q.png and slide_{idx:03d}_a.png")
+        try:
+            for idx, row in enumerate(reader, 1):
+                q_path = os.path.join(image_dir, f"slide_{idx:03d}_q.png")
+                a_path = os.path.join(image_dir, f"slide_{idx:03d}_a.png")
+                key = slide_key(RENDERER_VERSION, RENDER_STYLE, template_hash, row)
+                if is_fresh(manifest, [q_path, a_path], key):
+                    reused += 1
+                    continue
+
+                render_slide_pair(row, q_path, a_path, font_q, font_c, font_a)
+                record(manifest, [q_path, a_path], key)
+                rendered += 1
+                print(f"🖼️ Saved slide_{idx:03d}_q.png and slide_{idx:03d}_a.png")
+        finally:
+            save_manifest(image_dir, manifest)
+
+    print(f"✅ Rendered {rendered} slide pairs, reused {reused} unchanged")
 
 if __name__ == "__main__":
     generate_images()
@@ -3,11 +3,27 @@
 import os
 import json
 import subprocess
+import sys
 import wave
 import contextlib
-import shutil
-from PIL import Image, ImageDraw, ImageFont
-import ffmpeg  # pip install ffmpeg-python
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from media_probe import media_info
+
+# A keyframe every second lets 05_merge_videos_with_transition.py stream-copy everything but the
+# transition windows (cut points have to fall on keyframes). Without B-frames decode order equals
+# presentation order, so a body cut before a keyframe never carries frames past the cut.
+KEYFRAME_ARGS = ["-force_key_frames", "expr:gte(t,n_forced)", "-bf", "0"]
+
+# Frame rate of every question and answer clip; 05_merge_videos_with_transition.py can only stream-copy
+# clips that share it
+FPS = 30
+
+# Seconds the question slide stays up after the progress bar finishes
+TAIL_DURATION = 2
+
+# Every audio span is converted to this before the spans are concatenated
+AUDIO_FORMAT = "aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo"
 
 
 def load_config():
@@ -26,88 +42,104 @@ def run_ffmpeg(args):
     subprocess.run(args, check=True)
 
 
-def generate_question_video(slide_img, audio_path, out_video_path, progress_cfg, narration_duration, font_cfg, marker_cfg):
-    frames_dir = "temp_frames"
-    os.makedirs(frames_dir, exist_ok=True)
-
-    pb_x = progress_cfg["x"]
-    pb_y = progress_cfg["y"]
-    pb_w = progress_cfg["width"]
-    pb_h = progress_cfg["height"]
+def video_progress_bar(progress_cfg, narration_duration, input_index):
+    # Pre-rendered timer video from 00_generate_timer_progress_bar.py, scaled to the bar box
     progress_video = os.path.abspath(progress_cfg["video_path"])
-    fps = 30
+    progress = media_info(progress_video)
+    graph = [f"[{input_index}:v]scale={progress_cfg['width']}:{progress_cfg['height']},"
+             f"setpts=PTS-STARTPTS+{narration_duration}/TB[bar]"]
+    if progress.sample_rate:
+        graph.append(f"[{input_index}:a]{AUDIO_FORMAT},apad,atrim=duration={progress.duration:.3f}[bar_audio]")
+    else:
+        graph.append(f"anullsrc=r=44100:cl=stereo,atrim=duration={progress.duration:.3f}[bar_audio]")
+    return ["-i", progress_video], graph, progress.duration
+
+
+def native_progress_bar(progress_cfg, font_path, narration_duration, fps, input_index):
+    # Bar and countdown generated inside the filter graph: a fill strip slides into a background strip by an
+    # overlay x expression of t, and drawtext prints the seconds left, so no timer video is rendered or decoded
+    duration = progress_cfg.get("duration", 5)
+    width = progress_cfg["width"]
+    height = progress_cfg["height"]
+    fill_height = max(1, int(height * progress_cfg.get("bar_height_ratio", 0.9)))
+    font_size = progress_cfg.get("digit_font_size", int(height * 0.8))
+    if progress_cfg.get("show_seconds_only", True):
+        countdown = f"%{{eif\\:{duration}-t\\:d}}"
+    else:
+        countdown = (f"%{{eif\\:({duration}-t)/60\\:d\\:2}}\\:"
+                     f"%{{eif\\:mod({duration}-t\\,60)\\:d\\:2}}")
+    font_file = font_path.replace("\\", "/").replace(":", "\\:")
+
+    graph = [
+        f"color=c={progress_cfg.get('background_color', '#36013f')}:s={width}x{height}:r={fps}:d={duration}[bar_bg]",
+        f"color=c={progress_cfg.get('foreground_color', '#FFFFFF')}:s={width}x{fill_height}:r={fps}:d={duration}"
+        f"[bar_fill]",
+        f"[bar_bg][bar_fill]overlay=x='-w+w*t/{duration}':y=(H-h)/2,"
+        f"drawtext=fontfile='{font_file}':fontsize={font_size}:"
+        f"fontcolor={progress_cfg.get('digit_color', '#0000FF')}:"
+        f"x=(w-text_w)/2:y=(h-text_h)/2:text='{countdown}',"
+        f"setpts=PTS-STARTPTS+{narration_duration}/TB[bar]",
+    ]
+
+    music = progress_cfg.get("music")
+    if music and os.path.exists(music):
+        fade = min(progress_cfg.get("music_fade_out", 3), duration)
+        graph.append(f"[{input_index}:a]{AUDIO_FORMAT},apad,atrim=duration={duration},"
+                     f"volume={progress_cfg.get('music_volume', 0.3)},"
+                     f"afade=t=out:st={duration - fade}:d={fade}[bar_audio]")
+        return ["-i", music], graph, duration
+
+    graph.append(f"anullsrc=r=44100:cl=stereo,atrim=duration={duration}[bar_audio]")
+    return [], graph, duration
 
-    # Save still image without progress bar outline
-    still_img_path = os.path.join(frames_dir, "still.png")
-    base_img = Image.open(slide_img).convert("RGBA")
-    base_img.convert("RGB").save(still_img_path)
 
-    # Narration video
-    narration_video = os.path.join(frames_dir, "narration.mkv")
-    run_ffmpeg([
-        "ffmpeg", "-y",
-        "-loop", "1", "-i", still_img_path,
-        "-i", audio_path,
-        "-t", str(narration_duration), "-r", str(fps),
-        "-c:v", "libx264", "-c:a", "aac", "-pix_fmt", "yuv420p",
-        "-shortest", narration_video
-    ])
-
-    # Progress bar overlay video
-    probe = ffmpeg.probe(progress_video)
-    progress_duration = float(probe["format"]["duration"])
-    overlay_video = os.path.join(frames_dir, "overlay.mkv")
-    run_ffmpeg([
-        "ffmpeg", "-y",
-        "-loop", "1", "-t", str(progress_duration), "-i", still_img_path,
-        "-i", progress_video,
-        "-filter_complex", f"[1:v]scale={pb_w}:{pb_h}[bar];[0:v][bar]overlay={pb_x}:{pb_y}:format=auto",
-        "-pix_fmt", "yuv420p", "-c:v", "libx264", "-c:a", "aac",
-        "-shortest", overlay_video
-    ])
-
-    # Final 2s still frame (same as still image)
-    still2_path = os.path.join(frames_dir, "still2.png")
-    base_img.convert("RGB").save(still2_path)
-    still2_video = os.path.join(frames_dir, "still2.mkv")
-    run_ffmpeg([
-        "ffmpeg", "-y",
-        "-loop", "1", "-i", still2_path,
-        "-t", "2", "-r", str(fps),
-        "-c:v", "libx264", "-pix_fmt", "yuv420p",
-        still2_video
-    ])
-
-    # Concatenate video segments
-    full_video = os.path.join(frames_dir, "full_video.mkv")
-    concat_txt = os.path.join(frames_dir, "concat.txt")
-    with open(concat_txt, "w") as f:
-        f.write(f"file '{os.path.abspath(narration_video)}'\n")
-        f.write(f"file '{os.path.abspath(overlay_video)}'\n")
-        f.write(f"file '{os.path.abspath(still2_video)}'\n")
-
-    run_ffmpeg([
-        "ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", concat_txt,
-        "-c", "copy", full_video
+def generate_question_video(slide_img, audio_path, out_video_path, progress_cfg, narration_duration, font_cfg, marker_cfg):
+    # One ffmpeg pass: the looped slide carries the narration, then the progress bar is overlaid for its
+    # own length (with its audio), then the slide holds silently for TAIL_DURATION seconds.
+    # progress_bar.mode "native" draws the bar in the graph; "video" (default) overlays the timer video.
+    pb_x = progress_cfg["x"]
+    pb_y = progress_cfg["y"]
+    fps = FPS
+
+    if progress_cfg.get("mode", "video") == "native":
+        bar_inputs, bar_graph, bar_duration = native_progress_bar(
+            progress_cfg, font_cfg["path"], narration_duration, fps, 2)
+    else:
+        bar_inputs, bar_graph, bar_duration = video_progress_bar(progress_cfg, narration_duration, 2)
+    total_duration = narration_duration + bar_duration + TAIL_DURATION
+
+    filter_complex = ";".join([
+        # The slide is decoded once and repeated, instead of re-decoding the PNG for every frame
+        f"[0:v]format=yuv420p,loop=loop=-1:size=1,setpts=N/{fps}/TB[slide]",
+        *bar_graph,
+        # The bar starts when the narration ends; outside its span the overlay passes frames through untouched
+        f"[slide][bar]overlay={pb_x}:{pb_y}:eof_action=pass:"
+        f"enable='gte(t,{narration_duration})*lt(t,{narration_duration + bar_duration:.3f})'[video]",
+        f"[1:a]{AUDIO_FORMAT},apad,atrim=duration={narration_duration}[narration]",
+        f"anullsrc=r=44100:cl=stereo,atrim=duration={TAIL_DURATION}[tail]",
+        "[narration][bar_audio][tail]concat=n=3:v=0:a=1[audio]",
     ])
 
-    # Final muxing: narration + visuals (no silence extension)
     run_ffmpeg([
         "ffmpeg", "-y",
-        "-i", full_video, "-i", audio_path,
-        "-c:v", "copy", "-c:a", "aac", "-shortest",
+        "-i", slide_img,
+        "-i", audio_path,
+        *bar_inputs,
+        "-filter_complex", filter_complex,
+        "-map", "[video]", "-map", "[audio]",
+        "-t", f"{total_duration:.3f}", "-r", str(fps),
+        "-c:v", "libx264", "-c:a", "aac", "-pix_fmt", "yuv420p", *KEYFRAME_ARGS,
         out_video_path
     ])
 
-    shutil.rmtree(frames_dir, ignore_errors=True)
-
 
 def generate_answer_video(slide_img, audio_path, out_video_path):
     run_ffmpeg([
         "ffmpeg", "-y",
-        "-loop", "1", "-i", slide_img,
+        "-loop", "1", "-framerate", str(FPS), "-i", slide_img,
         "-i", audio_path,
-        "-c:v", "libx264", "-c:a", "aac",
+        "-r", str(FPS),
+        "-c:v", "libx264", "-c:a", "aac", "-ar", "44100", "-ac", "2", *KEYFRAME_ARGS,
         "-shortest", "-pix_fmt", "yuv420p", out_video_path
     ])
 
@@ -1,13 +1,40 @@
 # 05_merge_videos_with_transition.py
+#
+# Smart-render merge: only the few seconds around each _a.mkv → _q.mkv transition are re-encoded
+# (xfade + acrossfade); everything between those windows is stream-copied from the source segments,
+# cut on keyframes through concat demuxer inpoint/outpoint directives.
 
 import os
+import sys
 import json
-from moviepy.editor import VideoFileClip, CompositeVideoClip, concatenate_videoclips
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import namedtuple
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from media_probe import media_info, keyframe_times
+
+# xfade transition names for the "transition.type" config values; other values are passed to xfade as-is
+XFADE_TRANSITIONS = {"crossfade": "fade", "wipe": "wipeleft"}
+
+# Slack for comparing probed timestamps
+EPSILON = 0.001
+
+# A stretch [start, end) in seconds of the clip at index clip
+Part = namedtuple("Part", ["clip", "start", "end"])
+
 
 def load_config():
     with open("config.json", "r", encoding="utf-8") as f:
         return json.load(f)
 
+
+def run_ffmpeg(args):
+    subprocess.run(args, check=True)
+
+
 def get_video_list_from_txt(video_txt_path):
     if not os.path.exists(video_txt_path):
         raise FileNotFoundError(f"File not found: {video_txt_path}")
@@ -24,24 +51,148 @@ def get_video_list_from_txt(video_txt_path):
 
     return videos
 
-def wipe_transition(clip1, clip2, duration=1.0):
-    """Creates a horizontal wipe transition between two clips."""
-    clip1 = clip1.set_end(clip1.duration + duration)
-    clip2 = clip2.set_start(clip1.duration - duration)
 
-    # Create a mask for clip2 that moves from left to right
-    def make_frame(t):
-        w, h = clip2.size
-        mask = (t / duration) * w
-        return lambda gf, t_: gf(t_) * (t_ >= 0) * (t_ < duration)
+def get_transition_settings(config):
+    transition = config.get("transition", {})
+    enabled = transition.get("enabled", True)
+    duration = float(transition.get("duration", config.get("crossfade_duration", 1.0)))
+    kind = transition.get("type", "crossfade")
+    return enabled, duration, XFADE_TRANSITIONS.get(kind, kind)
+
+
+def stream_format(info):
+    # Rounded so container timebase noise (29.97002 vs 29.97) doesn't split clips that really match
+    fps = round(info.fps, 3) if info.fps else None
+    return info.width, info.height, fps, info.sample_rate, info.channels
+
+
+def reference_format(infos):
+    # The frame size, frame rate and audio format most clips share; windows are encoded to it
+    formats = [stream_format(info) for info in infos]
+    return max(set(formats), key=formats.count)
+
+
+def plan_pieces(infos, keyframes, transitions, duration, reference):
+    # Split the program into ("copy", Part) bodies and ("render", [Part, ...]) transition windows.
+    # A window starts at the last keyframe at least `duration` before the end of the outgoing clip and ends at
+    # the first keyframe at least `duration` into the incoming clip, so every body starts on a keyframe and
+    # stops right before one. A clip too short to keep a body between two windows, or whose frame size,
+    # frame rate or audio format differs from the reference (and so cannot be stream-copied next to the
+    # others), is rendered whole.
+    pieces = []
+    window = []
+    for i, info in enumerate(infos):
+        if stream_format(info) != reference:
+            window.append(Part(i, 0.0, info.duration))
+            continue
+        head, tail = 0.0, info.duration
+        if i > 0 and transitions[i - 1]:
+            head = next((t for t in keyframes[i] if t >= duration - EPSILON), info.duration)
+        if i < len(infos) - 1 and transitions[i]:
+            tail = max((t for t in keyframes[i] if t <= info.duration - duration + EPSILON), default=0.0)
+
+        if tail > head + EPSILON:
+            if head > 0:
+                window.append(Part(i, 0.0, head))
+            if window:
+                pieces.append(("render", window))
+                window = []
+            pieces.append(("copy", Part(i, head, tail)))
+            if tail < info.duration:
+                window.append(Part(i, tail, info.duration))
+        else:
+            window.append(Part(i, 0.0, info.duration))
+
+    if window:
+        pieces.append(("render", window))
+    return pieces
+
+
+def render_window(parts, video_paths, infos, transitions, duration, xfade, reference, out_path):
+    # Re-encode a run of clip parts, cross-fading where a transition falls between two of them.
+    # The window is encoded to the reference frame size, frame rate and audio format so it joins the copied
+    # bodies without a format change.
+    width, height, fps, sample_rate, channels = reference
+    fps = fps or infos[parts[0].clip].fps or 30
+    sample_rate = sample_rate or 44100
+    channels = min(channels or 2, 2)
+    layout = "mono" if channels == 1 else "stereo"
 
-    clip2_masked = clip2.set_mask(clip2.to_mask().with_start(clip1.duration - duration))
+    # Part lengths and the fade snapped to whole frames, so the window is exactly as long as its frames and the
+    # next body's first frame follows its last one by one frame period
+    lengths = [max(1, round((part.end - part.start) * fps)) / fps for part in parts]
+    duration = round(duration * fps) / fps
+
+    inputs = []
+    graph = []
+    for k, (part, length) in enumerate(zip(parts, lengths)):
+        inputs += ["-ss", f"{part.start:.3f}", "-t", f"{length:.3f}", "-i", video_paths[part.clip]]
+        # fps has to come after setpts: xfade needs the constant frame rate it sets on its output.
+        # The container duration can run past the last video frame (AAC padding), so the video is held on its
+        # last frame up to the part length the offsets below are computed from
+        graph.append(f"[{k}:v]setpts=PTS-STARTPTS,scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                     f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps:g},"
+                     f"tpad=stop=-1:stop_mode=clone,trim=duration={length:.3f},format=yuv420p[v{k}]")
+        if infos[part.clip].sample_rate:
+            graph.append(f"[{k}:a]aresample={sample_rate},aformat=sample_fmts=fltp:channel_layouts={layout},"
+                         f"apad,atrim=duration={length:.3f},asetpts=PTS-STARTPTS[a{k}]")
+        else:
+            graph.append(f"anullsrc=r={sample_rate}:cl={layout},atrim=duration={length:.3f}[a{k}]")
+
+    video, audio = "[v0]", "[a0]"
+    window_length = lengths[0]
+    for k in range(1, len(parts)):
+        length = lengths[k]
+        if transitions[parts[k - 1].clip]:
+            fade = min(duration, window_length, length)
+            graph.append(f"{video}[v{k}]xfade=transition={xfade}:duration={fade:.3f}:"
+                         f"offset={window_length - fade:.3f}[vx{k}]")
+            graph.append(f"{audio}[a{k}]acrossfade=d={fade:.3f}[ax{k}]")
+            window_length += length - fade
+        else:
+            graph.append(f"{video}{audio}[v{k}][a{k}]concat=n=2:v=1:a=1[vx{k}][ax{k}]")
+            window_length += length
+        video, audio = f"[vx{k}]", f"[ax{k}]"
+
+    run_ffmpeg([
+        "ffmpeg", "-y", "-v", "error",
+        *inputs,
+        "-filter_complex", ";".join(graph),
+        "-map", video, "-map", audio,
+        # Exact frame count: a stray frame at window_length would collide with the next body's first frame
+        "-frames:v", str(round(window_length * fps)), "-t", f"{window_length:.3f}",
+        "-c:v", "libx264", "-bf", "0", "-pix_fmt", "yuv420p", "-r", f"{fps:g}",
+        "-c:a", "aac", "-ar", str(sample_rate), "-ac", str(channels),
+        out_path
+    ])
+    return window_length
+
+
+def transitions_around(transitions):
+    # Indices of the clips on either side of a transition (the only ones whose keyframes matter)
+    clips = set()
+    for i, is_transition in enumerate(transitions):
+        if is_transition:
+            clips.update((i, i + 1))
+    return clips
+
+
+def concat_entry(path, start=0.0, end=None, duration=None):
+    # The inpoint is written even when it is 0: without one the concat demuxer lines a file up by its start
+    # time, which the AAC priming puts before the first video frame, shifting that file's video off the frame grid
+    entry = "file '{}'\n".format(os.path.abspath(path).replace("'", "'\\''"))
+    entry += f"inpoint {start:.6f}\n"
+    if end is not None:
+        entry += f"outpoint {end:.6f}\n"
+    if duration is not None:
+        entry += f"duration {duration:.6f}\n"
+    return entry
 
-    return CompositeVideoClip([clip1, clip2_masked], size=clip1.size).subclip(0, clip1.duration + clip2.duration - duration)
 
 def merge_with_transitions():
     config = load_config()
-    wipe_duration = 1.0
+    enabled, transition_duration, xfade = get_transition_settings(config)
+    output_path = "final_output.mkv"
 
     video_paths = []
 
@@ -57,32 +208,54 @@ def merge_with_transitions():
     if os.path.exists(end_slide_video_path):
         video_paths.append(end_slide_video_path)
 
-    # Load all clips
-    clips = [VideoFileClip(path) for path in video_paths]
+    print(f"🧩 Merging {len(video_paths)} clips into {output_path} ...")
+    started = time.time()
 
-    print(f"🧩 Merging {len(clips)} clips into final_output.mkv ...")
+    # Transition points (_a.mkv → _q.mkv)
+    transitions = []
+    for prev_path, curr_path in zip(video_paths, video_paths[1:]):
+        prev_name = os.path.basename(prev_path)
+        curr_name = os.path.basename(curr_path)
+        is_transition = enabled and prev_name.endswith("_a.mkv") and curr_name.endswith("_q.mkv")
+        if is_transition:
+            print(f"🎞️ {xfade} transition between {prev_name} → {curr_name}")
+        transitions.append(is_transition)
 
-    merged_clips = [clips[0]]
+    infos = [media_info(path) for path in video_paths]
+    transition_clips = transitions_around(transitions)
+    keyframes = [keyframe_times(path) if i in transition_clips else [0.0] for i, path in enumerate(video_paths)]
+    reference = reference_format(infos)
+    pieces = plan_pieces(infos, keyframes, transitions, transition_duration, reference)
 
-    for i in range(1, len(clips)):
-        prev_clip = merged_clips[-1]
-        curr_clip = clips[i]
+    work_dir = tempfile.mkdtemp(prefix="merge_", dir=".")
+    try:
+        concat_txt = os.path.join(work_dir, "concat.txt")
+        rendered = 0.0
+        with open(concat_txt, "w", encoding="utf-8") as f:
+            for index, (kind, piece) in enumerate(pieces):
+                if kind == "copy":
+                    end = piece.end if piece.end < infos[piece.clip].duration else None
+                    f.write(concat_entry(video_paths[piece.clip], piece.start, end))
+                else:
+                    window_path = os.path.join(work_dir, f"window_{index:04d}.mkv")
+                    window_length = render_window(piece, video_paths, infos, transitions, transition_duration,
+                                                  xfade, reference, window_path)
+                    rendered += window_length
+                    # The exact length, so the next body starts one frame after the window's last frame
+                    f.write(concat_entry(window_path, duration=window_length))
 
-        # Detect transition point (_a.mkv → _q.mkv)
-        prev_name = os.path.basename(video_paths[i - 1])
-        curr_name = os.path.basename(video_paths[i])
-        if prev_name.endswith("_a.mkv") and curr_name.endswith("_q.mkv"):
-            # Insert a wipe transition
-            print(f"🎞️ Wipe transition between {prev_name} → {curr_name}")
-            transition_clip = prev_clip.crossfadeout(wipe_duration).set_end(prev_clip.duration)
-            next_clip = curr_clip.crossfadein(wipe_duration)
-            merged_clips[-1] = transition_clip
-            merged_clips.append(next_clip)
-        else:
-            merged_clips.append(curr_clip)
+        run_ffmpeg([
+            "ffmpeg", "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", concat_txt,
+            "-c", "copy", output_path
+        ])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    windows = sum(1 for kind, _ in pieces if kind == "render")
+    print(f"⚡ Re-encoded {windows} transition windows ({rendered:.1f}s), stream-copied the rest "
+          f"in {time.time() - started:.1f}s")
+    print(f"✅ Final video saved to {output_path}")
 
-    final = concatenate_videoclips(merged_clips, method="compose")
-    final.write_videofile("final_output.mkv", codec="libx264", audio_codec="aac")
 
 if __name__ == "__main__":
     merge_with_transitions()
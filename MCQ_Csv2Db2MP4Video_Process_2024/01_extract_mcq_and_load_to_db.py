@@ -1,7 +1,36 @@
 import json
 import sqlite3
+import time
 import uuid
 import os
+from multiprocessing import Pool, cpu_count
+
+from question_db import count_words, count_option_words, ensure_question_bank_schema
+from question_dedup import (ensure_dedup_tables, backfill_fingerprints, fingerprint_question, find_duplicate,
+                            index_question, record_near_duplicate, EXACT_DUPLICATE, ANSWER_CHANGED)
+
+# Default duplicate policy: near duplicates and changed answers are inserted and flagged for review
+DEFAULT_DUPLICATE_POLICY = 'flag'
+
+# Upsert so a near-duplicate merged into an existing question_id overwrites that row
+INSERT_QUESTION_SQL = '''
+    INSERT INTO question_bank (
+        question_id, question_text, question_options, correct_answer, 
+        subject, topic, text_language, created_by, created_updated_on,
+        question_word_count, options_word_count
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (question_id) DO UPDATE SET
+        question_text = excluded.question_text,
+        question_options = excluded.question_options,
+        correct_answer = excluded.correct_answer,
+        subject = excluded.subject,
+        topic = excluded.topic,
+        text_language = excluded.text_language,
+        created_by = excluded.created_by,
+        created_updated_on = excluded.created_updated_on,
+        question_word_count = excluded.question_word_count,
+        options_word_count = excluded.options_word_count
+'''
 
 
 # Function to read config.json
@@ -29,10 +58,58 @@ def create_table(conn):
             topic TEXT,
             text_language TEXT,
             created_by TEXT,
-            created_updated_on TEXT
+            created_updated_on TEXT,
+            question_word_count INTEGER,
+            options_word_count INTEGER
         )
     ''')
     conn.commit()
+    # Adds the word count columns/index to older databases and backfills them
+    ensure_question_bank_schema(conn)
+    # Duplicate detection index (fingerprints existing questions on first use)
+    ensure_dedup_tables(conn)
+    backfill_fingerprints(conn)
+
+
+# Function to check a question against the duplicate index.
+# Returns the question_id to write: a new one, the existing one when a match is merged,
+# or None when the question is skipped as an exact duplicate.
+# Only exact matches (same text and answer) are skipped. With the default 'flag' policy a near duplicate, or the
+# same text with a different answer, is inserted and recorded in question_near_duplicates for review; 'merge'
+# overwrites the matched question instead (e.g. to load a corrected answer key over the old one).
+def resolve_question_id(conn, question, fingerprint, duplicate_policy, stats):
+    content_hash, answer_hash, signature = fingerprint
+    duplicate = find_duplicate(conn, content_hash, answer_hash, signature)
+    if duplicate is not None and duplicate[2] == EXACT_DUPLICATE:
+        stats['rejected'] += 1
+        print(f"Skipped exact duplicate of {duplicate[0]}: {question}")
+        return None
+
+    merge = duplicate is not None and duplicate_policy == 'merge'
+    if merge:
+        question_id = duplicate[0]
+        stats['merged'] += 1
+    else:
+        question_id = str(uuid.uuid4())
+        stats['inserted'] += 1
+    index_question(conn, question_id, content_hash, answer_hash, signature, replace=merge)
+
+    if duplicate is not None and not merge:
+        existing_id, similarity, kind = duplicate
+        record_near_duplicate(conn, question_id, existing_id, similarity)
+        stats['flagged'] += 1
+        if kind == ANSWER_CHANGED:
+            print(f"Flagged answer differing from {existing_id} for review: {question}")
+        else:
+            print(f"Flagged possible duplicate of {existing_id} for review (similarity {similarity:.2f}): {question}")
+    return question_id
+
+
+# Function to print how many questions were inserted, merged, flagged for review and rejected as duplicates
+def print_duplicate_stats(stats):
+    print(f"Inserted {stats['inserted']} new questions ({stats['flagged']} flagged as possible duplicates in "
+          f"question_near_duplicates), merged {stats['merged']} near-duplicates, "
+          f"rejected {stats['rejected']} exact duplicates")
 
 
 # Function to process file content line by line and extract question, options, and answer
@@ -75,21 +152,20 @@ def extract_qa(file_content):
     return questions
 
 
-# Function to insert questions into the database
-def insert_into_db(conn, questions, config):
+# Function to insert questions into the database, skipping or merging duplicates
+def insert_into_db(conn, questions, config, stats):
     cursor = conn.cursor()
 
     for question, options, answer in questions:
-        question_id = str(uuid.uuid4())
-        cursor.execute('''
-            INSERT INTO question_bank (
-                question_id, question_text, question_options, correct_answer, 
-                subject, topic, text_language, created_by, created_updated_on
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        question_id = resolve_question_id(conn, question, fingerprint_question(question, options, answer),
+                                          config['duplicate_policy'], stats)
+        if question_id is None:
+            continue
+        cursor.execute(INSERT_QUESTION_SQL, (
             question_id, question, options, answer,
             config['subject'], config['topic'], config['text_language'],
-            config['created_by'], config['created_updated_on']
+            config['created_by'], config['created_updated_on'],
+            count_words(question), count_option_words(options)
         ))
 
     conn.commit()
@@ -99,6 +175,7 @@ def insert_into_db(conn, questions, config):
 def process_files(config):
     conn = connect_to_db()
     create_table(conn)
+    stats = {'inserted': 0, 'merged': 0, 'flagged': 0, 'rejected': 0}
 
     for file_info in config['files']:
         file_path = file_info['file_path']
@@ -116,8 +193,9 @@ def process_files(config):
                         'topic': topic,
                         'text_language': config['text_language'],
                         'created_by': config['created_by'],
-                        'created_updated_on': config['created_updated_on']
-                    })
+                        'created_updated_on': config['created_updated_on'],
+                        'duplicate_policy': config.get('duplicate_policy', DEFAULT_DUPLICATE_POLICY)
+                    }, stats)
                 print(f"questions from chapter {file_path} = {len(questions)}")
             except Exception as e:
                 print(f"Error processing file {file_path}: {e}")
@@ -125,10 +203,117 @@ def process_files(config):
             print(f"File {file_path} does not exist.")
 
     conn.close()
+    print_duplicate_stats(stats)
+
+
+# Function to read and parse one chapter file (runs inside a worker process)
+def parse_file(file_info):
+    file_path = file_info['file_path']
+    if not os.path.exists(file_path):
+        return file_info, None, f"File {file_path} does not exist."
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            # Iterate the file object directly instead of materialising readlines()
+            questions = extract_qa(f)
+        # Fingerprints are computed here so the MinHash work is spread over the worker processes
+        questions = [(question, options, answer, fingerprint_question(question, options, answer))
+                     for question, options, answer in questions]
+        return file_info, questions, None
+    except Exception as e:
+        return file_info, None, f"Error processing file {file_path}: {e}"
+
+
+# Function to parse all files in a process pool and stream the parsed files back in config order
+def iter_parsed_files(pool, config):
+    for file_info, questions, error in pool.imap(parse_file, config['files']):
+        if error:
+            print(error)
+            continue
+        print(f"questions from chapter {file_info['file_path']} = {len(questions)}")
+        yield file_info, questions
+
+
+# Function to stream the question_bank rows of one parsed file (duplicates resolved)
+def iter_question_rows(conn, file_info, questions, config, stats):
+    duplicate_policy = config.get('duplicate_policy', DEFAULT_DUPLICATE_POLICY)
+    for question, options, answer, fingerprint in questions:
+        question_id = resolve_question_id(conn, question, fingerprint, duplicate_policy, stats)
+        if question_id is None:
+            continue
+        yield (
+            question_id, question, options, answer,
+            file_info['subject'], file_info['topic'], config['text_language'],
+            config['created_by'], config['created_updated_on'],
+            count_words(question), count_option_words(options)
+        )
+
+
+# Function to insert rows with executemany in fixed-size batches
+def insert_rows_in_batches(cursor, rows, batch_size):
+    total_rows = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            cursor.executemany(INSERT_QUESTION_SQL, batch)
+            total_rows += len(batch)
+            batch = []
+    if batch:
+        cursor.executemany(INSERT_QUESTION_SQL, batch)
+        total_rows += len(batch)
+    return total_rows
+
+
+# Bulk mode: parse files in parallel and load every row inside one WAL-mode transaction.
+# Each file is loaded under its own savepoint, so a file that fails to insert is rolled back on its own
+# and the other files are still committed.
+def bulk_process_files(config):
+    start_time = time.time()
+    batch_size = config.get('batch_size', 1000)
+    workers = config.get('parse_workers', cpu_count())
+
+    conn = connect_to_db()
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    create_table(conn)
+    stats = {'inserted': 0, 'merged': 0, 'flagged': 0, 'rejected': 0}
+
+    total_rows = 0
+    try:
+        with Pool(workers) as pool:
+            cursor = conn.cursor()
+            # Explicit BEGIN: a SAVEPOINT outside a transaction would commit on RELEASE; commit once at the end
+            cursor.execute("BEGIN")
+            for file_info, questions in iter_parsed_files(pool, config):
+                stats_before = dict(stats)
+                cursor.execute("SAVEPOINT chapter_file")
+                try:
+                    total_rows += insert_rows_in_batches(
+                        cursor, iter_question_rows(conn, file_info, questions, config, stats), batch_size)
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO chapter_file")
+                    stats.update(stats_before)
+                    print(f"Error loading file {file_info['file_path']}, its questions were rolled back: {e}")
+                cursor.execute("RELEASE chapter_file")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    elapsed = time.time() - start_time
+    rows_per_second = total_rows / elapsed if elapsed > 0 else float(total_rows)
+    print(f"Bulk loaded {total_rows} questions from {len(config['files'])} files "
+          f"in {elapsed:.2f} seconds ({rows_per_second:.0f} rows/sec)")
+    print_duplicate_stats(stats)
 
 
 # Entry point
 if __name__ == "__main__":
     config = read_config("config/01_config_4_db_load.json")
-    process_files(config)
+    if config.get('bulk_load', False):
+        bulk_process_files(config)
+    else:
+        process_files(config)
     print("Questions inserted successfully.")
@@ -1,10 +1,18 @@
+import os
 import sqlite3
 import json
-import textwrap
+import tempfile
+from functools import lru_cache
+from multiprocessing import Pool, cpu_count
+from pypdf import PdfWriter
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.pdfgen import canvas
 
+BOLD_FONT_NAME = 'Helvetica-Bold'  # Using built-in bold font
+LINE_SPACING = 1.5
+
 
 # Function to read the configuration from config.json
 def read_config(config_file):
@@ -31,141 +39,185 @@ def fetch_questions(conn, subject, topic):
     return cursor.fetchall()
 
 
-# Function to create a PDF with questions and answers
-def create_pdf(filename, subject, topics, config):
-    # Load the page configuration
+# Width of a word in points, cached since the same words repeat throughout a question book
+@lru_cache(maxsize=None)
+def word_width(word, font_name, font_size):
+    return stringWidth(word, font_name, font_size)
+
+
+# Split a word that is wider than the line on its own into pieces that fit
+def split_long_word(word, font_name, font_size, max_width):
+    pieces = []
+    piece = ""
+    for char in word:
+        if piece and word_width(piece + char, font_name, font_size) > max_width:
+            pieces.append(piece)
+            piece = char
+        else:
+            piece += char
+    if piece:
+        pieces.append(piece)
+    return pieces
+
+
+# Break text into lines by measured width so no line runs past the right margin
+def wrap_text_to_width(text, font_name, font_size, max_width):
+    space_width = word_width(' ', font_name, font_size)
+    lines = []
+    current_line = []
+    current_width = 0
+    for word in text.split():
+        width = word_width(word, font_name, font_size)
+        pieces = [word] if width <= max_width else split_long_word(word, font_name, font_size, max_width)
+        for piece in pieces:
+            width = word_width(piece, font_name, font_size)
+            if current_line and current_width + space_width + width > max_width:
+                lines.append(' '.join(current_line))
+                current_line = [piece]
+                current_width = width
+            else:
+                current_width += (space_width if current_line else 0) + width
+                current_line.append(piece)
+    if current_line:
+        lines.append(' '.join(current_line))
+    return lines
+
+
+# Lay out one topic into pages of drawing operations (runs in a worker process).
+# Every topic starts on a new page, so topics can be laid out and drawn independently.
+def layout_topic(subject, topic, config):
     font_name = config["page_config"]["font_name"]
     font_size = config["page_config"]["font_size"]
-    lines_per_page = config["page_config"]["lines_per_page"]
-    wrap_width = 76  # Approximate number of characters per line for wrapping
+    line_height = font_size * LINE_SPACING
 
     conn = connect_to_db()
+    questions = fetch_questions(conn, subject, topic)
+    conn.close()
 
-    # Initialize PDF canvas
-    c = canvas.Canvas(filename, pagesize=letter)
     width, height = letter
-
-    # Set font for title and content
-    c.setFont(font_name, font_size)
-
-    # Margins and starting y-position
     margin_x = inch
     margin_y = inch
     text_width = width - 2 * margin_x  # Available width for text
+
+    pages = []
+    ops = []
     y_position = height - margin_y
 
-    # Serial number for questions
-    def reset_serial_number():
-        return 1
+    def add_page():
+        nonlocal ops, y_position
+        ops = []
+        pages.append(ops)
+        y_position = height - margin_y
 
-    def add_page(topic):
+    def draw_line_of_text(text, font, size):
         nonlocal y_position
-        c.showPage()
-        y_position = height - margin_y
-        c.setFont(font_name, font_size)
-        draw_footer(topic)
+        if y_position - size < margin_y:
+            add_page()
+        ops.append(('text', font, size, margin_x, y_position, text))
+        y_position -= line_height
+
+    add_page()
+
+    # Main heading for the subject, subheading for the topic and a horizontal line
+    ops.append(('text', font_name, font_size + 4, margin_x, y_position, subject))
+    y_position -= font_size * 2
+    ops.append(('text', font_name, font_size + 2, margin_x, y_position, topic))
+    y_position -= font_size * 2
+    ops.append(('line', margin_x, y_position, width - margin_x, y_position))
+    y_position -= font_size * 1.5
+
+    # Write Questions
+    answers = []
+    for serial_no, (question_text, question_options, correct_answer) in enumerate(questions, start=1):
+        question_lines = wrap_text_to_width(f"{serial_no:03}. {question_text}", BOLD_FONT_NAME, font_size,
+                                            text_width)
+        option_lines = [line for option in question_options.split(" | ")
+                        for line in wrap_text_to_width(option.strip(), font_name, font_size, text_width)]
+
+        # Keep the question and its options together when they fit on one page
+        block_height = (len(question_lines) + len(option_lines) + 1) * line_height
+        if y_position - block_height < margin_y and block_height < height - 2 * margin_y:
+            add_page()
+
+        for line in question_lines:
+            draw_line_of_text(line, BOLD_FONT_NAME, font_size)
+        # Add 1 line space between the question and the options
+        y_position -= line_height
+        for line in option_lines:
+            draw_line_of_text(line, font_name, font_size)
+        # Add an empty line after each question
+        y_position -= line_height
 
-    def draw_footer(topic):
-        # Add footer with topic name and page number
-        footer_text = f"Topic: {topic}"
-        page_number_text = f"Page {c.getPageNumber()}"
-        c.setFont(font_name, font_size - 2)
-        c.drawString(margin_x, margin_y - 10, footer_text)
-        c.drawRightString(width - margin_x, margin_y - 10, page_number_text)
+        # Store the answers for printing later
+        answers.append((serial_no, correct_answer))
 
-    def add_heading(subject, topic):
-        nonlocal y_position
-        if y_position - 2 * font_size < margin_y:
-            add_page(topic)
-        # Main heading for the subject
-        c.setFont(font_name, font_size + 4)
-        c.drawString(margin_x, y_position, subject)
-        y_position -= font_size * 2
-        # Subheading for the topic
-        c.setFont(font_name, font_size + 2)
-        c.drawString(margin_x, y_position, topic)
-        y_position -= font_size * 2
-        # Draw a horizontal line
-        c.setLineWidth(1)
-        c.line(margin_x, y_position, width - margin_x, y_position)
-        y_position -= font_size * 1.5
-        # Reset font back to normal for questions
-        c.setFont(font_name, font_size)
-
-    # Function to wrap and print text
-    def draw_wrapped_text(text, wrap_width, bold=False):
-        nonlocal y_position
-        wrapped_lines = textwrap.wrap(text, width=wrap_width)
-        if bold:
-            c.setFont('Helvetica-Bold', font_size)  # Using built-in bold font
-        else:
-            c.setFont(font_name, font_size)
-        for line in wrapped_lines:
-            if y_position - font_size < margin_y:
-                add_page(topic)
-            c.drawString(margin_x, y_position, line)
-            y_position -= font_size * 1.5
-
-    # Function to add a question
-    def add_question(serial_no, question, options):
-        nonlocal y_position
-        question_text = f"{serial_no:03}. {question}"
+    # Print answers after questions for each topic
+    if y_position - (len(answers) + 2) * font_size < margin_y:
+        add_page()
 
-        # Wrap question text and make it bold
-        draw_wrapped_text(question_text, wrap_width, bold=True)
+    # Title for the answer section
+    ops.append(('text', font_name, font_size + 2, margin_x, y_position, f"Answers for {topic}"))
+    y_position -= font_size * 2
 
-        # Add 1 line space between the question and the options
-        y_position -= font_size * 1.5
+    # Write Answers
+    for serial_no, answer in answers:
+        for line in wrap_text_to_width(f"{serial_no:03}. {answer}", font_name, font_size, text_width):
+            draw_line_of_text(line, font_name, font_size)
 
-        # Handle options with wrapping (normal font)
-        for option in options.split(" | "):
-            draw_wrapped_text(option.strip(), wrap_width - 4)
+    return pages
 
-        # Add an empty line after each question
-        y_position -= font_size * 1.5
-
-    # Main function to process each topic
-    for topic in topics:
-        questions = fetch_questions(conn, subject, topic)
-        serial_number = reset_serial_number()
-        answers = []
-
-        # Add heading for subject and topic
-        add_heading(subject, topic)
-
-        # Write Questions
-        for question_text, question_options, correct_answer in questions:
-            # Check if the question and options will fit on the current page
-            if y_position - (len(question_options.split(" | ")) + 4) * font_size < margin_y:
-                add_page(topic)
-
-            add_question(serial_number, question_text, question_options)
-            # Store the answers for printing later
-            answers.append((serial_number, correct_answer))
-            serial_number += 1
-
-        # Print answers after questions for each topic
-        if y_position - (len(answers) + 2) * font_size < margin_y:
-            add_page(topic)
-
-        # Title for the answer section
-        c.setFont(font_name, font_size + 2)
-        c.drawString(margin_x, y_position, f"Answers for {topic}")
-        y_position -= font_size * 2
-        c.setFont(font_name, font_size)
-
-        # Write Answers
-        for serial_no, answer in answers:
-            if y_position - font_size < margin_y:
-                add_page(topic)
-            c.drawString(margin_x, y_position, f"{serial_no:03}. {answer}")
-            y_position -= font_size * 1.5
-
-        # Add a page break between topics
-        add_page(topic)
-
-    # Save the PDF
+
+# Draw the laid out pages of one topic into a separate PDF part (runs in a worker process)
+def draw_topic_part(pages, topic, part_path, first_page_number, config):
+    font_name = config["page_config"]["font_name"]
+    font_size = config["page_config"]["font_size"]
+    width, height = letter
+    margin_x = inch
+    margin_y = inch
+
+    c = canvas.Canvas(part_path, pagesize=letter)
+    for page_number, ops in enumerate(pages, start=first_page_number):
+        for op in ops:
+            if op[0] == 'text':
+                _, font, size, x, y, text = op
+                c.setFont(font, size)
+                c.drawString(x, y, text)
+            else:
+                _, x1, y1, x2, y2 = op
+                c.setLineWidth(1)
+                c.line(x1, y1, x2, y2)
+
+        # Add footer with topic name and page number
+        c.setFont(font_name, font_size - 2)
+        c.drawString(margin_x, margin_y - 10, f"Topic: {topic}")
+        c.drawRightString(width - margin_x, margin_y - 10, f"Page {page_number}")
+        c.showPage()
     c.save()
+    return part_path
+
+
+# Function to create a PDF with questions and answers.
+# Topics are laid out and drawn in parallel processes into separate parts, then merged in topic order.
+def create_pdf(filename, subject, topics, config):
+    workers = config.get("render_workers", cpu_count())
+
+    with tempfile.TemporaryDirectory() as part_dir, Pool(workers) as pool:
+        topic_pages = pool.starmap(layout_topic, [(subject, topic, config) for topic in topics])
+
+        # Page numbers run through the whole book, so each part starts after the previous parts
+        jobs = []
+        first_page_number = 1
+        for index, (topic, pages) in enumerate(zip(topics, topic_pages)):
+            part_path = os.path.join(part_dir, f"part_{index:04}.pdf")
+            jobs.append((pages, topic, part_path, first_page_number, config))
+            first_page_number += len(pages)
+        part_paths = pool.starmap(draw_topic_part, jobs)
+
+        writer = PdfWriter()
+        for part_path in part_paths:
+            writer.append(part_path)
+        with open(filename, 'wb') as f:
+            writer.write(f)
 
 
 # Main function to generate the PDF for multiple topics
@@ -1,17 +1,25 @@
 import os
 import sqlite3
 from PIL import Image, ImageDraw, ImageFont
-from moviepy.editor import ImageClip, concatenate_videoclips, AudioFileClip, afx
-from moviepy.audio.AudioClip import concatenate_audioclips
-import textwrap
+import sys
 import json
 import logging
 import time
 from datetime import datetime
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from text_layout import layout_lines, draw_lines, line_height
+from slide_render_cache import file_hash, slide_key, style_from_config, load_manifest, save_manifest, render_cached
+from slideshow_encoder import encode_slideshow
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Render cache: bump SLIDE_RENDERER_VERSION whenever the slide drawing code changes
+SLIDE_RENDERER_VERSION = 1
+SLIDE_STYLE_KEYS = ["wide_aspect_ratio", "font_path_question", "font_path_options", "font_path_answer",
+                    "font_settings"]
+
 # Ensure that required directories exist
 def ensure_directory_exists(directory):
     if not os.path.exists(directory):
@@ -81,6 +89,10 @@ def load_resources(config):
 def generate_slides(questions, config, background_image, font_question, font_options, font_answer):
     slides = []
     durations = []
+    slide_dir = config['working_slide_path']
+    manifest = load_manifest(slide_dir) if config.get("render_cache", True) else None
+    style = style_from_config(config, SLIDE_STYLE_KEYS)
+    template_hash = file_hash(config["background_image"])
 
     # Add start slide
     slides.append(create_slide_for_start_or_end(config["start_slide"], config))
@@ -96,15 +108,20 @@ def generate_slides(questions, config, background_image, font_question, font_opt
         question_content = f"Q - {idx + 1}: {question_text}"
         options_content = f"{formatted_options}"
 
-        # Create question slide
-        question_slide = create_slide(question_content, options_content, background_image,
-                                      font_question, font_options,
-                                      f"{config['working_slide_path']}/slide_{idx + 1}", config, "question")
+        # Create question slide (reused when unchanged since the last run)
+        question_key = slide_key(SLIDE_RENDERER_VERSION, style, template_hash, "question", question_content,
+                                 options_content)
+        question_slide = render_cached(manifest, f"{slide_dir}/slide_{idx + 1}_question.png", question_key,
+                                       lambda: create_slide(question_content, options_content, background_image,
+                                                            font_question, font_options,
+                                                            f"{slide_dir}/slide_{idx + 1}", config, "question"))
 
         # Create answer slide (only the answer, in a different font)
-        answer_slide = create_slide(correct_answer, "", background_image,
-                                    font_answer, font_answer,
-                                    f"{config['working_slide_path']}/slide_{idx + 1}", config, "answer")
+        answer_key = slide_key(SLIDE_RENDERER_VERSION, style, template_hash, "answer", correct_answer)
+        answer_slide = render_cached(manifest, f"{slide_dir}/slide_{idx + 1}_answer.png", answer_key,
+                                     lambda: create_slide(correct_answer, "", background_image,
+                                                          font_answer, font_answer,
+                                                          f"{slide_dir}/slide_{idx + 1}", config, "answer"))
 
         # Add the slides to the list
         slides.extend([question_slide, answer_slide])
@@ -114,6 +131,7 @@ def generate_slides(questions, config, background_image, font_question, font_opt
     slides.append(create_slide_for_start_or_end(config["end_slide"], config))
     durations.append(config["slide_durations"]["end_slide"])
 
+    save_manifest(slide_dir, manifest)
     return slides, durations
 
 # Function to create start or end slide in wide aspect ratio
@@ -147,16 +165,8 @@ def create_video(subject, topics, config):
     slides, durations = generate_slides(questions, config, background_image, font_question, font_options, font_answer)
 
     # Create the video
-    create_video_from_slides(slides, config["output_video"], durations, config.get("background_music"))
-
-# Improved: Word wrapping function for better text formatting
-def wrap_text(text, font, max_width, config):
-    """Wrap text based on max width and return wrapped text"""
-    wrap_width = config.get("text_wrap_width", 50)  # Default to 50 if not found in config
-    wrapped_lines = []
-    for line in text.split('\n'):
-        wrapped_lines.extend(textwrap.wrap(line, width=wrap_width))  # Use the value from config
-    return wrapped_lines
+    create_video_from_slides(slides, config["output_video"], durations, config.get("background_music"),
+                             processes=config.get("encode_processes", 1))
 
 def create_slide(question_text, options_text, background_image, font_question, font_options, output_path, config, slide_type="question"):
     img = background_image.copy()
@@ -174,22 +184,19 @@ def create_slide(question_text, options_text, background_image, font_question, f
     max_width_question = img.width - 100  # Leave padding for the text
 
     # Wrap and draw the question text
-    wrapped_question = wrap_text(question_text, font_question, max_width_question, config)  # Pass config
-    for line in wrapped_question:
-        draw.text((x_question, y_question), line, font=font_question, fill=tuple(config['font_settings']['font_color_question']))
-        line_height = font_question.getbbox(line)[3] - font_question.getbbox(line)[1]
-        y_question += line_height + 20
+    question_step = line_height(font_question) + 20
+    question_lines = layout_lines(question_text, font_question, max_width_question, x_question, y_question, question_step)
+    draw_lines(draw, question_lines, font_question, tuple(config['font_settings']['font_color_question']))
+    y_question += len(question_lines) * question_step
 
     # Position for options text
     x_options, y_options = 75, y_question + 120  # Start below the question text
     max_width_options = img.width - 100  # Leave padding for the text
 
     # Wrap and draw the options text
-    wrapped_options = wrap_text(options_text, font_options, max_width_options, config)  # Pass config
-    for line in wrapped_options:
-        draw.text((x_options, y_options), line, font=font_options, fill=tuple(config['font_settings']['font_color_options']))
-        line_height = font_options.getbbox(line)[3] - font_options.getbbox(line)[1]
-        y_options += line_height + 15
+    option_lines = layout_lines(options_text, font_options, max_width_options, x_options, y_options,
+                                line_height(font_options) + 15)
+    draw_lines(draw, option_lines, font_options, tuple(config['font_settings']['font_color_options']))
 
     # Save the slide as an image
     output_filename = f"{output_path}_{slide_type}.png"
@@ -198,56 +205,14 @@ def create_slide(question_text, options_text, background_image, font_question, f
 
     return output_filename
 
-def create_video_from_slides(slides, output_video, durations, background_music=None, music_volume=0.2):
+def create_video_from_slides(slides, output_video, durations, background_music=None, music_volume=0.2, processes=1):
     logging.info("Starting video creation...")
-    clips = []
-
-    for slide, duration in zip(slides, durations):
-        clip = ImageClip(slide).set_duration(duration)
-        clips.append(clip)
-
-    # Concatenate all slides to form the video
-    video = concatenate_videoclips(clips, method="compose")
-
-    # Total video duration
-    video_duration = sum(durations)
-
-    # Add background music in sequence if provided
-    if background_music:
-        if isinstance(background_music, list):
-            # Concatenate music tracks to match the video duration
-            music_clips = []
-            total_music_duration = 0
-            for music_file in background_music:
-                music = AudioFileClip(music_file)
-                music_clips.append(music)
-                total_music_duration += music.duration
-
-            # Concatenate all music clips together
-            full_music = concatenate_audioclips(music_clips)
-
-            # If the total music duration is less than the video duration, loop the music
-            if total_music_duration < video_duration:
-                full_music = afx.audio_loop(full_music, duration=video_duration)
-            else:
-                full_music = full_music.subclip(0, video_duration)
-        else:
-            # If background_music is a single file
-            full_music = AudioFileClip(background_music)
-            if full_music.duration < video_duration:
-                full_music = afx.audio_loop(full_music, duration=video_duration)
-            else:
-                full_music = full_music.subclip(0, video_duration)
-
-        # Apply a 3-second fade-out effect towards the end of the music
-        full_music = full_music.audio_fadeout(3)
-
-        # Adjust the volume of the music
-        full_music = full_music.volumex(music_volume)
-        video = video.set_audio(full_music)
-
-    # Save the video
-    video.write_videofile(output_video, fps=24)
+
+    # Background music (one file or a list played in sequence) is looped or trimmed to the video length,
+    # faded out over the last 3 seconds and lowered to music_volume.
+    # With processes > 1 the slides are encoded as parallel segments joined without re-encoding.
+    encode_slideshow(list(zip(slides, durations)), output_video, fps=24, audio=background_music,
+                     audio_volume=music_volume, audio_fade_out=3 if background_music else 0, processes=processes)
 
     logging.info(f"Video saved as: {output_video}")
 
@@ -1,17 +1,26 @@
 import os
 import sqlite3
 from PIL import Image, ImageDraw, ImageFont
-from moviepy.editor import ImageClip, concatenate_videoclips
-import textwrap
+import sys
 import json
 import logging
 import time
 import random
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from text_layout import layout_lines, draw_lines, line_height
+from slide_render_cache import file_hash, slide_key, style_from_config, load_manifest, save_manifest, render_cached
+from slideshow_encoder import encode_slideshow
+
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Render cache: bump SLIDE_RENDERER_VERSION whenever the slide drawing code changes
+SLIDE_RENDERER_VERSION = 1
+SLIDE_STYLE_KEYS = ["wide_aspect_ratio", "font_path_question", "font_path_options", "font_path_answer",
+                    "font_settings"]
+
 
 # Ensure that required directories exist
 def ensure_directory_exists(directory):
@@ -163,14 +172,6 @@ def load_resources(config):
     return background_image, font_question, font_options, font_answer
 
 
-# Word wrapping function for better text formatting
-def wrap_text(text, font, max_width, config):
-    wrap_width = config.get("text_wrap_width", 50)
-    wrapped_lines = []
-    for line in text.split('\n'):
-        wrapped_lines.extend(textwrap.wrap(line, width=wrap_width))
-    return wrapped_lines
-
 # Create individual slide (either question or answer)
 def create_slide(question_content, options_content, background_image, font_question, font_options, output_path, config, slide_type="question"):
     img = background_image.copy()
@@ -188,13 +189,11 @@ def create_slide(question_content, options_content, background_image, font_quest
     max_width_question = img.width - 100
 
     # Wrap and draw the question text
-    wrapped_question = wrap_text(question_content, font_question, max_width_question, config)
-    for line in wrapped_question:
-        draw.text((x_question, y_question), line, font=font_question, fill=tuple(config['font_settings']['font_color_question']))
-        # Use getbbox to get the height of the line
-        bbox = draw.textbbox((x_question, y_question), line, font=font_question)
-        line_height = bbox[3] - bbox[1]  # The height is bottom minus top of the bounding box
-        y_question += line_height + 20
+    question_step = line_height(font_question) + 20
+    question_lines = layout_lines(question_content, font_question, max_width_question, x_question, y_question,
+                                  question_step)
+    draw_lines(draw, question_lines, font_question, tuple(config['font_settings']['font_color_question']))
+    y_question += len(question_lines) * question_step
 
     # If options are present, draw the options
     if options_content:
@@ -202,12 +201,9 @@ def create_slide(question_content, options_content, background_image, font_quest
         max_width_options = img.width - 100
 
         # Wrap and draw the options text
-        wrapped_options = wrap_text(options_content, font_options, max_width_options, config)
-        for line in wrapped_options:
-            draw.text((x_options, y_options), line, font=font_options, fill=tuple(config['font_settings']['font_color_options']))
-            bbox = draw.textbbox((x_options, y_options), line, font=font_options)
-            line_height = bbox[3] - bbox[1]
-            y_options += line_height + 15
+        option_lines = layout_lines(options_content, font_options, max_width_options, x_options, y_options,
+                                    line_height(font_options) + 15)
+        draw_lines(draw, option_lines, font_options, tuple(config['font_settings']['font_color_options']))
 
     # Save the slide as an image
     output_filename = f"{output_path}_{slide_type}.png"
@@ -220,6 +216,10 @@ def create_slide(question_content, options_content, background_image, font_quest
 def generate_slides(questions, config, background_image, font_question, font_options, font_answer):
     slides = []
     durations = []
+    slide_dir = config['working_slide_path']
+    manifest = load_manifest(slide_dir) if config.get("render_cache", True) else None
+    style = style_from_config(config, SLIDE_STYLE_KEYS)
+    template_hash = file_hash(config["background_image"])
 
     # Add start slide
     slides.append(create_slide_for_start_or_end(config["start_slide"], config))
@@ -235,29 +235,34 @@ def generate_slides(questions, config, background_image, font_question, font_opt
         question_content = f"Q - {idx + 1}: {question_text}"
         options_content = f"{formatted_options}"
 
-        # Create question slide
-        question_slide = create_slide(
-            question_content=question_content,
-            options_content=options_content,
-            background_image=background_image,
-            font_question=font_question,
-            font_options=font_options,
-            output_path=f"{config['working_slide_path']}/slide_{idx + 1}_question",
-            config=config,
-            slide_type="question"
-        )
+        # Create question slide (reused when unchanged since the last run)
+        question_key = slide_key(SLIDE_RENDERER_VERSION, style, template_hash, "question", question_content,
+                                 options_content)
+        question_slide = render_cached(manifest, f"{slide_dir}/slide_{idx + 1}_question_question.png", question_key,
+                                       lambda: create_slide(
+                                           question_content=question_content,
+                                           options_content=options_content,
+                                           background_image=background_image,
+                                           font_question=font_question,
+                                           font_options=font_options,
+                                           output_path=f"{slide_dir}/slide_{idx + 1}_question",
+                                           config=config,
+                                           slide_type="question"
+                                       ))
 
         # Create answer slide (only the answer)
-        answer_slide = create_slide(
-            question_content=correct_answer,
-            options_content="",
-            background_image=background_image,
-            font_question=font_answer,  # Using font_answer for the answer text
-            font_options=font_answer,  # No options on this slide, but font_answer will be used
-            output_path=f"{config['working_slide_path']}/slide_{idx + 1}_answer",
-            config=config,
-            slide_type="answer"
-        )
+        answer_key = slide_key(SLIDE_RENDERER_VERSION, style, template_hash, "answer", correct_answer)
+        answer_slide = render_cached(manifest, f"{slide_dir}/slide_{idx + 1}_answer_answer.png", answer_key,
+                                     lambda: create_slide(
+                                         question_content=correct_answer,
+                                         options_content="",
+                                         background_image=background_image,
+                                         font_question=font_answer,  # Using font_answer for the answer text
+                                         font_options=font_answer,  # No options on this slide, but font_answer will be used
+                                         output_path=f"{slide_dir}/slide_{idx + 1}_answer",
+                                         config=config,
+                                         slide_type="answer"
+                                     ))
 
         # Add the slides to the list
         slides.extend([question_slide, answer_slide])
@@ -267,6 +272,7 @@ def generate_slides(questions, config, background_image, font_question, font_opt
     slides.append(create_slide_for_start_or_end(config["end_slide"], config))
     durations.append(config["slide_durations"]["end_slide"])
 
+    save_manifest(slide_dir, manifest)
     return slides, durations
 
 
@@ -287,17 +293,12 @@ def create_slide_for_start_or_end(image_path, config):
 
 
 # Create video from slides
-def create_video_from_slides(slides, output_video, durations):
+def create_video_from_slides(slides, output_video, durations, processes=1):
     logging.info("Starting video creation...")
 
-    # Create all clips in one pass with reduced frame rate (e.g., 12 FPS for static slides)
-    clips = [ImageClip(slide).set_duration(duration).set_fps(12) for slide, duration in zip(slides, durations)]
-
-    # Concatenate all slides into a single video
-    video = concatenate_videoclips(clips, method="compose")
-
-    # Save the video with reduced FPS (12 or another value that works well with your slides)
-    video.write_videofile(output_video, fps=12, codec='libx264', preset='fast')
+    # Reduced frame rate (12 FPS is plenty for static slides); with processes > 1 the slides are encoded as
+    # parallel segments joined without re-encoding
+    encode_slideshow(list(zip(slides, durations)), output_video, fps=12, preset='fast', processes=processes)
     logging.info(f"Video saved as: {output_video}")
 
 
@@ -326,7 +327,7 @@ def generate_video(config_file):
     slides, durations = generate_slides(questions, config, background_image, font_question, font_options, font_answer)
 
     # Create the video
-    create_video_from_slides(slides, config["output_video"], durations)
+    create_video_from_slides(slides, config["output_video"], durations, config.get("encode_processes", 1))
 
     end_time = time.time()
     total_time = end_time - start_time
@@ -353,15 +354,15 @@ The filtered questions are randomly sampled per topic (select_random_questions)
 
 ## Slide Creation:
 
-The create_slide function generates individual image slides for both questions and answers. It uses PIL to draw text on images, wrapping the text to fit within a specified width (wrap_text).
+The create_slide function generates individual image slides for both questions and answers. It uses PIL to draw text on images, wrapping the text to fit within a specified pixel width (text_layout.layout_lines).
 Background images and fonts are loaded via load_resources, with fallback to default fonts if any errors occur.
 Slides for questions and answers are created separately, with question slides containing the question text and options, while answer slides contain only the correct answer.
 Start and end slides are created by resizing provided images to the specified aspect ratio (create_slide_for_start_or_end).
 
 ## Video Creation:
 
-Once the slides are created, create_video_from_slides generates a video from these slides using the moviepy library, setting a static FPS (12 frames per second) to optimize for slideshows.
-The video is saved with a specified output file path, using libx264 codec and fast preset to speed up the encoding.
+Once the slides are created, create_video_from_slides generates a video from these slides with the shared slideshow encoder (slideshow_encoder.encode_slideshow), which drives ffmpeg directly with a static FPS (12 frames per second) to optimize for slideshows.
+The video is saved with a specified output file path, using libx264 codec (tuned for still images) and fast preset to speed up the encoding. With encode_processes above 1, the timeline is split at slide boundaries into segments that are encoded in parallel and joined losslessly.
 
 ## Configuration File (config.json):
 
@@ -379,7 +380,7 @@ If the font files are missing, the code uses default fonts.
 slide_durations defines how long each type of slide (start, question, answer, end) stays on screen.
 
 ### Text Wrapping:
-text_wrap_width controls the number of characters per line, affecting how the text is wrapped on the slides.
+Text is wrapped by its measured pixel width to the slide width (minus padding), so no wrap setting is needed.
 
 ### Output Settings:
 output_video sets the name and location of the final MP4 file that will be generated.
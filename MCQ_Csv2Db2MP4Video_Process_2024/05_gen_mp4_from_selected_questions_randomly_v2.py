@@ -1,9 +1,8 @@
 import json
 import logging
 import os
-import random
 import sqlite3
-import textwrap
+import sys
 import time
 from multiprocessing import Pool, cpu_count
 
@@ -11,17 +10,23 @@ from PIL import Image, ImageDraw, ImageFont
 from moviepy.audio.fx.volumex import volumex
 from moviepy.editor import ImageSequenceClip, AudioFileClip, afx
 
+from question_db import (ensure_question_bank_schema, word_limit_clause, sample_topic_questions, connect_for_concurrency,
+                         attach_test_series_db, unreserved_question_clause, run_in_immediate_transaction,
+                         expire_stale_reservations, reserve_questions, release_reserved_questions,
+                         RESERVATION_TTL_HOURS)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from image_template_cache import get_template
+from text_layout import layout_lines, draw_lines
+from slide_render_cache import file_hash, slide_key, style_from_config, load_manifest, save_manifest, render_cached
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-
-# Word wrapping function for better text formatting
-def wrap_text(text, font, max_width, config):
-    wrap_width = config.get("text_wrap_width", 50)
-    wrapped_lines = []
-    for line in text.split('\n'):
-        wrapped_lines.extend(textwrap.wrap(line, width=wrap_width))
-    return wrapped_lines
+# Render cache: bump SLIDE_RENDERER_VERSION whenever the slide drawing code changes
+SLIDE_RENDERER_VERSION = 1
+SLIDE_STYLE_KEYS = ["wide_aspect_ratio", "font_path_question", "font_path_options", "font_path_answer",
+                    "font_settings"]
 
 
 # Ensure that required directories exist
@@ -33,10 +38,10 @@ def ensure_directory_exists(directory):
         logging.info(f"Directory already exists: {directory}")
 
 
-# Connect to SQLite database with error handling
+# Connect to SQLite database with error handling (waits on locks held by other generators)
 def connect_to_db(db_name="questions.db"):
     try:
-        conn = sqlite3.connect(db_name)
+        conn = connect_for_concurrency(db_name)
         logging.info(f"Successfully connected to database: {db_name}")
         return conn
     except sqlite3.Error as e:
@@ -44,66 +49,26 @@ def connect_to_db(db_name="questions.db"):
         raise
 
 
-# Fetch all questions from the DB
-def fetch_all_questions(conn, subject, topics):
-    cursor = conn.cursor()
-    all_questions = []
+# Randomly select questions for each topic inside SQLite (within the word limits, skipping questions reserved by
+# a running 06 generator)
+def select_random_questions(conn, subject, topics, word_limits, seed=None):
+    limit_clause, limit_params = word_limit_clause(*word_limits)
+    where_clause = unreserved_question_clause() + limit_clause
+    selected_questions = []
     for topic_info in topics:
         topic_name = topic_info['topic_name']
+        num_questions_per_topic = topic_info['num_questions_per_topic']
         try:
-            query = '''
-                SELECT question_id, question_text, question_options, correct_answer, topic
-                FROM question_bank
-                WHERE subject = ? AND topic = ?
-                ORDER BY subject, topic, question_id
-            '''
-            cursor.execute(query, (subject, topic_name))
-            topic_questions = cursor.fetchall()
-            all_questions.extend(topic_questions)
-            logging.info(f"Fetched {len(topic_questions)} questions for topic {topic_name}.")
+            topic_questions = sample_topic_questions(conn, subject, topic_name, num_questions_per_topic,
+                                                     where_clause, limit_params, seed)
         except sqlite3.Error as e:
-            logging.error(f"Error fetching questions for topic {topic_name}: {e}")
+            logging.error(f"Error selecting questions for topic {topic_name}: {e}")
             raise
-    logging.info(f"Total questions fetched: {len(all_questions)}.")
-    return all_questions
-
-
-# Filter questions based on question_text and question_options length
-def filter_questions(questions):
-    filtered_questions = []
-    for question in questions:
-        question_id, question_text, question_options, correct_answer, topic = question
-        question_words = len(question_text.split())
-        options_words = len(' '.join(question_options.split('|')).split())
-        total_words = question_words + options_words
-        logging.info(f"Filter criteria: "
-                     f"question_words = {question_words} [<= 45] "
-                     f"options_words = {options_words} [<= 35] "
-                     f"total_words = {total_words} [<=70] ")
-        if question_words <= 45 and options_words <= 35 and total_words <= 70:
-            filtered_questions.append(question)
-            logging.info(f"Filtered IN question {question_id} for clearing length criteria")
-        else:
-            logging.info(f"Filtered OUT question {question_id} for exceeding length criteria.")
-    logging.info(f"Filtered {len(filtered_questions)} questions that met the length criteria.")
-    return filtered_questions
-
-
-# Randomly select questions for each topic
-def select_random_questions(filtered_questions, topics):
-    selected_questions = []
-    for topic_info in topics:
-        topic_name = topic_info['topic_name']
-        num_questions_per_topic = topic_info['num_questions_per_topic']
-        topic_questions = [q for q in filtered_questions if q[4] == topic_name]
         if len(topic_questions) < num_questions_per_topic:
             logging.warning(
                 f"Not enough questions for topic {topic_name}. Selecting all available {len(topic_questions)} questions.")
-            selected_questions.extend(topic_questions)
-        else:
-            random_selection = random.sample(topic_questions, num_questions_per_topic)
-            selected_questions.extend(random_selection)
-        logging.info(f"Randomly selected {len(random_selection)} questions for topic {topic_name}.")
+        selected_questions.extend(topic_questions)
+        logging.info(f"Randomly selected {len(topic_questions)} questions for topic {topic_name}.")
     return selected_questions
 
 
@@ -126,13 +91,25 @@ def remove_duplicates(selected_questions):
     return sorted_unique_questions
 
 
-# Fetch, filter, select, and remove duplicates
-def fetch_and_select_questions(conn, subject, topics):
-    all_questions = fetch_all_questions(conn, subject, topics)
-    filtered_questions = filter_questions(all_questions)
-    selected_questions = select_random_questions(filtered_questions, topics)
-    unique_questions = remove_duplicates(selected_questions)
-    return unique_questions
+# Select within length criteria, remove duplicates and reserve the questions under reservation_name in one
+# BEGIN IMMEDIATE, so 06 generators running side by side skip them until release_reserved_questions.
+# Practice videos are not tests: the questions are never confirmed into test_questions and stay available.
+def fetch_and_select_questions(conn, subject, topics, reservation_name, seed=None,
+                               question_word_limit=45, option_word_limit=35, combined_word_limit=70,
+                               reservation_ttl_hours=RESERVATION_TTL_HOURS):
+    # Make sure the precomputed word count columns and index exist (backfills older databases)
+    ensure_question_bank_schema(conn)
+    attach_test_series_db(conn)
+    word_limits = (question_word_limit, option_word_limit, combined_word_limit)
+
+    def select_and_reserve(conn):
+        expire_stale_reservations(conn, reservation_ttl_hours)
+        selected_questions = select_random_questions(conn, subject, topics, word_limits, seed)
+        unique_questions = remove_duplicates(selected_questions)
+        reserve_questions(conn, reservation_name, unique_questions)
+        return unique_questions
+
+    return run_in_immediate_transaction(conn, select_and_reserve)
 
 
 # Ensure directories exist
@@ -144,7 +121,12 @@ def ensure_directories(config):
 # Load resources for each topic
 def load_resources_for_topic(topic, config):
     try:
-        background_image = Image.open(config["topic_background_images"][topic])
+        # Decoded and resized to the slide size once; the slide renderers copy it
+        target_size = None
+        if "wide_aspect_ratio" in config:
+            target_size = (config["wide_aspect_ratio"]["width"], config["wide_aspect_ratio"]["height"])
+        background_image = get_template(config["topic_background_images"][topic], target_size,
+                                        cache_dir=config.get("template_cache_dir"))
         logging.info(f"Loaded background image for topic: {topic}")
     except IOError as e:
         logging.error(f"Error loading background image: {e}")
@@ -168,25 +150,24 @@ def create_question_slide(question_content, options_content, background_image, f
                           config):
     img = background_image.copy()
     if "wide_aspect_ratio" in config:
-        img = img.resize((config["wide_aspect_ratio"]["width"], config["wide_aspect_ratio"]["height"]))
+        target_size = (config["wide_aspect_ratio"]["width"], config["wide_aspect_ratio"]["height"])
+        if img.size != target_size:
+            img = img.resize(target_size)
     draw = ImageDraw.Draw(img)
 
     # Position for question text
     x_question, y_question = 120, 150
-    wrapped_question = wrap_text(question_content, font_question, config.get("text_wrap_width", 50), config)
-    for line in wrapped_question:
-        draw.text((x_question, y_question), line, font=font_question,
-                  fill=tuple(config['font_settings']['font_color_question']))
-        y_question += 80
+    question_lines = layout_lines(question_content, font_question, img.width - 2 * x_question, x_question, y_question,
+                                  line_step=80)
+    draw_lines(draw, question_lines, font_question, tuple(config['font_settings']['font_color_question']))
+    y_question += len(question_lines) * 80
 
     # Options
     if options_content:
         x_options, y_options = 120, y_question + 120
-        wrapped_options = wrap_text(options_content, font_options, config.get("text_wrap_width", 50), config)
-        for line in wrapped_options:
-            draw.text((x_options, y_options), line, font=font_options,
-                      fill=tuple(config['font_settings']['font_color_options']))
-            y_options += 90
+        option_lines = layout_lines(options_content, font_options, img.width - 2 * x_options, x_options, y_options,
+                                    line_step=90)
+        draw_lines(draw, option_lines, font_options, tuple(config['font_settings']['font_color_options']))
 
     # Save slide
     output_filename = f"{output_path}_question.png"
@@ -197,16 +178,15 @@ def create_question_slide(question_content, options_content, background_image, f
 def create_answer_slide(answer_content, background_image, font_answer, output_path, config):
     img = background_image.copy()
     if "wide_aspect_ratio" in config:
-        img = img.resize((config["wide_aspect_ratio"]["width"], config["wide_aspect_ratio"]["height"]))
+        target_size = (config["wide_aspect_ratio"]["width"], config["wide_aspect_ratio"]["height"])
+        if img.size != target_size:
+            img = img.resize(target_size)
     draw = ImageDraw.Draw(img)
 
     # Position for answer text
     x_answer, y_answer = 120, 480
-    wrapped_answer = wrap_text(answer_content, font_answer, config.get("text_wrap_width", 50), config)
-    for line in wrapped_answer:
-        draw.text((x_answer, y_answer), line, font=font_answer,
-                  fill=tuple(config['font_settings']['font_color_answer']))
-        y_answer += 80
+    answer_lines = layout_lines(answer_content, font_answer, img.width - 2 * x_answer, x_answer, y_answer, line_step=80)
+    draw_lines(draw, answer_lines, font_answer, tuple(config['font_settings']['font_color_answer']))
 
     # Save slide
     output_filename = f"{output_path}_answer.png"
@@ -214,11 +194,15 @@ def create_answer_slide(answer_content, background_image, font_answer, output_pa
     return output_filename
 
 
-# Create and save slides for questions and answers
+# Create and save slides for questions and answers.
+# Slides whose text, style and topic background are unchanged since the last run (per the render manifest) are reused.
 def generate_slides(questions, config, topic_backgrounds):
     slides = []
     durations = []
     pool = Pool(cpu_count())  # Use multiple processors
+    slide_dir = config['working_slide_path']
+    manifest = load_manifest(slide_dir) if config.get("render_cache", True) else None
+    style = style_from_config(config, SLIDE_STYLE_KEYS)
 
     # Load fonts from config
     font_question = ImageFont.truetype(config["font_path_question"], config["font_settings"]["font_size_question"])
@@ -239,13 +223,17 @@ def generate_slides(questions, config, topic_backgrounds):
     # 2. Create question and answer slides
     for idx, (question_id, question_text, question_options, correct_answer, topic) in enumerate(questions):
         background_image = topic_backgrounds[topic]
+        template_hash = file_hash(config["topic_background_images"][topic])
         question_content = f"Q - {idx + 1}: {question_text}"
         options_content = '\n'.join([opt.strip() for opt in question_options.replace('|', '\n').splitlines()])
 
-        # Create question slide
-        question_slide_output = f"{config['working_slide_path']}/slide_{idx + 1}_question.png"
-        slides.append(
-            pool.apply_async(create_question_slide, (
+        # Create question slide (create_question_slide appends "_question.png" to the output path)
+        question_slide_output = f"{slide_dir}/slide_{idx + 1}_question.png"
+        question_key = slide_key(SLIDE_RENDERER_VERSION, style, template_hash, "question", question_content,
+                                 options_content)
+        slides.append(render_cached(
+            manifest, f"{question_slide_output}_question.png", question_key,
+            lambda: pool.apply_async(create_question_slide, (
                 question_content,
                 options_content,
                 background_image,
@@ -254,20 +242,22 @@ def generate_slides(questions, config, topic_backgrounds):
                 question_slide_output,
                 config
             )).get()
-        )
+        ))
         logging.info(f"Slide for question and options {idx + 1} created")
 
-        # Create answer slide
-        answer_slide_output = f"{config['working_slide_path']}/slide_{idx + 1}_answer.png"
-        slides.append(
-            pool.apply_async(create_answer_slide, (
+        # Create answer slide (create_answer_slide appends "_answer.png" to the output path)
+        answer_slide_output = f"{slide_dir}/slide_{idx + 1}_answer.png"
+        answer_key = slide_key(SLIDE_RENDERER_VERSION, style, template_hash, "answer", correct_answer)
+        slides.append(render_cached(
+            manifest, f"{answer_slide_output}_answer.png", answer_key,
+            lambda: pool.apply_async(create_answer_slide, (
                 correct_answer,
                 background_image,
                 font_answer,
                 answer_slide_output,
                 config
             )).get()
-        )
+        ))
 
         logging.info(f"Slide for answer {idx + 1} created")
 
@@ -288,6 +278,7 @@ def generate_slides(questions, config, topic_backgrounds):
     durations.append(config["slide_durations"]["end_slide"])
 
     logging.info("End slide created")
+    save_manifest(slide_dir, manifest)
 
     return slides, durations
 
@@ -348,17 +339,26 @@ def generate_video(config_file):
 
     ensure_directories(config)
 
+    # The questions stay reserved under the video's name while it renders
+    reservation_name = config.get("test_name", os.path.splitext(os.path.basename(config["output_video"]))[0])
     conn = connect_to_db()
-    questions = fetch_and_select_questions(conn, subject, topics)
-
-    # Load different background images for each topic
-    topic_backgrounds = {topic_info["topic_name"]: load_resources_for_topic(topic_info["topic_name"], config)[0] for
-                         topic_info in topics}
+    questions = fetch_and_select_questions(conn, subject, topics, reservation_name, seed=config.get("random_seed"),
+                                           reservation_ttl_hours=config.get("reservation_ttl_hours",
+                                                                            RESERVATION_TTL_HOURS))
 
-    slides, durations = generate_slides(questions, config, topic_backgrounds)
-
-    # # Create the video with continuous audio
-    create_video_from_slides(slides, config["output_video"], durations, audio_file, config)
+    try:
+        # Load different background images for each topic
+        topic_backgrounds = {topic_info["topic_name"]: load_resources_for_topic(topic_info["topic_name"], config)[0]
+                             for topic_info in topics}
+
+        slides, durations = generate_slides(questions, config, topic_backgrounds)
+
+        # # Create the video with continuous audio
+        create_video_from_slides(slides, config["output_video"], durations, audio_file, config)
+    finally:
+        # Also on failure or Ctrl-C
+        release_reserved_questions(conn, reservation_name)
+        conn.close()
 
     end_time = time.time()
     total_time = end_time - start_time
@@ -0,0 +1,352 @@
+import hashlib
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+# Shared helpers for the question_bank schema used by the loader and the video generators
+
+# How long a connection waits on a locked database, and how often a write transaction is retried after that
+BUSY_TIMEOUT_SECONDS = 30
+TRANSACTION_RETRIES = 5
+
+# Reservations older than this belong to a generator that was killed or crashed before releasing them
+RESERVATION_TTL_HOURS = 12
+
+
+# Word count of a question text
+def count_words(text):
+    return len(text.split()) if text else 0
+
+
+# Word count of the options (split by the pipe '|' delimiter if multiple options are present)
+def count_option_words(options_text):
+    if not options_text:
+        return 0
+    return sum(len(opt.split()) for opt in options_text.split('|'))
+
+
+# Add the precomputed word count columns and the (subject, topic) index, backfilling old rows
+def ensure_question_bank_schema(conn):
+    cursor = conn.cursor()
+    existing_columns = {row[1] for row in cursor.execute("PRAGMA table_info(question_bank)")}
+    if not existing_columns:
+        # Table not created yet; the loader creates it with the full schema
+        return
+
+    for column in ("question_word_count", "options_word_count"):
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE question_bank ADD COLUMN {column} INTEGER")
+            logging.info(f"Added column {column} to question_bank")
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_question_bank_subject_topic
+        ON question_bank (subject, topic)
+    ''')
+
+    # Backfill rows loaded before the word count columns existed
+    conn.create_function("count_words", 1, count_words, deterministic=True)
+    conn.create_function("count_option_words", 1, count_option_words, deterministic=True)
+    cursor.execute('''
+        UPDATE question_bank
+        SET question_word_count = count_words(question_text),
+            options_word_count = count_option_words(question_options)
+        WHERE question_word_count IS NULL OR options_word_count IS NULL
+    ''')
+    if cursor.rowcount > 0:
+        logging.info(f"Backfilled word counts for {cursor.rowcount} questions")
+    conn.commit()
+
+
+# SQL predicate applying the question/options/combined word limits on the precomputed columns
+def word_limit_clause(question_word_limit, option_word_limit, combined_word_limit):
+    clause = '''
+        AND question_word_count <= ?
+        AND options_word_count <= ?
+        AND question_word_count + options_word_count <= ?
+    '''
+    return clause, (question_word_limit, option_word_limit, combined_word_limit)
+
+
+# Create the test_questions log table (in the given attached schema) with an index on question_id
+def ensure_test_questions_table(conn, schema="main"):
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}.test_questions (
+            test_name TEXT,
+            topic_name TEXT,
+            question_id TEXT,  -- Use TEXT type for UUID
+            question_no INTEGER,
+            answer TEXT,
+            date_created TEXT
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE INDEX IF NOT EXISTS {schema}.idx_test_questions_question_id
+        ON test_questions (question_id)
+    ''')
+    conn.commit()
+
+
+# Create the reservation table: questions claimed by a generator that is still rendering
+def ensure_reservation_table(conn, schema="main"):
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}.question_reservations (
+            question_id TEXT PRIMARY KEY,
+            test_name TEXT,
+            reserved_on TEXT
+        )
+    ''')
+    conn.commit()
+
+
+# Create the per-question usage counters used by the least-recently-used rotation.
+# Counters are seeded once from the existing test_questions history, then updated incrementally. The
+# (last_used_on, usage_count) index lets the rotation walk used questions oldest first and stop at the sample size.
+def ensure_usage_table(conn, schema="main"):
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}.question_usage (
+            question_id TEXT PRIMARY KEY,
+            usage_count INTEGER NOT NULL,
+            last_used_on TEXT NOT NULL
+        )
+    ''')
+    conn.execute(f'''
+        CREATE INDEX IF NOT EXISTS {schema}.idx_question_usage_last_used
+        ON question_usage (last_used_on, usage_count)
+    ''')
+    if conn.execute(f"SELECT 1 FROM {schema}.question_usage LIMIT 1").fetchone() is None:
+        cursor = conn.execute(f'''
+            INSERT INTO {schema}.question_usage (question_id, usage_count, last_used_on)
+            SELECT question_id, COUNT(*), MAX(date_created)
+            FROM {schema}.test_questions
+            GROUP BY question_id
+        ''')
+        if cursor.rowcount > 0:
+            logging.info(f"Seeded usage counters for {cursor.rowcount} questions from test_questions")
+    conn.commit()
+
+
+# Open a connection that waits for other generators instead of failing with "database is locked"
+def connect_for_concurrency(db_name):
+    conn = sqlite3.connect(db_name, timeout=BUSY_TIMEOUT_SECONDS)
+    # WAL lets readers run while another generator holds the write lock
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+# Attach test_series.db to the questions connection so used questions are excluded inside SQLite
+def attach_test_series_db(conn, db_name="test_series.db"):
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    if "test_series" not in attached:
+        conn.execute("ATTACH DATABASE ? AS test_series", (db_name,))
+        conn.execute("PRAGMA test_series.journal_mode=WAL")
+        logging.info(f"Attached {db_name} as test_series")
+    ensure_test_questions_table(conn, schema="test_series")
+    ensure_reservation_table(conn, schema="test_series")
+    ensure_usage_table(conn, schema="test_series")
+
+
+# Run work(conn) inside BEGIN IMMEDIATE, retrying when the write lock stays busy past the timeout
+def run_in_immediate_transaction(conn, work, retries=TRANSACTION_RETRIES):
+    for attempt in range(1, retries + 1):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) or attempt == retries:
+                raise
+            logging.warning(f"Database is busy, retrying transaction ({attempt}/{retries})")
+            time.sleep(attempt)
+            continue
+        try:
+            result = work(conn)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+
+
+# Drop reservations left behind by generators that died without releasing them, so their questions return to
+# the pool (call inside run_in_immediate_transaction, before selecting)
+def expire_stale_reservations(conn, ttl_hours=RESERVATION_TTL_HOURS):
+    cutoff = (datetime.now() - timedelta(hours=ttl_hours)).strftime('%Y-%m-%d %H:%M:%S')
+    cursor = conn.execute('''
+        DELETE FROM test_series.question_reservations WHERE reserved_on IS NULL OR reserved_on < ?
+    ''', (cutoff,))
+    if cursor.rowcount > 0:
+        logging.warning(f"Expired {cursor.rowcount} question reservations older than {ttl_hours} hours")
+
+
+# Claim the selected questions for a test (call inside run_in_immediate_transaction)
+def reserve_questions(conn, test_name, selected_questions):
+    reserved_on = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.executemany('''
+        INSERT INTO test_series.question_reservations (question_id, test_name, reserved_on)
+        VALUES (?, ?, ?)
+    ''', [(question[0], test_name, reserved_on) for question in selected_questions])
+
+
+# Log a rendered test into test_questions and drop its reservations in one transaction
+def confirm_reserved_questions(conn, test_name, selected_questions):
+    def confirm(conn):
+        date_created = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conn.executemany('''
+            INSERT INTO test_series.test_questions
+                (test_name, topic_name, question_id, question_no, answer, date_created)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(test_name, question[4], question[0], question_no, question[3], date_created)
+              for question_no, question in enumerate(selected_questions, start=1)])
+        conn.executemany('''
+            INSERT INTO test_series.question_usage (question_id, usage_count, last_used_on)
+            VALUES (?, 1, ?)
+            ON CONFLICT (question_id) DO UPDATE
+            SET usage_count = usage_count + 1, last_used_on = excluded.last_used_on
+        ''', [(question[0], date_created) for question in selected_questions])
+        conn.execute("DELETE FROM test_series.question_reservations WHERE test_name = ?", (test_name,))
+
+    run_in_immediate_transaction(conn, confirm)
+
+
+# Release the reservations of a test whose render failed so other generators can pick the questions
+def release_reserved_questions(conn, test_name):
+    def release(conn):
+        cursor = conn.execute("DELETE FROM test_series.question_reservations WHERE test_name = ?", (test_name,))
+        logging.info(f"Released {cursor.rowcount} reserved questions for {test_name}")
+
+    run_in_immediate_transaction(conn, release)
+
+
+# SQL predicate excluding questions reserved by a running generator (indexed anti-join)
+def unreserved_question_clause():
+    return '''
+        AND NOT EXISTS (
+            SELECT 1 FROM test_series.question_reservations AS reserved
+            WHERE reserved.question_id = question_bank.question_id
+        )
+    '''
+
+
+# SQL predicate excluding questions already logged in test_series.test_questions or reserved by a
+# running generator (indexed anti-joins)
+def unused_question_clause():
+    return '''
+        AND NOT EXISTS (
+            SELECT 1 FROM test_series.test_questions AS used
+            WHERE used.question_id = question_bank.question_id
+        )
+    ''' + unreserved_question_clause()
+
+
+# Deterministic per-row sort key for seeded sampling. A digest rather than hash(): string hashes are salted per
+# process and tuple hashing changes between Python versions, so the same seed picks the same questions everywhere.
+def _seeded_rank(seed, rowid):
+    digest = hashlib.blake2b(f"{seed}:{rowid}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+# Draw up to sample_size random questions for one topic inside SQLite.
+# Every row gets a random key and SQLite's top-N sorter keeps the smallest sample_size keys
+# (equivalent to reservoir sampling), so only the chosen rows cross into Python.
+# With least_recently_used, never-used questions are sampled first the same way; any shortfall is topped up from
+# the used ones, longest ago / least often first (see sample_least_recently_used).
+def sample_topic_questions(conn, subject, topic, sample_size, where_clause="", params=(), seed=None,
+                           least_recently_used=False):
+    if seed is None:
+        order_key, order_params = "random()", ()
+    else:
+        conn.create_function("seeded_rank", 2, _seeded_rank, deterministic=True)
+        order_key, order_params = "seeded_rank(?, question_bank.rowid)", (seed,)
+
+    usage_clause = ""
+    if least_recently_used:
+        usage_clause = '''
+            AND NOT EXISTS (
+                SELECT 1 FROM test_series.question_usage AS usage
+                WHERE usage.question_id = question_bank.question_id
+            )
+        '''
+
+    query = '''
+        SELECT question_bank.question_id, question_text, question_options, correct_answer, topic
+        FROM question_bank
+        WHERE subject = ? AND topic = ?
+        {}
+        {}
+        ORDER BY {}
+        LIMIT ?
+    '''.format(usage_clause, where_clause, order_key)
+    cursor = conn.execute(query, (subject, topic) + tuple(params) + order_params + (sample_size,))
+    questions = cursor.fetchall()
+    if least_recently_used and len(questions) < sample_size:
+        questions += sample_least_recently_used(conn, subject, topic, sample_size - len(questions), where_clause,
+                                                params, order_key, order_params)
+    return questions
+
+
+# Top up an LRU sample with used questions, longest ago / least often first; the random key only breaks ties.
+# The CROSS JOIN keeps question_usage as the outer table, so SQLite walks idx_question_usage_last_used in order,
+# checks each question's topic through the primary key and stops once sample_size rows match.
+def sample_least_recently_used(conn, subject, topic, sample_size, where_clause, params, order_key, order_params):
+    query = '''
+        SELECT question_bank.question_id, question_text, question_options, correct_answer, topic
+        FROM test_series.question_usage AS usage
+        CROSS JOIN question_bank ON question_bank.question_id = usage.question_id
+        WHERE subject = ? AND topic = ?
+        {}
+        ORDER BY usage.last_used_on, usage.usage_count, {}
+        LIMIT ?
+    '''.format(where_clause, order_key)
+    cursor = conn.execute(query, (subject, topic) + tuple(params) + order_params + (sample_size,))
+    return cursor.fetchall()
+
+
+# Randomly select questions per topic inside SQLite (unused questions only, within the word limits if given).
+# With rotation, used questions stay eligible and the least recently used ones are preferred.
+def select_random_questions(conn, subject, topics, word_limits, seed=None, rotation=False):
+    limit_clause, limit_params = word_limit_clause(*word_limits) if word_limits else ("", ())
+    # Used and reserved questions are excluded with anti-joins against the attached test_series.db
+    exclusion_clause = unreserved_question_clause() if rotation else unused_question_clause()
+    where_clause = exclusion_clause + limit_clause
+    selected_questions = []
+    for topic_info in topics:
+        topic_name = topic_info['topic_name']
+        num_questions_per_topic = topic_info['num_questions_per_topic']
+        try:
+            topic_questions = sample_topic_questions(conn, subject, topic_name, num_questions_per_topic,
+                                                     where_clause, limit_params, seed,
+                                                     least_recently_used=rotation)
+        except sqlite3.Error as e:
+            logging.error(f"Error selecting questions for topic {topic_name}: {e}")
+            raise
+        if len(topic_questions) < num_questions_per_topic:
+            logging.warning(f"Not enough questions for topic {topic_name}. Selecting all available.")
+        selected_questions.extend(topic_questions)
+        logging.info(f"Randomly selected {len(topic_questions)} questions for topic {topic_name}.")
+    return selected_questions
+
+
+# Select and reserve questions for the test; selection and reservation happen under one BEGIN IMMEDIATE
+# so generators running side by side never pick the same question
+def fetch_and_select_questions(conn, subject, topics, test_name, seed=None, rotation=False, auto_fit=False,
+                               question_word_limit=50, option_word_limit=50, combined_word_limit=80,
+                               reservation_ttl_hours=RESERVATION_TTL_HOURS):
+    # Make sure the precomputed word count columns and index exist (backfills older databases)
+    ensure_question_bank_schema(conn)
+    attach_test_series_db(conn)
+
+    # Auto-fit slides shrink long questions to fit, so no question is excluded for its length
+    word_limits = None if auto_fit else (question_word_limit, option_word_limit, combined_word_limit)
+
+    def select_and_reserve(conn):
+        expire_stale_reservations(conn, reservation_ttl_hours)
+        selected_questions = select_random_questions(conn, subject, topics, word_limits, seed, rotation)
+        reserve_questions(conn, test_name, selected_questions)
+        return selected_questions
+
+    selected_questions = run_in_immediate_transaction(conn, select_and_reserve)
+
+    logging.info(f"Selected and reserved {len(selected_questions)} questions"
+                 f"{'' if auto_fit else ' within word limits'}.")
+
+    return selected_questions
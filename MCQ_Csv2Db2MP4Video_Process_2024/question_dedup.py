@@ -0,0 +1,204 @@
+import hashlib
+import logging
+import re
+from array import array
+from datetime import datetime
+
+# Exact and near-duplicate detection for question_bank.
+# Each question gets a hash of its normalized text and options, a hash of its answer and a MinHash signature
+# over word shingles. The same text with the same answer is an exact duplicate; the same text with a different
+# answer is a corrected (or wrong) answer key, which is never loaded silently next to the old copy.
+# The signature is split into LSH bands stored in an indexed side table, so a lookup only compares against
+# questions that share at least one band bucket and have the same answer instead of scanning the whole bank.
+# Near matches are candidates for review, not proof of a duplicate: templated questions like
+# "Who was the father of X?" / "Who was the mother of X?" differ in a single word.
+
+SHINGLE_SIZE = 2  # words; a changed word breaks every shingle it is part of
+NUM_PERMUTATIONS = 32
+NUM_BANDS = 8
+ROWS_PER_BAND = NUM_PERMUTATIONS // NUM_BANDS
+NEAR_DUPLICATE_THRESHOLD = 0.9
+
+# Bumped whenever the fingerprint recipe changes; older rows are recomputed by backfill_fingerprints
+FINGERPRINT_VERSION = 3
+
+# Kinds of match returned by find_duplicate
+EXACT_DUPLICATE = 'exact'
+ANSWER_CHANGED = 'answer_changed'
+NEAR_DUPLICATE = 'near'
+
+# blake2b personalisations; each digest yields 16 independent 32-bit hash values per shingle
+_HASH_PERSONS = [f"minhash{i}".encode('ascii') for i in range(NUM_PERMUTATIONS // 16)]
+
+
+# Lowercase, drop option labels like "A)" and punctuation, collapse whitespace
+def normalize_text(text):
+    text = text.lower()
+    text = re.sub(r'(^|\|)\s*[a-d]\)', ' ', text)
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+
+# MinHash signature of the word shingles of a normalized text
+def minhash_signature(normalized_text):
+    words = normalized_text.split()
+    if len(words) <= SHINGLE_SIZE:
+        shingles = {normalized_text}
+    else:
+        shingles = {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    hash_rows = []
+    for shingle in shingles:
+        data = shingle.encode('utf-8')
+        row = array('I')
+        for person in _HASH_PERSONS:
+            row.frombytes(hashlib.blake2b(data, digest_size=64, person=person).digest())
+        hash_rows.append(row)
+    # Column-wise minimum: one min-hash per hash function
+    return tuple(map(min, zip(*hash_rows)))
+
+
+# Content hash, answer hash and MinHash signature for a question (cheap enough to compute in the parser workers).
+# The content hash leaves the answer out, so a reloaded question with a corrected answer key still finds its old copy.
+def fingerprint_question(question_text, question_options, correct_answer):
+    normalized = normalize_text(f"{question_text} | {question_options}")
+    answer_hash = hashlib.sha1(normalize_text(correct_answer or '').encode('utf-8')).hexdigest()
+    content_hash = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+    return content_hash, answer_hash, minhash_signature(normalized)
+
+
+# One bucket key per LSH band; questions sharing any bucket become near-duplicate candidates
+def band_buckets(signature):
+    buckets = []
+    for band in range(NUM_BANDS):
+        rows = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(array('I', rows).tobytes(), digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, 'little', signed=True)))
+    return buckets
+
+
+# Fraction of matching MinHash components, an estimate of the shingle Jaccard similarity
+def estimated_similarity(signature, other_signature):
+    return sum(1 for a, b in zip(signature, other_signature) if a == b) / NUM_PERMUTATIONS
+
+
+# Create the fingerprint, LSH bucket and near-duplicate review side tables
+def ensure_dedup_tables(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS question_fingerprints (
+            question_id TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            signature BLOB NOT NULL,
+            answer_hash TEXT,
+            fingerprint_version INTEGER
+        )
+    ''')
+    # Fingerprint tables created before answers were part of the fingerprint
+    existing_columns = {row[1] for row in cursor.execute("PRAGMA table_info(question_fingerprints)")}
+    for column, column_type in (("answer_hash", "TEXT"), ("fingerprint_version", "INTEGER")):
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE question_fingerprints ADD COLUMN {column} {column_type}")
+            logging.info(f"Added column {column} to question_fingerprints")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_question_fingerprints_content_hash
+        ON question_fingerprints (content_hash)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS question_lsh_buckets (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            question_id TEXT NOT NULL,
+            PRIMARY KEY (band, bucket, question_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_question_lsh_buckets_question_id
+        ON question_lsh_buckets (question_id)
+    ''')
+    # Near matches and changed answers found at load time; both questions are kept until someone reviews the pair
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS question_near_duplicates (
+            question_id TEXT NOT NULL,
+            duplicate_of TEXT NOT NULL,
+            similarity REAL NOT NULL,
+            detected_on TEXT NOT NULL,
+            PRIMARY KEY (question_id, duplicate_of)
+        )
+    ''')
+    conn.commit()
+
+
+# Fingerprint questions loaded before the side tables existed or with an older fingerprint recipe
+def backfill_fingerprints(conn):
+    rows = conn.execute('''
+        SELECT question_bank.question_id, question_text, question_options, correct_answer,
+               question_fingerprints.question_id IS NOT NULL
+        FROM question_bank
+        LEFT JOIN question_fingerprints ON question_fingerprints.question_id = question_bank.question_id
+        WHERE question_fingerprints.question_id IS NULL
+           OR question_fingerprints.fingerprint_version IS NOT ?
+    ''', (FINGERPRINT_VERSION,)).fetchall()
+    for question_id, question_text, question_options, correct_answer, indexed in rows:
+        content_hash, answer_hash, signature = fingerprint_question(question_text, question_options, correct_answer)
+        index_question(conn, question_id, content_hash, answer_hash, signature, replace=indexed)
+    if rows:
+        logging.info(f"Fingerprinted {len(rows)} existing questions")
+    conn.commit()
+
+
+# Add the fingerprint and LSH buckets of a question (replace=True refreshes an already indexed question)
+def index_question(conn, question_id, content_hash, answer_hash, signature, replace=False):
+    conn.execute('''
+        INSERT OR REPLACE INTO question_fingerprints
+            (question_id, content_hash, signature, answer_hash, fingerprint_version)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (question_id, content_hash, array('I', signature).tobytes(), answer_hash, FINGERPRINT_VERSION))
+    if replace:
+        conn.execute("DELETE FROM question_lsh_buckets WHERE question_id = ?", (question_id,))
+    conn.executemany('''
+        INSERT INTO question_lsh_buckets (band, bucket, question_id) VALUES (?, ?, ?)
+    ''', [(band, bucket, question_id) for band, bucket in band_buckets(signature)])
+
+
+# Return (question_id, similarity, kind) of an existing match, or None. kind is EXACT_DUPLICATE (same text and
+# answer), ANSWER_CHANGED (same text, different answer) or NEAR_DUPLICATE.
+# Near duplicates must have the same answer: a one-word change that flips the answer is a different question.
+def find_duplicate(conn, content_hash, answer_hash, signature, threshold=NEAR_DUPLICATE_THRESHOLD):
+    same_text = conn.execute('''
+        SELECT question_id, answer_hash FROM question_fingerprints WHERE content_hash = ?
+    ''', (content_hash,)).fetchall()
+    for question_id, existing_answer_hash in same_text:
+        if existing_answer_hash == answer_hash:
+            return question_id, 1.0, EXACT_DUPLICATE
+    if same_text:
+        return same_text[0][0], 1.0, ANSWER_CHANGED
+
+    candidate_ids = set()
+    for band, bucket in band_buckets(signature):
+        candidate_ids.update(row[0] for row in conn.execute('''
+            SELECT question_id FROM question_lsh_buckets WHERE band = ? AND bucket = ?
+        ''', (band, bucket)))
+    if not candidate_ids:
+        return None
+
+    best_match = None
+    placeholders = ','.join('?' * len(candidate_ids))
+    for question_id, blob in conn.execute(f'''
+        SELECT question_id, signature FROM question_fingerprints
+        WHERE question_id IN ({placeholders}) AND answer_hash = ?
+    ''', tuple(candidate_ids) + (answer_hash,)):
+        other_signature = array('I')
+        other_signature.frombytes(blob)
+        similarity = estimated_similarity(signature, other_signature)
+        if similarity >= threshold and (best_match is None or similarity > best_match[1]):
+            best_match = (question_id, similarity, NEAR_DUPLICATE)
+    return best_match
+
+
+# Remember a near match or a changed answer for review instead of dropping either question
+def record_near_duplicate(conn, question_id, duplicate_of, similarity):
+    detected_on = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    conn.execute('''
+        INSERT OR REPLACE INTO question_near_duplicates (question_id, duplicate_of, similarity, detected_on)
+        VALUES (?, ?, ?, ?)
+    ''', (question_id, duplicate_of, similarity, detected_on))
@@ -0,0 +1,241 @@
+import logging
+import os
+import sys
+import time
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from image_template_cache import get_template
+from text_layout import layout_lines, draw_lines, break_lines, load_font, largest_fitting_size
+from slide_render_cache import (file_hash, slide_key, style_from_config, load_manifest, save_manifest, is_fresh,
+                                record, render_cached)
+
+# Slide helpers shared by the 06 test series generators.
+# Slides are handed on as PNG paths, or as RGB frames in "in_memory_frames" mode; the slideshow encoder streams
+# frames straight to ffmpeg, so in that mode no slide image is written unless "save_slide_images" asks for it.
+
+# Render cache: bump SLIDE_RENDERER_VERSION whenever the slide drawing code changes
+SLIDE_RENDERER_VERSION = 1
+SLIDE_STYLE_KEYS = ["wide_aspect_ratio", "font_path_question", "font_path_options", "font_settings",
+                    "auto_fit_text", "min_font_size"]
+
+
+# Hand a rendered slide on: its PNG path normally, or its RGB frame in "in_memory_frames" mode, where the
+# PNG is only written when the "save_slide_images" debug flag asks for it
+def emit_slide(img, output_filename, config):
+    if not config.get("in_memory_frames", False):
+        img.save(output_filename)
+        return output_filename
+    if config.get("save_slide_images", False):
+        img.save(output_filename)
+    return np.asarray(img.convert("RGB"))
+
+
+# (width, height) of a slide given as an RGB frame or an image file (only the file header is read)
+def slide_size(slide):
+    if isinstance(slide, np.ndarray):
+        return slide.shape[1], slide.shape[0]
+    with Image.open(slide) as img:
+        return img.size
+
+
+# Resize a slide file to a "_resized.png" copy (RGB, no alpha)
+def resize_image(slide, target_size):
+    with Image.open(slide) as img:
+        img_resized = img.resize(target_size).convert("RGB")
+    resized_slide_path = slide.replace(".png", "_resized.png")
+    img_resized.save(resized_slide_path, format="PNG")
+    return resized_slide_path
+
+
+# Bring all slides to the target size; slides that already match (the rendered ones) are passed through as-is.
+# Frames, and in "in_memory_frames" mode every other slide, are resized in memory; files are otherwise resized
+# to copies on a process pool.
+def resize_images_to_same_size(slides, target_size, config, processes=None):
+    mismatched = [idx for idx, slide in enumerate(slides) if slide_size(slide) != target_size]
+    if not mismatched:
+        logging.info(f"All {len(slides)} slides already have the size {target_size}, skipping resize")
+        return slides
+
+    resized_slides = list(slides)
+    mismatched_files = []
+    for idx in mismatched:
+        if isinstance(slides[idx], np.ndarray):
+            resized_slides[idx] = np.asarray(Image.fromarray(slides[idx]).resize(target_size))
+        elif config.get("in_memory_frames", False):
+            with Image.open(slides[idx]) as img:
+                resized_slides[idx] = np.asarray(img.resize(target_size).convert("RGB"))
+        else:
+            mismatched_files.append(idx)
+    if mismatched_files:
+        processes = min(processes or cpu_count(), len(mismatched_files))
+        logging.info(f"Resizing {len(mismatched_files)} slides using {processes} CPUs")
+        with Pool(processes) as pool:
+            resized_files = pool.starmap(resize_image, [(slides[idx], target_size) for idx in mismatched_files])
+        for idx, resized_file in zip(mismatched_files, resized_files):
+            resized_slides[idx] = resized_file
+    return resized_slides
+
+
+# Auto-fit: largest question font size (options and line spacing scaled along) at which the question and its
+# options fit on the slide. Returns the fonts and the scale applied to the configured sizes.
+def fit_question_fonts(question_content, options_content, slide_size, config):
+    font_settings = config["font_settings"]
+    max_size = font_settings["font_size_question"]
+    options_ratio = font_settings["font_size_options"] / max_size
+    slide_width, slide_height = slide_size
+    text_width = slide_width - 2 * 120
+
+    def fonts_for(size):
+        return (load_font(config["font_path_question"], size),
+                load_font(config["font_path_options"], max(1, round(size * options_ratio))))
+
+    def fits(size):
+        scale = size / max_size
+        font_question, font_options = fonts_for(size)
+        height = len(break_lines(question_content, font_question, text_width)) * 80 * scale
+        if options_content:
+            height += 120 * scale + len(break_lines(options_content, font_options, text_width)) * 90 * scale
+        # Same top and bottom margin as the fixed layout
+        return 80 + height <= slide_height - 80
+
+    size = largest_fitting_size(fits, min(config.get("min_font_size", 24), max_size), max_size)
+    return fonts_for(size) + (size / max_size,)
+
+
+# Create question slide with proper size from config
+def create_question_slide(question_content, options_content, background_image, font_question, font_options, output_path,
+                          config):
+    # Resize the background image to the wide aspect ratio (callers pass it pre-resized)
+    target_size = (config["wide_aspect_ratio"]["width"], config["wide_aspect_ratio"]["height"])
+    img = background_image.copy()
+    if img.size != target_size:
+        img = img.resize(target_size)
+    draw = ImageDraw.Draw(img)
+
+    # Long questions are shrunk to fit instead of being filtered out by word count
+    scale = 1
+    if config.get("auto_fit_text", False):
+        font_question, font_options, scale = fit_question_fonts(question_content, options_content, img.size, config)
+    question_step, options_step = round(80 * scale), round(90 * scale)
+
+    # Position for question text
+    x_question, y_question = 120, 80
+    question_lines = layout_lines(question_content, font_question, img.width - 2 * x_question, x_question, y_question,
+                                  line_step=question_step)
+    draw_lines(draw, question_lines, font_question, tuple(config['font_settings']['font_color_question']))
+    y_question += len(question_lines) * question_step
+
+    # Options
+    if options_content:
+        x_options, y_options = 120, y_question + round(120 * scale)
+        option_lines = layout_lines(options_content, font_options, img.width - 2 * x_options, x_options, y_options,
+                                    line_step=options_step)
+        draw_lines(draw, option_lines, font_options, tuple(config['font_settings']['font_color_options']))
+
+    # Save slide (or hand over the frame in in-memory mode)
+    return emit_slide(img, f"{output_path}_question.png", config)
+
+
+# Save a start/end slide resized to the wide aspect ratio, unless the copy from an earlier run is still current
+def prepare_cover_slide(image_path, output_path, target_size, manifest, config):
+    def render():
+        return emit_slide(get_template(image_path, target_size, cache_dir=config.get("template_cache_dir")),
+                          output_path, config)
+
+    key = slide_key(SLIDE_RENDERER_VERSION, target_size, file_hash(image_path))
+    return render_cached(manifest, output_path, key, render)
+
+
+# Resources of a slide render worker, loaded once by init_slide_worker
+_slide_worker_resources = {}
+
+
+# Pool initializer: load and pre-resize the background and load the fonts once per worker process
+def init_slide_worker(config):
+    target_size = (config["wide_aspect_ratio"]["width"], config["wide_aspect_ratio"]["height"])
+    _slide_worker_resources["background_image"] = get_template(config["background_image"], target_size,
+                                                               cache_dir=config.get("template_cache_dir"))
+    _slide_worker_resources["font_question"] = load_font(config["font_path_question"],
+                                                         config["font_settings"]["font_size_question"])
+    _slide_worker_resources["font_options"] = load_font(config["font_path_options"],
+                                                        config["font_settings"]["font_size_options"])
+    _slide_worker_resources["config"] = config
+
+
+# Render one question slide from a plain (index, question text, options text, output path) job
+def render_question_slide_job(job):
+    idx, question_content, options_content, output_path = job
+    resources = _slide_worker_resources
+    slide = create_question_slide(question_content, options_content, resources["background_image"],
+                                  resources["font_question"], resources["font_options"], output_path,
+                                  resources["config"])
+    return idx, slide
+
+
+# Generate slides for the test ensuring all use the wide aspect ratio.
+# Slides whose text, style and template are unchanged since the last run (per the render manifest) are reused.
+def generate_slides(questions, config):
+    slides = []
+    durations = []
+    target_size = (config["wide_aspect_ratio"]["width"], config["wide_aspect_ratio"]["height"])
+    slide_dir = config['working_slide_path']
+    # In-memory frames are streamed to the encoder without being written, so there is nothing to reuse
+    use_render_cache = config.get("render_cache", True) and not config.get("in_memory_frames", False)
+    manifest = load_manifest(slide_dir) if use_render_cache else None
+
+    try:
+        # 1. Add the start slide
+        slides.append(prepare_cover_slide(config["start_slide"], f"{slide_dir}/start_slide.png", target_size,
+                                          manifest, config))
+        durations.append(config["slide_durations"]["start_slide"])
+
+        # 2. Create question slides on a pool of render workers; jobs only carry text, the background and
+        # fonts live in each worker
+        style = style_from_config(config, SLIDE_STYLE_KEYS)
+        template_hash = file_hash(config["background_image"])
+        question_slides = [None] * len(questions)
+        jobs, keys = [], {}
+        for idx, (question_id, question_text, question_options, _, topic) in enumerate(questions):
+            question_content = f"Q - {idx + 1}: {question_text}"
+            options_content = '\n'.join([opt.strip() for opt in question_options.replace('|', '\n').splitlines()])
+            question_slide_output = f"{slide_dir}/slide_{idx + 1}_question.png"
+            # create_question_slide appends "_question.png" to the output path
+            slide_file = f"{question_slide_output}_question.png"
+            key = slide_key(SLIDE_RENDERER_VERSION, style, template_hash, question_content, options_content)
+            if is_fresh(manifest, [slide_file], key):
+                question_slides[idx] = slide_file
+                continue
+            keys[idx] = key
+            jobs.append((idx, question_content, options_content, question_slide_output))
+        logging.info(f"Reusing {len(questions) - len(jobs)} unchanged question slides, rendering {len(jobs)}")
+
+        if jobs:
+            processes = min(config.get("render_processes", cpu_count()), len(jobs))
+            render_start = time.time()
+            with Pool(processes, initializer=init_slide_worker, initargs=(config,)) as pool:
+                chunksize = max(1, len(jobs) // (processes * 4))
+                for idx, slide in pool.imap_unordered(render_question_slide_job, jobs, chunksize=chunksize):
+                    question_slides[idx] = slide
+                    record(manifest, [slide], keys[idx])
+                    logging.info(f"Slide for question {idx + 1} created")
+            render_time = time.time() - render_start
+            logging.info(f"Rendered {len(jobs)} question slides in {render_time:.2f} seconds "
+                         f"({len(jobs) / max(render_time, 1e-6):.1f} slides/sec on {processes} processes)")
+
+        slides.extend(question_slides)
+        durations.extend([config["slide_durations"]["question_slide"]] * len(question_slides))
+
+        # 3. Add the end slide
+        slides.append(prepare_cover_slide(config["end_slide"], f"{slide_dir}/end_slide.png", target_size,
+                                          manifest, config))
+        durations.append(config["slide_durations"]["end_slide"])
+
+        logging.info("End slide created")
+    finally:
+        save_manifest(slide_dir, manifest)
+
+    return slides, durations
@@ -4,6 +4,21 @@ import subprocess
 import wave
 import contextlib
 import shutil
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from media_probe import video_duration
+
+# Most clips one xfade pass merges; larger decks are merged as a tree of passes
+MERGE_GROUP_SIZE = 8
+
+# Intermediate merges are near-lossless with PCM audio so the extra passes cost no quality
+INTERMEDIATE_CODEC_ARGS = ["-c:v", "libx264", "-crf", "4", "-preset", "veryfast", "-c:a", "pcm_s16le"]
+OUTPUT_CODEC_ARGS = [
+    "-c:v", "libx264", "-crf", "18", "-preset", "fast",
+    "-c:a", "aac", "-b:a", "192k",
+    "-movflags", "+faststart",
+]
 
 
 def run(cmd):
@@ -37,78 +52,98 @@ def make_slide_video(image, audio, out_video, fade_duration):
     return duration
 
 
-def crossfade_videos(input_files, output, crossfade_duration):
-    filter_complex = ""
-    inputs = []
+def xfade_group(inputs, durations, output, crossfade_duration, codec_args):
+    # Chain xfade/acrossfade over a handful of inputs. Each offset is where the running output ends minus
+    # the crossfade, computed from the real duration of every input rather than assumed equal.
+    cmd_inputs = []
     filter_streams = []
-
-    for idx, f in enumerate(input_files):
-        inputs += ["-i", f]
-
-    for i in range(len(input_files)):
-        filter_streams.append(f"[{i}:v]format=yuv420p[v{i}];")
-        filter_streams.append(f"[{i}:a]aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo[a{i}];")
-
-    filter_complex += "".join(filter_streams)
+    for i, f in enumerate(inputs):
+        cmd_inputs += ["-i", f]
+        filter_streams.append(f"[{i}:v]settb=AVTB,format=yuv420p[v{i}]")
+        filter_streams.append(f"[{i}:a]aformat=sample_fmts=fltp:sample_rates=44100:channel_layouts=stereo[a{i}]")
 
     current_video = "[v0]"
     current_audio = "[a0]"
-    for i in range(1, len(input_files)):
-        next_video = f"[v{i}]"
-        next_audio = f"[a{i}]"
+    merged_duration = durations[0]
+    for i in range(1, len(inputs)):
+        fade = min(crossfade_duration, merged_duration, durations[i])
         out_video = f"[vxf{i}]"
         out_audio = f"[axf{i}]"
-        filter_complex += (
-            f"{current_video}{next_video}"
-            f"xfade=transition=fade:duration={crossfade_duration}:offset="
-            f"{i * (duration_per_slide - crossfade_duration)}{out_video};"
-        )
-        filter_complex += (
-            f"{current_audio}{next_audio}"
-            f"acrossfade=d={crossfade_duration}:c1=tri:c2=tri{out_audio};"
+        filter_streams.append(
+            f"{current_video}[v{i}]"
+            f"xfade=transition=fade:duration={fade:.3f}:offset={merged_duration - fade:.3f}{out_video}"
         )
+        filter_streams.append(f"{current_audio}[a{i}]acrossfade=d={fade:.3f}:c1=tri:c2=tri{out_audio}")
+        merged_duration += durations[i] - fade
         current_video = out_video
         current_audio = out_audio
 
     cmd = [
-        "ffmpeg", "-y", *inputs,
-        "-filter_complex", filter_complex,
+        "ffmpeg", "-y", *cmd_inputs,
+        "-filter_complex", ";".join(filter_streams),
         "-map", current_video,
         "-map", current_audio,
-        "-c:v", "libx264", "-crf", "18", "-preset", "fast",
-        "-c:a", "aac", "-b:a", "192k",
-        "-movflags", "+faststart",
+        *codec_args,
         output
     ]
     run(cmd)
 
 
+def crossfade_videos(input_files, durations, output, crossfade_duration, group_size=MERGE_GROUP_SIZE,
+                     work_dir="temp_videos"):
+    # Merge as a tree of xfade passes: every pass joins at most group_size files, so ffmpeg never holds more
+    # than group_size decoders and filter chains however long the deck is. Every neighbouring pair of slides
+    # is still cross-faded exactly once, either inside a group or where two merged groups meet one level up.
+    # durations are the slide lengths from the WAVs; merged files are probed by their video stream, since the
+    # xfade offsets are positions in the video and the AAC audio of a slide can run slightly longer.
+    group_size = max(2, group_size)
+    files = list(input_files)
+    durations = list(durations)
+    level = 0
+    while len(files) > group_size:
+        level += 1
+        print(f"🌲 Merge level {level}: {len(files)} clips in groups of {group_size}")
+        merged_files, merged_durations = [], []
+        for start in range(0, len(files), group_size):
+            group = files[start:start + group_size]
+            if len(group) == 1:
+                merged_files.append(group[0])
+                merged_durations.append(durations[start])
+                continue
+            merged = os.path.join(work_dir, f"merge_{level}_{start // group_size}.mkv")
+            xfade_group(group, durations[start:start + group_size], merged, crossfade_duration,
+                        INTERMEDIATE_CODEC_ARGS)
+            merged_files.append(merged)
+            merged_durations.append(video_duration(merged))
+        files, durations = merged_files, merged_durations
+
+    xfade_group(files, durations, output, crossfade_duration, OUTPUT_CODEC_ARGS)
+
+
 def main():
     with open("04_config.json") as f:
         config = json.load(f)
 
     fade_duration = config.get("fade_duration", 0.5)
     crossfade_duration = config.get("crossfade_duration", 0.5)
+    group_size = config.get("merge_group_size", MERGE_GROUP_SIZE)
     output_file = config["output"]
     slides = config["slides"]
 
     os.makedirs("temp_videos", exist_ok=True)
     temp_files = []
-
-    global duration_per_slide
-    duration_per_slide = 0
+    durations = []
 
     print("🎞️ Generating individual slide videos...")
     for idx, slide in enumerate(slides, start=1):
         image = slide["image"]
         audio = slide["audio"]
         out_vid = f"temp_videos/slide_{idx}.mp4"
-        duration = make_slide_video(image, audio, out_vid, fade_duration)
-        duration_per_slide = duration  # assume same duration for all slides
+        durations.append(make_slide_video(image, audio, out_vid, fade_duration))
         temp_files.append(out_vid)
 
     print("🎬 Creating final video with crossfades...")
-    crossfade_videos(temp_files, output_file, crossfade_duration)
+    crossfade_videos(temp_files, durations, output_file, crossfade_duration, group_size)
 
     print("✅ Final video created:", output_file)
     shutil.rmtree("temp_videos")
@@ -1,6 +1,10 @@
 import os
+import sys
 import json
-from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from media_probe import media_duration
+from slideshow_encoder import Slide, encode_slideshow
 
 def create_video_with_images_and_audio(config_file):
     # Load configuration
@@ -24,12 +28,10 @@ def create_video_with_images_and_audio(config_file):
 
     print("Creating video...")
 
-    # Create audio clip
-    audio_clip = AudioFileClip(mp3_file)
-    song_duration = audio_clip.duration
+    song_duration = media_duration(mp3_file)
 
-    # Create image clips based on timings
-    video_clips = []
+    # Create slides based on timings
+    slides = []
     for i, image_setting in enumerate(image_settings):
         image_path = image_setting["image"]
         start_time = image_setting["start_time"]
@@ -42,14 +44,10 @@ def create_video_with_images_and_audio(config_file):
             duration = max(0, song_duration - start_time)
 
         if duration > 0:
-            image_clip = ImageClip(image_path, duration=duration).set_start(start_time)
-            video_clips.append(image_clip)
-
-    # Concatenate all image clips
-    final_video = concatenate_videoclips(video_clips, method="compose").set_audio(audio_clip)
+            slides.append(Slide(image_path, duration))
 
-    # Write final video to file
-    final_video.write_videofile(output_video, fps=24)
+    # Encode the slides with the song
+    encode_slideshow(slides, output_video, fps=24, audio=mp3_file, loop_audio=False)
     print(f"Video created successfully: {output_video}")
 
 if __name__ == "__main__":
@@ -1,6 +1,10 @@
 import os
+import sys
 import json
-from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from media_probe import media_duration
+from slideshow_encoder import Slide, encode_slideshow
 
 
 def create_video_with_images_and_audio(config_file, transition_duration=1):
@@ -26,14 +30,12 @@ def create_video_with_images_and_audio(config_file, transition_duration=1):
 
     print("Creating video...")
 
-    # Create audio clip
-    audio_clip = AudioFileClip(mp3_file)
-    song_duration = audio_clip.duration
+    song_duration = media_duration(mp3_file)
 
     print(f"MP3 Song Duration: {song_duration} seconds")
 
-    # Create video clips
-    video_clips = []
+    # Create slides
+    slides = []
     for i, image_setting in enumerate(image_settings):
         image_path = image_setting["image"]
         start_time = image_setting["start_time"]
@@ -49,23 +51,13 @@ def create_video_with_images_and_audio(config_file, transition_duration=1):
         duration = end_time - start_time
         print(f'current clip duration  {duration}s')
 
-        # Create the image clip
-        image_clip = ImageClip(image_path, duration=duration)
-
-        # Add crossfade transition if not the last image
-        if i + 1 < len(image_settings):
-            image_clip = image_clip.crossfadeout(transition_duration)
-
-        video_clips.append(image_clip)
-
-    # Concatenate video clips with crossfade
-    final_video = concatenate_videoclips(video_clips, method="compose")
+        # Fade out at the end of every image except the last one
+        fade_out = transition_duration if i + 1 < len(image_settings) else 0
 
-    # Add audio
-    final_video = final_video.set_audio(audio_clip)
+        slides.append(Slide(image_path, duration, fade_out=fade_out))
 
-    # Write the final video to a file
-    final_video.write_videofile(output_video, fps=24, codec="libx264", audio_codec="aac")
+    # Encode the slides with the song
+    encode_slideshow(slides, output_video, fps=24, audio=mp3_file, loop_audio=False)
     print(f"Video created successfully: {output_video}")
 
 
@@ -1,10 +1,10 @@
 import os
+import sys
 import json
-from moviepy.editor import (
-    ImageClip,
-    AudioFileClip,
-    concatenate_videoclips,
-)
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from media_probe import media_duration
+from slideshow_encoder import Slide, encode_slideshow
 
 
 def create_video_with_fade_effects(config_file, fade_duration=1):
@@ -30,14 +30,12 @@ def create_video_with_fade_effects(config_file, fade_duration=1):
 
     print("Creating video...")
 
-    # Create audio clip
-    audio_clip = AudioFileClip(mp3_file)
-    song_duration = audio_clip.duration
+    song_duration = media_duration(mp3_file)
 
     print(f"MP3 Song Duration: {song_duration} seconds")
 
-    # Create video clips with fade effects
-    video_clips = []
+    # Create slides with fade effects
+    slides = []
     for i, image_setting in enumerate(image_settings):
         image_path = image_setting["image"]
         start_time = image_setting["start_time"]
@@ -50,16 +48,11 @@ def create_video_with_fade_effects(config_file, fade_duration=1):
         # Calculate duration for the current clip
         duration = end_time - start_time
 
-        # Create the image clip with fade effects
-        image_clip = ImageClip(image_path, duration=duration)
-        faded_clip = image_clip.fadein(fade_duration).fadeout(fade_duration)
-        video_clips.append(faded_clip)
-
-    # Concatenate all video clips
-    final_video = concatenate_videoclips(video_clips, method="compose").set_audio(audio_clip)
+        # Fade each image in and out
+        slides.append(Slide(image_path, duration, fade_in=fade_duration, fade_out=fade_duration))
 
-    # Write the final video to a file
-    final_video.write_videofile(output_video, fps=24, codec="libx264", audio_codec="aac")
+    # Encode the slides with the song
+    encode_slideshow(slides, output_video, fps=24, audio=mp3_file, loop_audio=False)
     print(f"Video created successfully: {output_video}")
 
 
@@ -3,11 +3,16 @@ from pydub import AudioSegment
 import json
 import time
 import logging
-from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips
-from PIL import Image, ImageDraw, ImageFont
+from moviepy.editor import VideoClip, AudioFileClip
+from PIL import ImageFont
 import os
+import sys
 from pysrt import SubRipFile, SubRipItem, SubRipTime
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from text_layout import layout_lines
+from subtitle_compositor import Cue, subtitle_frame_maker
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -23,11 +28,6 @@ srt_filename = config.get('srt_filename', input_mp3.replace('.mp3', '.srt'))  #
 video_width, video_height = config['video_dimensions']
 font_path = config.get('font_path', None)  # Specify a Malayalam font path
 
-# Create temp directory for intermediate images
-temp_dir = './temp'
-if not os.path.exists(temp_dir):
-    os.makedirs(temp_dir)
-
 # Log the start of the process
 logging.info("Starting the speech-to-video process.")
 process_start_time = time.time()
@@ -103,78 +103,47 @@ srt_file.save(srt_filename, encoding='utf-8')
 logging.info(f".srt file saved to {srt_filename}.")
 
 
-# Step 3: Render Malayalam Text on Image
-def render_text_on_image(image_path, text, output_image_path):
-    """Draws the Malayalam text onto the image using Pillow"""
-    img = Image.open(image_path)
-    draw = ImageDraw.Draw(img)
+# Step 3: Lay out Malayalam Text on Image
+font = ImageFont.truetype(font_path, 40) if font_path else ImageFont.load_default()
 
-    font = ImageFont.truetype(font_path, 40) if font_path else ImageFont.load_default()
 
-    # Split text into multiple lines to fit within the image width
-    image_width, image_height = img.size
+def layout_subtitle(text, image_size):
+    """Wraps the Malayalam text to the image width and places it in the lower part of the image"""
+    image_width, image_height = image_size
     max_text_width = image_width - 40  # Padding from the sides
-    lines = []
-    current_line = ""
-    for word in text.split():
-        test_line = current_line + " " + word if current_line else word
-        test_width, _ = draw.textbbox((0, 0), test_line, font=font)[2:4]
-        if test_width <= max_text_width:
-            current_line = test_line
-        else:
-            lines.append(current_line)
-            current_line = word
-    lines.append(current_line)
-
-    # Position the text in the lower part of the image
-    text_height = len(lines) * 50  # Approximate height per line
-    y_position = (image_height - text_height) // 2 + 200  # Adjust this value for positioning
-
-    for line in lines:
-        text_width, _ = draw.textbbox((0, 0), line, font=font)[2:4]
-        x_position = (image_width - text_width) // 2
-        draw.text((x_position, y_position), line, font=font, fill="white")
-        y_position += 50
-
-    img.save(output_image_path)
-    logging.info(f"Text rendered on image and saved to {output_image_path}")
-
-
-# Step 4: Generate Image Clips for Each Subtitle
+
+    # Wrap by pixel width with cached word widths, center each line and place the block in the lower part
+    return layout_lines(text, font, max_text_width, 20, 200, 50, align="center", box_height=image_height)
+
+
+# Step 4: Collect a cue for each subtitle; frames are composited over the background resized once
 srt_data = SubRipFile.open(srt_filename)
-image_clips = []
+cues = []
 
 for i, item in enumerate(srt_data):
     # Get the start and end times in seconds for each subtitle
     start_seconds = item.start.ordinal / 1000.0
     end_seconds = item.end.ordinal / 1000.0
 
-    # Render text for each subtitle on the image and save in ./temp directory
-    output_image_with_text = os.path.join(temp_dir, f'temp_image_with_text_{i}.png')
-    render_text_on_image(image_for_video, item.text, output_image_with_text)
-
-    # Create an ImageClip for the rendered image with the correct duration
     duration = end_seconds - start_seconds
     if duration <= 0:
         duration = 1.0  # Ensure that each image has at least 1 second of duration
 
-    image_clip = ImageClip(output_image_with_text).set_duration(duration).resize(newsize=(video_width, video_height))
-
-    # Append to the list of image clips
-    image_clips.append(image_clip)
+    cues.append(Cue(image_for_video, item.text, duration))
 
-    # Log when each image clip is created and its duration
+    # Log when each cue is added and its duration
     logging.info(
         f"Image {i} with text from {start_seconds:.2f}s to {end_seconds:.2f}s (duration: {duration:.2f}s) added to the video.")
 
-# Step 5: Concatenate Image Clips and Add Audio
+# Step 5: Build the Video from the Subtitle Frames and Add Audio
 logging.info("Loading audio and creating final video...")
 
 try:
     audio_clip = AudioFileClip(input_mp3)
 
-    # Concatenate all image clips
-    final_video = concatenate_videoclips(image_clips).set_audio(audio_clip)
+    # Stream the subtitle frames, each composited once per cue
+    make_frame, video_duration = subtitle_frame_maker(cues, (video_width, video_height), layout_subtitle, font)
+    final_video = VideoClip(make_frame, duration=video_duration).set_audio(audio_clip)
 
     # Ensure the video ends exactly when the audio ends
     final_video = final_video.set_duration(audio_clip.duration)
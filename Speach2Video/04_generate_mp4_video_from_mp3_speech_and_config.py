@@ -1,9 +1,14 @@
 import json
 import os
-from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips
-from PIL import Image, ImageDraw, ImageFont
+import sys
+from moviepy.editor import VideoClip, AudioFileClip
+from PIL import ImageFont
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from text_layout import layout_lines
+from subtitle_compositor import Cue, subtitle_frame_maker
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -19,52 +24,21 @@ font_path = config.get('font_path', 'NotoSansMalayalam-Regular.ttf')  # Default
 font_size = config.get('font_size', 40)
 font_color = config.get('font_color', 'white')
 
-# Create temp directory for intermediate images
-temp_dir = './temp'
-if not os.path.exists(temp_dir):
-    os.makedirs(temp_dir)
-
-# Function to render text on image using Pillow
-def render_text_on_image(image_path, text, output_image_path):
-    """Draw the text onto an image using Pillow."""
-    img = Image.open(image_path)
-    draw = ImageDraw.Draw(img)
-
-    # Load the font
-    font = ImageFont.truetype(font_path, font_size)
+# Load the font
+font = ImageFont.truetype(font_path, font_size)
 
+# Function to lay out the slide text on its image
+def layout_slide_text(text, image_size):
+    """Wrap the text to the image width and place it in the lower part of the image."""
     # Image dimensions
-    image_width, image_height = img.size
+    image_width, image_height = image_size
     max_text_width = image_width - 40  # Padding from sides
-    lines = []
-    current_line = ""
-
-    # Word wrapping logic
-    for word in text.split():
-        test_line = current_line + " " + word if current_line else word
-        test_width, _ = draw.textbbox((0, 0), test_line, font=font)[2:4]
-        if test_width <= max_text_width:
-            current_line = test_line
-        else:
-            lines.append(current_line)
-            current_line = word
-    lines.append(current_line)
 
-    # Position the text in the image
-    text_height = len(lines) * (font_size + 10)
-    y_position = (image_height - text_height) // 2 + 200
+    # Wrap by pixel width with cached word widths, center each line and place the block in the lower part
+    return layout_lines(text, font, max_text_width, 20, 200, font_size + 10, align="center", box_height=image_height)
 
-    for line in lines:
-        text_width, _ = draw.textbbox((0, 0), line, font=font)[2:4]
-        x_position = (image_width - text_width) // 2
-        draw.text((x_position, y_position), line, font=font, fill=font_color)
-        y_position += font_size + 10
-
-    img.save(output_image_path)
-    logging.info(f"Text rendered on image and saved to {output_image_path}")
-
-# Step 1: Process each slide from config and generate image clips
-image_clips = []
+# Step 1: Collect a cue for each slide from config; frames are composited over each image resized once
+cues = []
 
 for i, slide in enumerate(slides):
     image_path = slide['image']
@@ -77,48 +51,39 @@ for i, slide in enumerate(slides):
     end_seconds = int(end_time.split(':')[0]) * 60 + int(end_time.split(':')[1])
     duration = end_seconds - start_seconds
 
-    # Render the text onto the image
-    output_image_with_text = os.path.join(temp_dir, f'temp_image_with_text_{i}.png')
-    render_text_on_image(image_path, text, output_image_with_text)
-
-    # Create an ImageClip for the rendered image with the correct duration
-    image_clip = ImageClip(output_image_with_text).set_duration(duration).resize(newsize=(video_width, video_height))
-
-    # Append to the list of image clips
-    image_clips.append(image_clip)
+    cues.append(Cue(image_path, text, duration))
     logging.info(f"Slide {i+1} from {start_time} to {end_time} (duration: {duration} seconds) added to video.")
 
-# Step 2: Concatenate image clips and add audio
+# Step 2: Build the video from the slide frames and add audio
 logging.info("Loading audio and creating final video...")
 
 try:
     audio_clip = AudioFileClip(input_mp3)
     logging.info(f"Audio duration: {audio_clip.duration:.2f} seconds")
 
-    # Concatenate all image clips
-    final_video = concatenate_videoclips(image_clips)
-    logging.info(f"Video duration before extending: {final_video.duration:.2f} seconds")
-    logging.info(f"Number of image clips: {len(image_clips)}")
+    # Stream the slide frames, each composited once per slide
+    make_frame, video_duration = subtitle_frame_maker(cues, (video_width, video_height), layout_slide_text, font,
+                                                      font_color)
+    logging.info(f"Video duration before extending: {video_duration:.2f} seconds")
+    logging.info(f"Number of slides: {len(cues)}")
 
     # Ensure the video ends exactly when the audio ends
-    if final_video.duration < audio_clip.duration:
+    if video_duration < audio_clip.duration:
         logging.info("Extending the last slide to cover remaining audio duration.")
-        if len(image_clips) > 0:  # Ensure there are clips to extend
-            extra_duration = audio_clip.duration - final_video.duration
-            new_duration = image_clips[-1].duration + extra_duration
-            logging.info(f"Extending last slide from {image_clips[-1].duration:.2f}s to {new_duration:.2f}s")
-            # Update the duration of the last clip
-            image_clips[-1] = image_clips[-1].set_duration(new_duration)
-            # Re-concatenate the clips
-            final_video = concatenate_videoclips(image_clips)
+        if len(cues) > 0:  # Ensure there are slides to extend
+            extra_duration = audio_clip.duration - video_duration
+            new_duration = cues[-1].duration + extra_duration
+            logging.info(f"Extending last slide from {cues[-1].duration:.2f}s to {new_duration:.2f}s")
+            # Frames past the last cue keep showing the last slide
+            video_duration = audio_clip.duration
         else:
-            logging.error("No image clips available to extend!")
+            logging.error("No slides available to extend!")
             exit(1)
     else:
         logging.info("No need to extend the last slide.")
 
     # Set audio and duration
-    final_video = final_video.set_audio(audio_clip).set_duration(audio_clip.duration)
+    final_video = VideoClip(make_frame, duration=video_duration).set_audio(audio_clip).set_duration(audio_clip.duration)
 
     # Step 3: Export the final video to MP4
     final_video.write_videofile(output_mp4, fps=24, codec='libx264', threads=4)
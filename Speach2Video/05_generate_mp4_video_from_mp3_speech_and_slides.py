@@ -1,8 +1,12 @@
 import json
 import os
-from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips
+import sys
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from media_probe import media_duration
+from slideshow_encoder import Slide, encode_slideshow
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -19,53 +23,43 @@ temp_dir = './temp'
 if not os.path.exists(temp_dir):
     os.makedirs(temp_dir)
 
-# Step 1: Process each slide from config and generate image clips
-image_clips = []
+# Step 1: Collect each slide from config with its duration
+slide_entries = []
 
 for i, slide in enumerate(slides):
     image_path = slide['image']
     duration = slide['duration']  # Duration of the slide
 
-    # Create an ImageClip for each image with the correct duration
-    image_clip = ImageClip(image_path).set_duration(duration)
-    image_clips.append(image_clip)
+    slide_entries.append(Slide(image_path, duration))
 
     logging.info(f"Slide {i+1} with image {image_path} will be shown for {duration} seconds.")
 
-# Step 2: Concatenate image clips and add audio
+# Step 2: Fit the slides to the audio and encode the video
 logging.info("Loading audio and creating final video...")
 
 try:
-    audio_clip = AudioFileClip(input_mp3)
-    logging.info(f"Audio duration: {audio_clip.duration:.2f} seconds")
+    audio_duration = media_duration(input_mp3)
+    logging.info(f"Audio duration: {audio_duration:.2f} seconds")
 
-    # Concatenate all image clips
-    final_video = concatenate_videoclips(image_clips)
-    logging.info(f"Video duration before extending: {final_video.duration:.2f} seconds")
-    logging.info(f"Number of image clips: {len(image_clips)}")
+    video_duration = sum(entry.duration for entry in slide_entries)
+    logging.info(f"Video duration before extending: {video_duration:.2f} seconds")
+    logging.info(f"Number of slides: {len(slide_entries)}")
 
     # Ensure the video ends exactly when the audio ends
-    if final_video.duration < audio_clip.duration:
+    if video_duration < audio_duration:
         logging.info("Extending the last slide to cover remaining audio duration.")
-        if len(image_clips) > 0:  # Ensure there are clips to extend
-            extra_duration = audio_clip.duration - final_video.duration
-            new_duration = image_clips[-1].duration + extra_duration
-            logging.info(f"Extending last slide from {image_clips[-1].duration:.2f}s to {new_duration:.2f}s")
-            # Update the duration of the last clip
-            image_clips[-1] = image_clips[-1].set_duration(new_duration)
-            # Re-concatenate the clips
-            final_video = concatenate_videoclips(image_clips)
+        if len(slide_entries) > 0:  # Ensure there are slides to extend
+            new_duration = slide_entries[-1].duration + audio_duration - video_duration
+            logging.info(f"Extending last slide from {slide_entries[-1].duration:.2f}s to {new_duration:.2f}s")
+            slide_entries[-1] = slide_entries[-1]._replace(duration=new_duration)
         else:
-            logging.error("No image clips available to extend!")
+            logging.error("No slides available to extend!")
             exit(1)
     else:
         logging.info("No need to extend the last slide.")
 
-    # Set audio and duration
-    final_video = final_video.set_audio(audio_clip).set_duration(audio_clip.duration)
-
-    # Step 3: Export the final video to MP4
-    final_video.write_videofile(output_mp4, fps=24, codec='libx264', threads=4)
+    # Step 3: Export the final video to MP4, cut to the audio duration
+    encode_slideshow(slide_entries, output_mp4, fps=24, audio=input_mp3, loop_audio=False, duration=audio_duration)
     logging.info(f"Video creation complete. Output file: {output_mp4}")
 
 except IndexError as e:
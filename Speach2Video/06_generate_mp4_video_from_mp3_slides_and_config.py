@@ -1,8 +1,12 @@
 import json
 import os
-from moviepy.editor import ImageClip, AudioFileClip, concatenate_videoclips
+import sys
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from media_probe import media_duration
+from slideshow_encoder import Slide, encode_slideshow
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -18,38 +22,32 @@ temp_dir = './temp'
 if not os.path.exists(temp_dir):
     os.makedirs(temp_dir)
 
-# Step 1: Process each slide from config and generate image/audio clips
-video_clips = []
+# Step 1: Process each slide from config, showing its image for as long as its audio plays
+slide_entries = []
 
 for i, slide in enumerate(slides):
     image_path = slide['image']
     audio_path = slide['mp3']
 
-    # Create an AudioFileClip for each audio
+    # Read the duration of each audio
     try:
-        audio_clip = AudioFileClip(audio_path)
-        duration = audio_clip.duration
+        duration = media_duration(audio_path)
     except Exception as e:
         logging.error(f"Error processing audio file {audio_path}: {e}")
         exit(1)
 
-    # Create an ImageClip for each image with the same duration as the audio
-    try:
-        image_clip = ImageClip(image_path).set_duration(duration).set_audio(audio_clip)
-        video_clips.append(image_clip)
-        logging.info(f"Slide {i+1} with image {image_path} and audio {audio_path} will be shown for {duration:.2f} seconds.")
-    except Exception as e:
-        logging.error(f"Error processing image file {image_path}: {e}")
+    if not os.path.exists(image_path):
+        logging.error(f"Error processing image file {image_path}: file not found")
         exit(1)
+    slide_entries.append(Slide(image_path, duration, audio_path))
+    logging.info(f"Slide {i+1} with image {image_path} and audio {audio_path} will be shown for {duration:.2f} seconds.")
 
-# Step 2: Concatenate all image/audio clips into a final video
-logging.info("Concatenating video clips...")
+# Step 2: Encode all slides with their audio into the final video
+logging.info("Encoding slides...")
 
 try:
-    final_video = concatenate_videoclips(video_clips)
-    # Step 3: Export the final video to MP4
-    final_video.write_videofile(output_mp4, fps=24, codec='libx264', threads=4)
+    encode_slideshow(slide_entries, output_mp4, fps=24)
     logging.info(f"Video creation complete. Output file: {output_mp4}")
 except Exception as e:
-    logging.error(f"An unexpected error occurred during video concatenation: {e}")
+    logging.error(f"An unexpected error occurred during video encoding: {e}")
     exit(1)
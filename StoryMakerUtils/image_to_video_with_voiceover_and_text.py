@@ -4,10 +4,13 @@ from PIL import Image, ImageDraw, ImageFont
 from gtts import gTTS
 from pydub import AudioSegment
 import moviepy.editor as mp
-import textwrap
 import os
+import sys
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from text_layout import layout_lines, word_positions, line_height
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message=s)')
 
@@ -15,22 +18,6 @@ def load_config(config_path):
     with open(config_path, 'r') as f:
         return json.load(f)
 
-def wrap_text(text, wrap_width, font, draw):
-    lines = []
-    words = text.split()
-    line = ""
-
-    for word in words:
-        test_line = line + word + " "
-        width, _ = font.getsize(test_line)
-        if width <= wrap_width:
-            line = test_line
-        else:
-            lines.append(line)
-            line = word + " "
-    lines.append(line)
-    return lines
-
 def generate_audio_from_text(text, speed, config):
     print("Text being sent to gTTS:", text)
     try:
@@ -58,30 +45,30 @@ def generate_audio_from_text(text, speed, config):
         print(f"Error generating audio: {e}")
         return 0
 
-def generate_frame(image, draw, text_lines, font, text_color, highlight_color, x, y, word_idx):
-    current_word = 0  # Word counter
-
-    # Get the height of a line using textbbox
-    line_height = draw.textbbox((x, y), "A", font=font)[3] - draw.textbbox((x, y), "A", font=font)[1]
-
-    for line in text_lines:
-        x_position = x  # Reset x position for each line
-        for word in line.split():
-            # Highlight the current word, otherwise set normal text color
-            color = highlight_color if current_word == word_idx else text_color
-            draw.text((x_position, y), word, font=font, fill=color)
-
-            # Update x position by the width of the word using textbbox
-            word_width = draw.textbbox((x_position, y), word + " ", font=font)[2] - \
-                         draw.textbbox((x_position, y), word + " ", font=font)[0]
-            x_position += word_width  # Add width of word plus space
-
-            current_word += 1
-
-        # After processing a line, move y position down by the line height
-        y += line_height + 60
-
-    return image
+def layout_words(text_lines, font):
+    # (word, x, y) of every word in reading order; its index is what the highlight follows
+    return [(word, x_position, line.y) for line in text_lines for word, x_position in word_positions(line, font)]
+
+def render_text_layer(image, words, font, text_color):
+    # Background with every word in the normal text color, drawn once for the whole video
+    text_image = image.copy()
+    draw = ImageDraw.Draw(text_image)
+    for word, x_position, y_position in words:
+        draw.text((x_position, y_position), word, font=font, fill=text_color)
+    return text_image
+
+def generate_word_frame(background, text_image, words, font, highlight_color, word_idx, output_size):
+    # The text layer with one word redrawn in the highlight color over the clean background under it,
+    # downscaled to the output size
+    frame_image = text_image.copy()
+    word, x_position, y_position = words[word_idx]
+    draw = ImageDraw.Draw(frame_image)
+    left, top, right, bottom = draw.textbbox((x_position, y_position), word, font=font)
+    box = (int(np.floor(left)), int(np.floor(top)), int(np.ceil(right)), int(np.ceil(bottom)))
+    frame_image.paste(background.crop(box), box[:2])
+    draw.text((x_position, y_position), word, font=font, fill=highlight_color)
+    frame_image = frame_image.resize(output_size, Image.LANCZOS)
+    return np.array(frame_image.convert("RGB"))
 
 def create_video_with_text(config):
     try:
@@ -90,7 +77,6 @@ def create_video_with_text(config):
         output_video = config["output_video"]
         font_path = config["font_path"]
         font_size = config["font_size"]
-        wrap_width = config["wrap_width"]
         text_color = config["text_color"]
         highlight_color = config["highlight_color"]
         fps = config["fps"]
@@ -103,7 +89,6 @@ def create_video_with_text(config):
         # Scale image for higher resolution
         scale_factor = 2  # Scale image 2x for better text rendering
         image = image.resize((image_width * scale_factor, image_height * scale_factor), Image.LANCZOS)
-        draw = ImageDraw.Draw(image)
 
         # Load the text from file
         with open(config["text_file"], 'r') as f:
@@ -117,8 +102,13 @@ def create_video_with_text(config):
         font = ImageFont.truetype(font_path, font_size * scale_factor)
 
         # Wrap text to fit the image width
-        text_lines = textwrap.wrap(text, width=wrap_width)
-        total_words = len(text.split())
+        x, y = 50, 50  # Initial text position
+        text_lines = layout_lines(text, font, image.width - 2 * x, x, y, line_height(font) + 60)
+        words = layout_words(text_lines, font)
+        total_words = len(words)
+        if not total_words:
+            print("No text to display, exiting.")
+            return
 
         # Generate or reuse audio and get duration
         audio_duration = generate_audio_from_text(text, config["audio_speed"], config)
@@ -129,42 +119,28 @@ def create_video_with_text(config):
         # Calculate the duration per word
         word_duration = audio_duration / total_words
 
-        # Initialize MoviePy
-        frames = []
-
-        x, y = 50, 50  # Initial text position
-        time_per_frame = 1 / fps
-        total_frames = int(audio_duration * fps)
-
         # Debugging: Log total frames and total words
-        print(f"Total frames to be generated: {total_frames}")
+        print(f"Total frames to be generated: {int(audio_duration * fps)}")
         print(f"Total words to be processed: {total_words}")
 
-        # Generate each frame for the video
-        for frame_num in range(total_frames):
-            time_elapsed = frame_num * time_per_frame
-            current_word_idx = min(int((time_elapsed + 0.2) / word_duration), total_words - 1)
-
-            frame_image = generate_frame(image.copy(), draw, text_lines, font, text_color, highlight_color, x, y,
-                                         current_word_idx)
-
-            # Downscale frame back to original size before appending
-            frame_image = frame_image.resize((image_width, image_height), Image.LANCZOS)
-
-            # Convert the frame to a NumPy array and append it
-            frames.append(np.array(frame_image.convert("RGB")))  # Convert to NumPy array before appending
-
-            # Log frame creation
-            if frame_num % 50 == 0 or frame_num == total_frames - 1:
-                print(f"Processed frame {frame_num}/{total_frames}")
-
-        # Check if frames were generated
-        if not frames:
-            print("No frames were generated, exiting.")
-            return
-
-        # Create video clip from frames
-        video_clip = mp.ImageSequenceClip(frames, fps=fps)
+        # Frames are rendered once per highlighted word and streamed to the encoder: moviepy pulls them
+        # one at a time and every frame of the same word reuses the cached array
+        text_image = render_text_layer(image, words, font, text_color)
+        current = {"word": None, "frame": None}
+
+        def make_frame(t):
+            word_idx = min(int((t + 0.2) / word_duration), total_words - 1)
+            if word_idx != current["word"]:
+                current["frame"] = generate_word_frame(image, text_image, words, font, highlight_color, word_idx,
+                                                       (image_width, image_height))
+                current["word"] = word_idx
+                # Log word frame creation
+                if word_idx % 50 == 0 or word_idx == total_words - 1:
+                    print(f"Rendered word frame {word_idx + 1}/{total_words}")
+            return current["frame"]
+
+        # Create video clip from the frame stream
+        video_clip = mp.VideoClip(make_frame, duration=audio_duration)
 
         # Add the audio
         audio_clip = mp.AudioFileClip(output_audio_path)
@@ -176,7 +152,7 @@ def create_video_with_text(config):
         final_video = final_video.set_duration(audio_duration)
 
         # High-quality video export
-        final_video.write_videofile(output_video, codec="libx264", bitrate="5000k", preset="slow")
+        final_video.write_videofile(output_video, fps=fps, codec="libx264", bitrate="5000k", preset="slow")
 
         print("Video creation complete.")
 
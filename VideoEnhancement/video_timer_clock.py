@@ -1,11 +1,13 @@
 import json
-import numpy as np
-import matplotlib.pyplot as plt
+import os
+import sys
 from moviepy.editor import VideoClip, AudioFileClip, CompositeAudioClip
-from moviepy.video.io.bindings import mplfig_to_npimage
 import moviepy.audio.fx.all as afx
 import moviepy.video.fx.all as vfx  # Import the video effects
-from matplotlib.font_manager import FontProperties  # For custom fonts
+from matplotlib.font_manager import FontProperties, findfont  # For custom fonts
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from timer_frames import clock_frame_maker
 
 # Load configuration from config.json
 with open('config/timer_clock_config.json', 'r') as config_file:
@@ -21,58 +23,61 @@ DIGIT_FONT_TYPE = config["DIGIT_FONT_TYPE"]  # New font type from config
 BACKGROUND_MUSIC = config["BACKGROUND_MUSIC"]
 FPS = config["FPS"]
 
-# High DPI setting for higher quality graphics
-DPI = 300  # Higher DPI for better resolution
+DPI = 300
 MUSIC_VOLUME = config.get("MUSIC_VOLUME", 0.3)  # Default volume level at 30%
 FADEOUT_DURATION = 3  # Background music fade out in the last 3 seconds
 
-# Function to create the circle animation for the timer
-def make_frame(t):
-    # Normalize time (0 to 1)
-    progress = t / TIMER_DURATION
-
-    # Set up the plot with a configurable figure size and high DPI
-    fig, ax = plt.subplots(figsize=(VIDEO_SIZE / DPI, VIDEO_SIZE / DPI), subplot_kw={'projection': 'polar'}, dpi=DPI)
-    ax.set_ylim(0, 1)
-    ax.set_xticks([])  # Remove radial labels
-    ax.set_yticks([])  # Remove radial ticks
+# Timer lengths generated by one run; each becomes output/timer_clock_<N>Sec.mp4
+TIMER_LIBRARY = config.get("TIMER_LIBRARY", [TIMER_DURATION])
 
+# Font sizes are points at this DPI, converted to pixels for the glyph rasterizer
+font_path = findfont(FontProperties(family=DIGIT_FONT_TYPE))
+font_size = DIGIT_FONT_SIZE * DPI / 72
 
-    # Plot the unwinding circle with configurable colors
-    theta = np.linspace(0, 2 * np.pi, 100)  # Keep theta in its original order (counterclockwise definition)
-    ax.fill_between(theta, 0, 1, color=BACKGROUND_COLOR)  # Full background circle
 
-    # The key fix: adjust the progress direction by changing the condition for the fill
-    ax.fill_between(theta, 0, 1, where=(theta <= (2 * np.pi - progress * 2 * np.pi)),
-                    color=FOREGROUND_COLOR)  # Unwinding clockwise
+# Render one countdown clock video. The clock face geometry is computed once per VIDEO_SIZE and shared by
+# every timer of the batch.
+def generate_timer(duration, output_filename):
+    make_frame = clock_frame_maker(
+        VIDEO_SIZE, duration,
+        BACKGROUND_COLOR, FOREGROUND_COLOR, DIGIT_COLOR,
+        font_path, font_size,
+    )
 
-    # Define the font properties
-    font_properties = FontProperties(family=DIGIT_FONT_TYPE, size=DIGIT_FONT_SIZE)
+    # Create the video
+    animation = VideoClip(make_frame, duration=duration)
 
-    # Add the countdown text in the center with configurable font size and color
-    time_left = max(0, TIMER_DURATION - t)
-    ax.text(0, 0, f"{int(time_left)}", ha='center', va='center', color=DIGIT_COLOR, fontproperties=font_properties)
+    # Load the background music and control volume; a track shorter than the timer is looped to its length
+    music = AudioFileClip(BACKGROUND_MUSIC)
+    if music.duration < duration:
+        audio = music.fx(afx.audio_loop, duration=duration)
+    else:
+        audio = music.subclip(0, duration)
+    audio = audio.volumex(MUSIC_VOLUME)
 
-    # Convert the matplotlib figure to an image frame
-    img = mplfig_to_npimage(fig)
-    plt.close(fig)  # Close the figure to free up memory
-    return img
+    # Apply fadeout effect in the last 3 seconds
+    audio = audio.fx(afx.audio_fadeout, FADEOUT_DURATION)
 
+    # Set the audio to the video
+    animation = animation.set_audio(audio)
 
-# Create the video
-animation = VideoClip(make_frame, duration=TIMER_DURATION)
+    # Save the video to a file with the configured FPS
+    animation.write_videofile(output_filename, fps=FPS, codec="libx264", bitrate="5000k", audio_codec="aac")
+    music.close()
 
-# Load the background music and control volume
-audio = AudioFileClip(BACKGROUND_MUSIC).subclip(0, TIMER_DURATION).volumex(MUSIC_VOLUME)
+    print(f"Timer video with background music and custom font saved as {output_filename}")
 
-# Apply fadeout effect in the last 3 seconds
-audio = audio.fx(afx.audio_fadeout, FADEOUT_DURATION)
 
-# Set the audio to the video
-animation = animation.set_audio(audio)
+# Render the whole library of timers in one call
+def generate_timer_library(durations=TIMER_LIBRARY, output_dir="output"):
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = []
+    for duration in durations:
+        output_filename = os.path.join(output_dir, f"timer_clock_{duration}Sec.mp4")
+        generate_timer(duration, output_filename)
+        outputs.append(output_filename)
+    return outputs
 
-# Save the video to a file with the configured FPS
-output_filename = "output/timer_clock_30Sec.mp4"
-animation.write_videofile(output_filename, fps=FPS, codec="libx264", bitrate="5000k", audio_codec="aac")
 
-print(f"Timer video with background music and custom font saved as {output_filename}")
+if __name__ == "__main__":
+    generate_timer_library()
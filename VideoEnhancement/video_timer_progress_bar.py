@@ -1,11 +1,13 @@
 import json
-import numpy as np
-import matplotlib.pyplot as plt
+import os
+import sys
 from moviepy.editor import VideoClip, AudioFileClip, CompositeAudioClip
-from moviepy.video.io.bindings import mplfig_to_npimage
 import moviepy.audio.fx.all as afx
 import moviepy.video.fx.all as vfx  # Import the video effects
-from matplotlib.font_manager import FontProperties  # For custom fonts
+from matplotlib.font_manager import FontProperties, findfont  # For custom fonts
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "CommonUtils"))
+from timer_frames import timer_frame_maker
 
 # Load configuration from config.json
 with open('config/timer_progress_bar_config.json', 'r') as config_file:
@@ -21,50 +23,24 @@ DIGIT_FONT_TYPE = config["DIGIT_FONT_TYPE"]  # New font type from config
 BACKGROUND_MUSIC = config["BACKGROUND_MUSIC"]
 FPS = config["FPS"]
 
-# High DPI setting for higher quality graphics
-DPI = 300  # Higher DPI for better resolution
+# Font sizes are in points at this DPI
+DPI = 300
 MUSIC_VOLUME = config.get("MUSIC_VOLUME", 0.3)  # Default volume level at 30%
 FADEOUT_DURATION = 3  # Background music fade out in the last 3 seconds
 
 
-# Function to create the progress bar animation for the timer
-def make_frame(t):
-    # Normalize time (0 to 1)
-    progress = t / TIMER_DURATION
-
-    # Set up the plot with a wider aspect ratio (fullscreen progress bar)
-    fig, ax = plt.subplots(figsize=(VIDEO_SIZE / DPI, VIDEO_SIZE / DPI / 12), dpi=DPI)  # Adjust ratio for horizontal bar
-    ax.set_xlim(0, 1)
-    ax.set_ylim(0, 1)
-    ax.set_xticks([])  # Remove x-axis labels
-    ax.set_yticks([])  # Remove y-axis labels
-
-    # Remove frame lines (spines)
-    ax.spines['top'].set_visible(False)
-    ax.spines['right'].set_visible(False)
-    ax.spines['left'].set_visible(False)
-    ax.spines['bottom'].set_visible(False)
-
-    # Draw the background for the progress bar
-    ax.barh(0.5, 1, height=0.9, color=BACKGROUND_COLOR, align='center')  # Full background bar
-
-    # Draw the foreground (progress) bar with configurable progress
-    ax.barh(0.5, progress, height=0.9, color=FOREGROUND_COLOR, align='center')  # Foreground progress bar
-
-    # Define the font properties and scale it relative to the frame size
-    font_properties = FontProperties(family=DIGIT_FONT_TYPE, size=DIGIT_FONT_SIZE * (VIDEO_SIZE / 800))  # Adjust font size
-
-    # Correct placement of countdown text
-    time_left = max(0, TIMER_DURATION - t)  # Ensure time_left is defined before use
-    ax.text(0.5, 0.4, f"{int(time_left)}", ha='center', va='center', color=DIGIT_COLOR, fontproperties=font_properties)
-
-    # Adjust layout to remove margins
-    plt.subplots_adjust(left=0, right=1, top=1, bottom=0)
+# Frame renderer for the progress bar: a VIDEO_SIZE x VIDEO_SIZE/12 strip on a white canvas, with the bar 0.9 of
+# the height and the countdown centered at 40% from the bottom
+font_path = findfont(FontProperties(family=DIGIT_FONT_TYPE))
+font_size = DIGIT_FONT_SIZE * (VIDEO_SIZE / 800) * DPI / 72  # Adjust font size
 
-    # Convert the matplotlib figure to an image frame
-    img = mplfig_to_npimage(fig)
-    plt.close(fig)  # Close the figure to free up memory
-    return img
+make_frame = timer_frame_maker(
+    VIDEO_SIZE, int(VIDEO_SIZE / 12), TIMER_DURATION,
+    BACKGROUND_COLOR, FOREGROUND_COLOR, DIGIT_COLOR,
+    font_path, font_size,
+    canvas_color="white",
+    text_center=(0.5, 0.6),
+)
 
 
 # Create the video